@@ -1,5 +1,5 @@
 from flask import Flask, session, redirect, url_for,flash
-from routes import index, download, downs, interfaces, sessions
+from routes import index, download, downs, interfaces, sessions, health, storage, metrics
 import os
 
 app = Flask(__name__)
@@ -9,12 +9,36 @@ BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 DOWNLOAD_FOLDER = os.path.join(BASE_DIR, "downloads")
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
+# Base de datos, yt_dlp y herramientas externas se preparan en segundo plano:
+# el worker empieza a aceptar peticiones sin esperarlas. El janitor de
+# descargas aplica TTL y cuotas fuera de las peticiones.
+health.start_warmup(download.FFMPEG_PATH)
+storage.start_janitor()
+
+@app.before_request
+def ensure_warmup():
+    # Con gunicorn --preload los hilos de fondo no sobreviven al fork
+    health.start_warmup(download.FFMPEG_PATH)
+    storage.start_janitor()
+
 def limpiar_carpeta():
     for archivo in os.listdir(DOWNLOAD_FOLDER):
         archivo_path = os.path.join(DOWNLOAD_FOLDER, archivo)
         if os.path.isfile(archivo_path):
             os.remove(archivo_path)
 
+@app.route("/healthz")
+def healthz_route():
+    return health.healthz()
+
+@app.route("/readyz")
+def readyz_route():
+    return health.readyz()
+
+@app.route("/metrics")
+def metrics_route():
+    return metrics.metrics_endpoint()
+
 @app.route("/")
 def index_route():
     return index.index()
@@ -59,11 +83,51 @@ def download_youtube():
     session_user = session.get('user')
     return download.download_ytdl(session_user)
 
+@app.route('/jobs/<job_id>')
+def job_status_route(job_id):
+    session_user = session.get('user')
+    return download.job_status(session_user, job_id)
+
+@app.route('/jobs/<job_id>/events')
+def job_events_route(job_id):
+    session_user = session.get('user')
+    return download.job_events(session_user, job_id)
+
+@app.route('/history')
+def history_route():
+    session_user = session.get('user')
+    return download.download_history(session_user)
+
+@app.route('/history/stats')
+def history_stats_route():
+    session_user = session.get('user')
+    return download.download_history_stats(session_user)
+
+@app.route('/history', methods=["DELETE"])
+def delete_history_route():
+    session_user = session.get('user')
+    return download.delete_download_history(session_user)
+
+@app.route('/history/<int:download_id>', methods=["DELETE"])
+def delete_history_entry_route(download_id):
+    session_user = session.get('user')
+    return download.delete_download_history(session_user, download_id)
+
+@app.route('/stream')
+def stream_route():
+    session_user = session.get('user')
+    return download.stream_audio(session_user)
+
 @app.route("/descargar")
 def descargar_archivo():
     session_user = session.get('user')
     return downs.descargar_archivo(session_user)
 
+@app.route("/descargar/<filename>")
+def descargar_archivo_nombre(filename):
+    session_user = session.get('user')
+    return downs.descargar_archivo(session_user, filename)
+
 @app.route("/descargar_todo")
 def descargar_todo():
     session_user = session.get('user')
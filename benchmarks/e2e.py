@@ -0,0 +1,333 @@
+"""Benchmark de extremo a extremo de la aplicación, sin red
+
+Ejecuta la aplicación Flask completa (rutas, cola de trabajos, caché,
+historial y entrega de archivos) contra orígenes de audio locales:
+
+- un servidor HTTP local sirve un WAV generado (un tono de --seconds segundos);
+- un extractor de yt-dlp atiende las URLs de YouTube (con IDs aleatorios) y
+  devuelve ese WAV como único formato, así que la aplicación calcula claves de
+  caché, pre-flight y post-procesado igual que con YouTube;
+- el proceso de spotdl se sustituye por benchmarks/fake_spotdl.py, que habla
+  el mismo protocolo, descarga el WAV y lo convierte con ffmpeg;
+- la base de datos es SQLite (DB_BACKEND=sqlite) en un archivo temporal.
+
+Escenarios, cada uno con --concurrency clientes (un usuario por cliente):
+
+- ytdl: POST /download-ytdl de --tracks canciones nuevas hasta que el trabajo termina
+- spotdl: lo mismo con /download-spdl
+- cache_hit: otros usuarios piden las canciones de ytdl (servidas desde la caché)
+- descargar: GET /descargar (último archivo del usuario)
+- descargar_todo: GET /descargar_todo (ZIP de la carpeta del usuario)
+
+Para cada escenario se mide peticiones/s, latencia p50/p99, segundos de CPU
+por petición (este proceso más los hijos terminados: ffmpeg y los procesos de
+spotdl) y la memoria máxima (RSS). Las peticiones pasan por el cliente de
+pruebas de Flask: se mide la aplicación, no el servidor WSGI.
+
+Requiere ffmpeg en el PATH. Los usuarios, sus carpetas y las entradas de caché
+creadas se eliminan al terminar.
+
+Uso:
+    python benchmarks/e2e.py [--tracks 20] [--concurrency 4] [--workers 4] [--seconds 10] [--output e2e.json]
+"""
+import os
+import io
+import sys
+import json
+import math
+import time
+import uuid
+import wave
+import array
+import queue
+import random
+import shutil
+import string
+import argparse
+import resource
+import tempfile
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+FAKE_SPOTDL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_spotdl.py")
+SAMPLE_RATE = 44100
+PASSWORD = "benchmark-password"
+POLL_INTERVAL = 0.05  # Segundos entre consultas de /jobs/<id>
+JOB_TIMEOUT = 300
+
+class KeepAliveHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Los clientes cerrados cortan conexiones keep-alive; no es un error
+        pass
+
+def start_server(folder):
+    handler = lambda *args, **kwargs: KeepAliveHandler(*args, directory=folder, **kwargs)
+    server = QuietServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def generate_wav(seconds):
+    """WAV mono de 16 bits con un tono de 440 Hz"""
+    samples = array.array("h", (
+        int(12000 * math.sin(2 * math.pi * 440 * i / SAMPLE_RATE)) for i in range(int(seconds * SAMPLE_RATE))
+    ))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+def register_extractor(media_url, seconds, filesize):
+    """Antepone a los extractores de yt-dlp uno que resuelve YouTube al servidor local"""
+    from yt_dlp.extractor import import_extractors
+    from yt_dlp.extractor.common import InfoExtractor
+    from yt_dlp.globals import extractors
+
+    class BenchmarkYoutubeIE(InfoExtractor):
+        IE_NAME = "benchmark"
+        _VALID_URL = r"https?://(?:www\.)?youtube\.com/watch\?v=(?P<id>[0-9A-Za-z_-]{11})"
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            return {
+                "id": video_id,
+                # Mismo extractor que YouTube: la clave canónica coincide con la de la URL
+                "extractor_key": "Youtube",
+                "title": f"Benchmark {video_id}",
+                "uploader": "Benchmark",
+                "duration": seconds,
+                "formats": [{
+                    "format_id": "wav",
+                    "url": f"{media_url}/track.wav?id={video_id}",
+                    "ext": "wav",
+                    "acodec": "pcm_s16le",
+                    "vcodec": "none",
+                    "filesize": filesize,
+                }],
+            }
+
+    import_extractors()
+    extractors.value = {BenchmarkYoutubeIE.__name__: BenchmarkYoutubeIE, **extractors.value}
+
+def random_id(length, alphabet=string.ascii_letters + string.digits):
+    return "".join(random.choice(alphabet) for _ in range(length))
+
+def make_client(app, username):
+    """Cliente de pruebas con la sesión de un usuario recién registrado"""
+    client = app.test_client()
+    client.post("/register", data={
+        "username": username,
+        "email": f"{username}@benchmark.local",
+        "password": PASSWORD,
+        "password2": PASSWORD,
+    })
+    with client.session_transaction() as session:
+        if "user" not in session:
+            raise SystemExit(f"No se pudo registrar el usuario {username}")
+    return client
+
+def download_track(client, endpoint, url, audio_format):
+    """Pide una descarga y espera a que termine
+
+    Returns:
+        str: "cache" si se sirvió de inmediato, "success" o "failed"
+    """
+    response = client.post(endpoint, json={"url": url, "format": audio_format})
+    if response.status_code == 200:
+        return "cache"
+    if response.status_code != 202:
+        return "failed"
+    status_url = response.get_json()["status_url"]
+    deadline = time.monotonic() + JOB_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        status = client.get(status_url).get_json()["status"]
+        if status in ("success", "failed"):
+            return status
+    return "failed"
+
+def fetch(client, path):
+    """GET que consume la respuesta entera; devuelve el código de estado"""
+    response = client.get(path)
+    try:
+        response.get_data()
+        return response.status_code
+    finally:
+        response.close()
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def run_scenario(name, clients, items, operation, expected, reap=None):
+    """Reparte items entre los clientes (uno por hilo) y mide cada operación
+
+    Args:
+        operation: Función (cliente, item) -> resultado
+        expected: Resultados que cuentan como éxito
+        reap: Función llamada al terminar para esperar a los procesos hijos
+    """
+    work = queue.Queue()
+    for item in items:
+        work.put(item)
+    timings, errors = [], []
+    lock = threading.Lock()
+
+    def worker(client):
+        while True:
+            try:
+                item = work.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            result = operation(client, item)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                timings.append(elapsed)
+                if result not in expected:
+                    errors.append(result)
+
+    cpu_start = cpu_seconds()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+        list(pool.map(worker, clients))
+    elapsed = time.perf_counter() - start
+    if reap:
+        reap()
+    cpu = cpu_seconds() - cpu_start
+
+    timings.sort()
+    return {
+        "scenario": name,
+        "requests": len(timings),
+        "errors": len(errors),
+        "concurrency": len(clients),
+        "wall_s": round(elapsed, 3),
+        "requests_per_s": round(len(timings) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(statistics.mean(timings), 2) if timings else None,
+        "p50_ms": round(statistics.median(timings), 2) if timings else None,
+        "p99_ms": round(statistics.quantiles(timings, n=100)[98], 2) if len(timings) > 1 else None,
+        "cpu_s": round(cpu, 3),
+        "cpu_s_per_request": round(cpu / len(timings), 4) if timings else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tracks", type=int, default=20, help="Canciones por escenario de descarga")
+    parser.add_argument("--concurrency", type=int, default=4, help="Clientes simultáneos")
+    parser.add_argument("--workers", type=int, default=4, help="MAX_WORKERS de la aplicación")
+    parser.add_argument("--seconds", type=float, default=10, help="Duración del audio generado")
+    parser.add_argument("--requests", type=int, default=50, help="Peticiones de /descargar y /descargar_todo")
+    parser.add_argument("--format", default="mp3", help="Formato de entrega pedido")
+    parser.add_argument("--output", help="Archivo donde guardar el JSON (además de imprimirlo)")
+    args = parser.parse_args()
+
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        parser.error("Se necesita ffmpeg en el PATH")
+
+    # stdout queda reservado para el JSON; lo que imprima yt-dlp (progreso) va a stderr
+    output = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    workdir = tempfile.mkdtemp()
+    # La configuración se lee al importar la aplicación
+    os.environ["DB_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = os.path.join(workdir, "benchmark.db")
+    os.environ["MAX_WORKERS"] = str(args.workers)
+
+    # yt_dlp se importa antes que la aplicación: su warm-up lo importa en otro hilo
+    import yt_dlp  # noqa: F401
+    from app import app
+    from routes import download, spotdl_engine, cache, ydl_pool
+
+    media_folder = os.path.join(workdir, "media")
+    os.makedirs(media_folder)
+    audio = generate_wav(args.seconds)
+    with open(os.path.join(media_folder, "track.wav"), "wb") as f:
+        f.write(audio)
+    server = start_server(media_folder)
+    media_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    register_extractor(media_url, args.seconds, len(audio))
+    download.FFMPEG_PATH = ffmpeg
+    # yt-dlp guarda las cookies al cerrar: se usa una copia para no tocar cookies.txt
+    cookiefile = os.path.join(workdir, "cookies.txt")
+    shutil.copy(download.COOKIES_FILE, cookiefile)
+    download.COOKIES_FILE = cookiefile
+    os.environ["BENCH_MEDIA_URL"] = media_url
+    spotdl_engine.ENGINE_COMMAND = [sys.executable, FAKE_SPOTDL]
+
+    run_id = uuid.uuid4().hex[:8]
+    usernames = [f"bench{run_id}u{i}" for i in range(args.concurrency * 2)]
+    youtube_urls = [f"https://www.youtube.com/watch?v={random_id(11)}" for _ in range(args.tracks)]
+    spotify_urls = [f"https://open.spotify.com/track/{random_id(22)}" for _ in range(args.tracks)]
+    try:
+        clients = [make_client(app, username) for username in usernames]
+        owners, others = clients[:args.concurrency], clients[args.concurrency:]
+
+        def ytdl(client, url):
+            return download_track(client, "/download-ytdl", url, args.format)
+
+        def spotdl(client, url):
+            return download_track(client, "/download-spdl", url, args.format)
+
+        results = [
+            run_scenario("ytdl", owners, youtube_urls, ytdl, {"success"}),
+            # Los procesos de spotdl se cierran para que su CPU cuente en RUSAGE_CHILDREN
+            run_scenario("spotdl", owners, spotify_urls, spotdl, {"success"}, reap=spotdl_engine.close_all),
+            run_scenario("cache_hit", others, youtube_urls, ytdl, {"cache"}),
+            run_scenario("descargar", owners, range(args.requests),
+                         lambda client, _: fetch(client, "/descargar"), {200}),
+            run_scenario("descargar_todo", owners, range(args.requests),
+                         lambda client, _: fetch(client, "/descargar_todo"), {200}),
+        ]
+        report = {
+            "config": {
+                "tracks": args.tracks,
+                "concurrency": args.concurrency,
+                "workers": args.workers,
+                "audio_seconds": args.seconds,
+                "audio_bytes": len(audio),
+                "format": args.format,
+                "ffmpeg": ffmpeg,
+            },
+            "results": results,
+        }
+        print(json.dumps(report, indent=2), file=output, flush=True)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=2)
+    finally:
+        # Las instancias de YoutubeDL guardan las cookies al cerrarse: antes de borrar workdir
+        ydl_pool.close_all()
+        spotdl_engine.close_all()
+        server.shutdown()
+        for username in usernames:
+            shutil.rmtree(os.path.join(download.DOWNLOAD_FOLDER, username), ignore_errors=True)
+        for url in youtube_urls:
+            cache.evict_entry(cache.get_cache_key(url, *download.ytdl_cache_params(args.format)))
+        for url in spotify_urls:
+            cache.evict_entry(cache.get_cache_key(url, *download.spotdl_cache_params(args.format)))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
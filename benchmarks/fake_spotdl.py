@@ -0,0 +1,57 @@
+"""Motor de spotdl falso para los benchmarks (sin red ni credenciales de Spotify)
+
+Habla el mismo protocolo de líneas JSON que routes.spotdl_engine: recibe una
+petición por línea en stdin y responde con mensajes [tipo, datos] en stdout.
+Cada canción se descarga del servidor de medios local (BENCH_MEDIA_URL) y se
+convierte con el ffmpeg de la petición, como haría spotdl tras buscar el audio
+en YouTube.
+
+No se ejecuta a mano: benchmarks/e2e.py lo usa como
+routes.spotdl_engine.ENGINE_COMMAND.
+"""
+import os
+import sys
+import json
+import shutil
+import subprocess
+import urllib.request
+
+MEDIA_URL = os.environ.get("BENCH_MEDIA_URL", "")
+
+def download(request, send):
+    track_id = request["url"].rstrip("/").split("/")[-1].split(":")[-1].split("?")[0]
+    send("progress", {"song": track_id, "message": "Searching for song", "progress": 0})
+    send("progress", {"song": track_id, "message": "Downloading", "progress": 10})
+    source = os.path.join(request["output"], f".{track_id}.wav")
+    with urllib.request.urlopen(f"{MEDIA_URL}/track.wav?id={track_id}") as response, open(source, "wb") as f:
+        shutil.copyfileobj(response, f)
+
+    send("progress", {"song": track_id, "message": "Converting", "progress": 50})
+    path = os.path.join(request["output"], f"Benchmark - {track_id}.{request['format']}")
+    command = [request["ffmpeg"], "-y", "-loglevel", "error", "-i", source, "-vn"]
+    if request["bitrate"] not in (None, "disable"):
+        command += ["-b:a", request["bitrate"]]
+    subprocess.run(command + [path], check=True, stdin=subprocess.DEVNULL)
+    os.remove(source)
+    send("progress", {"song": track_id, "message": "Done", "progress": 100})
+    return {"files": [path], "errors": []}
+
+def main():
+    messages = sys.stdout
+
+    def send(kind, payload):
+        messages.write(json.dumps([kind, payload]) + "\n")
+        messages.flush()
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        if request.get("action") == "expand":
+            send("error", {"message": "El motor de benchmark no expande playlists"})
+            continue
+        try:
+            send("done", download(request, send))
+        except Exception as e:
+            send("error", {"message": str(e)})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Benchmark de ocupación de workers al servir archivos detrás de nginx
+
+Levanta gunicorn (workers síncronos) detrás de un nginx local y descarga un
+archivo con varios clientes lentos a la vez, primero con FILE_DELIVERY=send_file
+y después con FILE_DELIVERY=x-accel. Mientras tanto mide la latencia de una
+petición trivial (/ping): con send_file los workers quedan ocupados empujando
+bytes hacia los clientes lentos y /ping espera; con X-Accel-Redirect el worker
+responde en milisegundos y nginx envía el archivo.
+
+nginx se configura con proxy_max_temp_file_size 0 (sin volcar respuestas a
+disco), que es lo habitual con archivos grandes; con buffering a disco nginx
+absorbería la respuesta, pero cada byte seguiría pasando por Python y por el
+disco temporal.
+
+Requiere nginx y gunicorn en el PATH. No usa la base de datos.
+
+Uso:
+    python benchmarks/file_delivery.py [--clients 4] [--workers 2] [--size-mb 16] [--rate-kb 2048]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import statistics
+import threading
+import subprocess
+import http.client
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from flask import Flask
+from routes import delivery
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# Carpeta temporal con el archivo del benchmark (no se toca downloads/): la crea
+# el proceso principal y gunicorn la recibe en BENCH_DOWNLOAD_FOLDER
+BENCH_FOLDER = os.getenv("BENCH_DOWNLOAD_FOLDER")
+if BENCH_FOLDER:
+    # accel_uri resuelve las rutas respecto a la carpeta de descargas
+    delivery.DOWNLOAD_FOLDER = BENCH_FOLDER
+
+# Aplicación mínima que gunicorn carga como benchmarks.file_delivery:app
+app = Flask(__name__)
+
+@app.route("/file")
+def file_route():
+    return delivery.send_download(os.path.join(BENCH_FOLDER, "track.mp3"), "track.mp3", "audio/mpeg")
+
+@app.route("/ping")
+def ping_route():
+    return "pong"
+
+NGINX_CONF = """
+worker_processes 1;
+daemon off;
+pid {workdir}/nginx.pid;
+error_log {workdir}/nginx-error.log warn;
+events {{ worker_connections 1024; }}
+http {{
+    access_log off;
+    client_body_temp_path {workdir}/client_body;
+    proxy_temp_path {workdir}/proxy;
+    fastcgi_temp_path {workdir}/fastcgi;
+    uwsgi_temp_path {workdir}/uwsgi;
+    scgi_temp_path {workdir}/scgi;
+    server {{
+        listen 127.0.0.1:{nginx_port};
+        location {prefix} {{
+            internal;
+            alias {download_folder}/;
+        }}
+        location / {{
+            proxy_pass http://127.0.0.1:{app_port};
+            proxy_max_temp_file_size 0;
+        }}
+    }}
+}}
+"""
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"El puerto {port} no respondió")
+
+def slow_download(port, rate, results):
+    """Descarga /file leyendo a como mucho `rate` bytes por segundo"""
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    conn.request("GET", "/file")
+    response = conn.getresponse()
+    received = 0
+    while True:
+        chunk = response.read(64 * 1024)
+        if not chunk:
+            break
+        received += len(chunk)
+        ahead = received / rate - (time.perf_counter() - start)
+        if ahead > 0:
+            time.sleep(ahead)
+    conn.close()
+    results.append({"status": response.status, "bytes": received, "seconds": time.perf_counter() - start})
+
+def probe(port, stop, latencies):
+    """Mide la latencia de /ping mientras duran las descargas"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        conn.request("GET", "/ping")
+        conn.getresponse().read()
+        conn.close()
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.1)
+
+def worker_busy_seconds(access_log):
+    """Tiempo que los workers pasaron atendiendo /file (según el access log de gunicorn)"""
+    busy = []
+    with open(access_log) as f:
+        for line in f:
+            path, micros = line.split()
+            if path == "/file":
+                busy.append(int(micros) / 1_000_000)
+    return busy
+
+def run(mode, args, workdir, download_folder):
+    app_port, nginx_port = free_port(), free_port()
+    access_log = os.path.join(workdir, f"gunicorn-{mode}.log")
+    env = dict(os.environ, FILE_DELIVERY=mode, BENCH_DOWNLOAD_FOLDER=download_folder)
+    gunicorn = subprocess.Popen(
+        ["gunicorn", "--chdir", BASE_DIR, "-w", str(args.workers), "-b", f"127.0.0.1:{app_port}",
+         "--access-logfile", access_log, "--access-logformat", "%(U)s %(D)s",
+         "benchmarks.file_delivery:app"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    conf = os.path.join(workdir, f"nginx-{mode}.conf")
+    with open(conf, "w") as f:
+        f.write(NGINX_CONF.format(
+            workdir=workdir, nginx_port=nginx_port, app_port=app_port,
+            prefix=delivery.X_ACCEL_PREFIX, download_folder=download_folder
+        ))
+    nginx = subprocess.Popen(["nginx", "-p", workdir, "-c", conf],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(app_port)
+        wait_for_port(nginx_port)
+
+        downloads, latencies = [], []
+        stop = threading.Event()
+        prober = threading.Thread(target=probe, args=(nginx_port, stop, latencies))
+        clients = [threading.Thread(target=slow_download, args=(nginx_port, args.rate_kb * 1024, downloads))
+                   for _ in range(args.clients)]
+        start = time.perf_counter()
+        prober.start()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        wall = time.perf_counter() - start
+        stop.set()
+        prober.join()
+    finally:
+        nginx.terminate()
+        gunicorn.terminate()
+        nginx.wait()
+        gunicorn.wait()
+
+    busy = worker_busy_seconds(access_log)
+    return {
+        "mode": mode,
+        "clients": args.clients,
+        "workers": args.workers,
+        "downloads_ok": sum(1 for d in downloads if d["status"] == 200 and d["bytes"] == args.size_mb * 1024 * 1024),
+        "wall_s": round(wall, 2),
+        "worker_busy_per_download_s": round(statistics.mean(busy), 3) if busy else None,
+        "worker_occupancy": round(sum(busy) / (args.workers * wall), 3),
+        "ping_p50_ms": round(statistics.median(latencies), 2),
+        "ping_max_ms": round(max(latencies), 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--size-mb", type=int, default=16)
+    parser.add_argument("--rate-kb", type=int, default=2048, help="Velocidad de cada cliente (KB/s)")
+    args = parser.parse_args()
+
+    for tool in ("nginx", "gunicorn"):
+        if not shutil.which(tool):
+            sys.exit(f"{tool} no está instalado o no está en el PATH")
+
+    workdir = tempfile.mkdtemp()
+    download_folder = os.path.join(workdir, "downloads")
+    os.makedirs(download_folder)
+    try:
+        with open(os.path.join(download_folder, "track.mp3"), "wb") as f:
+            f.write(os.urandom(args.size_mb * 1024 * 1024))
+        results = [run(mode, args, workdir, download_folder) for mode in ("send_file", "x-accel")]
+        print(json.dumps(results, indent=2))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
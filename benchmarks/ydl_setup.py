@@ -0,0 +1,121 @@
+"""Benchmark del coste de preparación de yt-dlp por trabajo
+
+Compara crear un YoutubeDL nuevo en cada trabajo (comportamiento anterior)
+con reutilizar la instancia del hilo mediante routes.ydl_pool. Cada trabajo
+resuelve y descarga un audio servido por un servidor HTTP local, así que no
+necesita red; tcp_connections muestra la reutilización de conexiones keep-alive.
+
+Uso:
+    python benchmarks/ydl_setup.py [--jobs 50]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import threading
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import yt_dlp
+from routes.ydl_pool import pooled_ydl, close_all
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+class KeepAliveHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self):
+        KeepAliveHandler.connections += 1
+        super().setup()
+
+    def log_message(self, *args):
+        pass
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Los clientes cerrados cortan conexiones keep-alive; no es un error
+        pass
+
+def start_server(folder):
+    handler = lambda *args, **kwargs: KeepAliveHandler(*args, directory=folder, **kwargs)
+    server = QuietServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def make_opts(cookiefile):
+    """Opciones de red y extracción equivalentes a routes.download.optimize_ydl_opts
+
+    Sin post-procesadores: el benchmark mide la preparación y la red, no ffmpeg.
+    """
+    return {
+        "format": "bestaudio[ext=m4a]/bestaudio/best",
+        "outtmpl": "%(title)s.%(ext)s",
+        "overwrites": True,
+        "quiet": True,
+        "noprogress": True,
+        "no_warnings": True,
+        "noplaylist": True,
+        "cookiefile": cookiefile,
+        "socket_timeout": 30,
+    }
+
+def run(label, jobs, job):
+    timings = []
+    KeepAliveHandler.connections = 0
+    for _ in range(jobs):
+        start = time.perf_counter()
+        job()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "mode": label,
+        "jobs": jobs,
+        "mean_ms": round(statistics.mean(timings), 2),
+        "p50_ms": round(statistics.median(timings), 2),
+        "first_ms": round(timings[0], 2),
+        "tcp_connections": KeepAliveHandler.connections,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(workdir, "audio.m4a"), "wb") as f:
+            # El extractor genérico solo lee los primeros 512 bytes; un archivo
+            # más pequeño se consume entero y la conexión puede reutilizarse
+            f.write(os.urandom(400))
+        cookiefile = os.path.join(workdir, "cookies.txt")
+        shutil.copy(os.path.join(BASE_DIR, "cookies.txt"), cookiefile)
+
+        server = start_server(workdir)
+        url = f"http://127.0.0.1:{server.server_address[1]}/audio.m4a"
+        outdir = os.path.join(workdir, "out")
+        opts = make_opts(cookiefile)
+
+        def fresh_job():
+            with yt_dlp.YoutubeDL({**opts, "paths": {"home": outdir}}) as ydl:
+                ydl.extract_info(url, download=True)
+
+        def pooled_job():
+            with pooled_ydl(opts, outdir) as ydl:
+                ydl.extract_info(url, download=True)
+
+        results = [run("fresh", args.jobs, fresh_job), run("pooled", args.jobs, pooled_job)]
+        close_all()
+        server.shutdown()
+        print(json.dumps(results, indent=2))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
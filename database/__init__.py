@@ -1,4 +1,4 @@
-from .core import DatabaseManager, DatabaseError
+from .core import DatabaseManager, DatabaseError, DuplicateKeyError
 
 # Crear una instancia global del DatabaseManager
 db = DatabaseManager()
@@ -6,4 +6,4 @@ db = DatabaseManager()
 # Importar después de crear db para evitar importación circular
 from .setup import init_db, register_download
 
-__all__ = ['db', 'DatabaseError', 'DatabaseManager', 'init_db', 'register_download']
+__all__ = ['db', 'DatabaseError', 'DuplicateKeyError', 'DatabaseManager', 'init_db', 'register_download']
@@ -1,7 +1,11 @@
 import mysql.connector
-from mysql.connector import Error, pooling
+from mysql.connector import Error, errorcode, pooling
 from contextlib import contextmanager
+from collections import OrderedDict
 import os
+import random
+import sqlite3
+import threading
 import logging
 from dotenv import load_dotenv
 from functools import wraps
@@ -11,6 +15,25 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
+
+# Motor de base de datos: mysql (servidor remoto) o sqlite (un solo nodo, pruebas sin servidor)
+DB_BACKENDS = ("mysql", "sqlite")
+DB_BACKEND = os.getenv('DB_BACKEND', 'mysql').strip().lower()
+
+# Hilos que usan la base de datos a la vez: descargas en segundo plano
+# (MAX_WORKERS, el mismo valor que usa routes.download), hilos que atienden
+# peticiones (WEB_THREADS) y el escritor del historial
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', '4'))
+WEB_THREADS = int(os.getenv('WEB_THREADS', '4'))
+MAX_POOL_SIZE = 32  # Máximo que admite mysql.connector
+DB_POOL_SIZE = min(int(os.getenv('DB_POOL_SIZE') or MAX_WORKERS + WEB_THREADS + 1), MAX_POOL_SIZE)
+# Segundos máximos esperando una conexión libre del pool
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# Reintentos ante errores transitorios, con espera exponencial y jitter
+DB_MAX_RETRIES = int(os.getenv('DB_MAX_RETRIES', '3'))
+DB_RETRY_BASE_DELAY = float(os.getenv('DB_RETRY_BASE_DELAY', '0.1'))
+DB_RETRY_MAX_DELAY = float(os.getenv('DB_RETRY_MAX_DELAY', '2'))
+
 DB_CONFIG = {
     'host': os.getenv('DB_HOST', 'bvkqasbg866s0wttyamf-mysql.services.clever-cloud.com'),
     'user': os.getenv('DB_USER', 'uiovaybiektnjsrq'),
@@ -18,7 +41,7 @@ DB_CONFIG = {
     'database': os.getenv('DB_NAME', 'bvkqasbg866s0wttyamf'),
     'port': int(os.getenv('DB_PORT', '1020748662')),
     'pool_name': 'mypool',
-    'pool_size': 3,  # Reduced pool size for better stability
+    'pool_size': DB_POOL_SIZE,
     'connect_timeout': 30,  # Increased timeout
     'connection_timeout': 30,  # Additional timeout setting
     'time_zone': '+00:00',
@@ -29,43 +52,300 @@ DB_CONFIG = {
     'consume_results': True  # Consume results automatically
 }
 
+# Columnas con índice UNIQUE que se informan en DuplicateKeyError
+UNIQUE_COLUMNS = ("username", "email", "job_id")
+# Usuarios leídos recientemente que se sirven sin consultar la base de datos
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '30'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1000'))
+
+# Errores que pueden desaparecer al reintentar (conexión caída, bloqueos)
+TRANSIENT_ERRORS = {
+    errorcode.CR_CONNECTION_ERROR,
+    errorcode.CR_CONN_HOST_ERROR,
+    errorcode.CR_SERVER_GONE_ERROR,
+    errorcode.CR_SERVER_LOST,
+    errorcode.CR_SERVER_LOST_EXTENDED,
+    errorcode.ER_CON_COUNT_ERROR,
+    errorcode.ER_LOCK_DEADLOCK,
+    errorcode.ER_LOCK_WAIT_TIMEOUT,
+    errorcode.ER_CLIENT_INTERACTION_TIMEOUT,
+}
+
 class DatabaseError(Exception):
     """Excepción personalizada para errores de base de datos"""
     pass
 
-def retry_on_error(max_retries=3, delay=1):
-    """Decorador para reintentar operaciones de base de datos"""
+class PoolTimeoutError(DatabaseError):
+    """No se liberó ninguna conexión del pool antes de DB_POOL_TIMEOUT"""
+    pass
+
+class DuplicateKeyError(DatabaseError):
+    """Un INSERT/UPDATE chocó con un índice UNIQUE
+
+    Attributes:
+        field: Columna duplicada ('username', 'email', ...) o None si no se reconoce
+    """
+    def __init__(self, message, field=None):
+        super().__init__(message)
+        self.field = field
+
+def duplicate_key_error(error):
+    """DuplicateKeyError a partir del mensaje de MySQL o SQLite
+
+    MySQL: "Duplicate entry 'x' for key 'USER.idx_username'"
+    SQLite: "UNIQUE constraint failed: USER.username"
+    """
+    message = str(error)
+    key = message.rsplit("for key", 1)[-1] if "for key" in message else message.rsplit(":", 1)[-1]
+    field = next((column for column in UNIQUE_COLUMNS if column in key), None)
+    return DuplicateKeyError(f"Duplicate key: {message}", field)
+
+def is_transient_error(error):
+    """Indica si un error (o el error de MySQL/SQLite que lo causó) es transitorio"""
+    while error is not None:
+        if isinstance(error, Error):
+            return error.errno in TRANSIENT_ERRORS
+        if isinstance(error, sqlite3.OperationalError):
+            # Otra conexión tiene el archivo bloqueado más allá de busy_timeout
+            return "locked" in str(error) or "busy" in str(error)
+        error = error.__cause__
+    return False
+
+def retry_on_error(max_retries=DB_MAX_RETRIES):
+    """Decorador para reintentar operaciones de base de datos
+
+    Solo se reintentan los errores transitorios, esperando entre intentos un
+    tiempo exponencial con jitter. Se aplica en una única capa (las
+    primitivas que abren conexión), así que una consulta se intenta como
+    mucho max_retries + 1 veces.
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            retries = 0
-            while retries < max_retries:
+            attempt = 0
+            while True:
                 try:
                     return func(*args, **kwargs)
-                except Error as e:
-                    retries += 1
-                    if retries == max_retries:
-                        raise DatabaseError(f"Max retries reached: {e}")
-                    logger.warning(f"Database operation failed, retrying... ({retries}/{max_retries})")
+                except (Error, DatabaseError) as e:
+                    if not is_transient_error(e):
+                        if isinstance(e, DatabaseError):
+                            raise
+                        raise DatabaseError(str(e)) from e
+                    if attempt >= max_retries:
+                        raise DatabaseError(f"Max retries reached: {e}") from e
+                    attempt += 1
+                    pool_metrics.retried()
+                    delay = random.uniform(0, min(DB_RETRY_MAX_DELAY, DB_RETRY_BASE_DELAY * 2 ** attempt))
+                    logger.warning(f"Database operation failed, retrying in {delay:.2f}s... ({attempt}/{max_retries}): {e}")
                     time.sleep(delay)
-            return None
         return wrapper
     return decorator
 
+class PoolMetrics:
+    """Métricas del pool de conexiones (las expone DatabaseManager.pool_stats)"""
+
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self.size = size
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.acquisitions = 0
+        self.waits = 0  # Adquisiciones que encontraron el pool lleno
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0  # Adquisiciones que superaron DB_POOL_TIMEOUT
+        self.retries = 0
+        self._wait_observers = []
+
+    def add_wait_observer(self, callback):
+        """Llama a callback(segundos) con la espera de cada adquisición (p. ej. para un histograma)"""
+        self._wait_observers.append(callback)
+
+    def _observe_wait(self, seconds):
+        for callback in self._wait_observers:
+            callback(seconds)
+
+    def acquired(self, waited, seconds):
+        with self._lock:
+            self.acquisitions += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            if waited:
+                self.waits += 1
+                self.wait_seconds += seconds
+                self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+        self._observe_wait(seconds if waited else 0.0)
+
+    def released(self):
+        with self._lock:
+            self.in_use -= 1
+
+    def timed_out(self, seconds):
+        with self._lock:
+            self.timeouts += 1
+            self.waits += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+        self._observe_wait(seconds)
+
+    def retried(self):
+        with self._lock:
+            self.retries += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "acquisitions": self.acquisitions,
+                "waits": self.waits,
+                "wait_seconds_total": round(self.wait_seconds, 6),
+                "wait_seconds_max": round(self.max_wait_seconds, 6),
+                "timeouts": self.timeouts,
+                "retries": self.retries,
+            }
+
+pool_metrics = PoolMetrics(DB_POOL_SIZE)
+
+class UserCache:
+    """Caché en memoria con TTL de las filas de USER (por ID y por nombre)
+
+    Evita repetir la misma consulta en ráfagas de login/registro. Solo se
+    guardan usuarios encontrados, y DatabaseManager invalida la entrada al
+    modificar o borrar el usuario. Con varios procesos cada uno tiene su
+    propia caché: un cambio hecho en otro proceso se ve como mucho
+    USER_CACHE_TTL segundos tarde.
+    """
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_entries=USER_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # ('id', 1) / ('username', 'ana') -> (expira, fila)
+        self._lock = threading.Lock()
+
+    def get(self, kind, value):
+        with self._lock:
+            entry = self._entries.get((kind, value))
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[(kind, value)]
+                return None
+            self._entries.move_to_end((kind, value))
+            return dict(entry[1])
+
+    def set(self, kind, value, user):
+        if not self.ttl or not user:
+            return
+        with self._lock:
+            self._entries[(kind, value)] = (time.monotonic() + self.ttl, dict(user))
+            self._entries.move_to_end((kind, value))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Descarta todas las entradas del usuario (por ID y por nombre)"""
+        with self._lock:
+            stale = [key for key, (_, user) in self._entries.items() if user['id'] == user_id]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+user_cache = UserCache()
+
+# Las sentencias con ON DUPLICATE KEY UPDATE usan un alias de fila (AS new) en
+# lugar de VALUES(col), obsoleto desde MySQL 8.0.20: su aviso 1287 se
+# convertiría en error con raise_on_warnings. Requiere MySQL 8.0.19+
+UPSERT_DOWNLOAD_JOB = """
+INSERT INTO DOWNLOAD_HISTORY (job_id, user_id, url, filename, download_date, status, error_message)
+VALUES (%s, %s, %s, %s, %s, %s, %s) AS new
+ON DUPLICATE KEY UPDATE
+    filename = new.filename,
+    status = new.status,
+    error_message = new.error_message
+"""
+
+UPDATE_USER_STATS = """
+INSERT INTO USER_DOWNLOAD_STATS (user_id, total_downloads, successful_downloads, failed_downloads)
+VALUES (%s, %s, %s, %s) AS new
+ON DUPLICATE KEY UPDATE
+    total_downloads = USER_DOWNLOAD_STATS.total_downloads + new.total_downloads,
+    successful_downloads = USER_DOWNLOAD_STATS.successful_downloads + new.successful_downloads,
+    failed_downloads = USER_DOWNLOAD_STATS.failed_downloads + new.failed_downloads
+"""
+
+# En INSERT ... SELECT el alias es el de una tabla derivada con los recuentos
+REPAIR_USER_STATS = """
+INSERT INTO USER_DOWNLOAD_STATS (user_id, total_downloads, successful_downloads, failed_downloads)
+SELECT new.user_id, new.total_downloads, new.successful_downloads, new.failed_downloads
+FROM (
+    SELECT
+        u.id AS user_id,
+        COUNT(h.id) AS total_downloads,
+        COALESCE(SUM(h.status = 'success'), 0) AS successful_downloads,
+        COALESCE(SUM(h.status = 'failed'), 0) AS failed_downloads
+    FROM USER u
+    LEFT JOIN DOWNLOAD_HISTORY h ON h.user_id = u.id AND h.status IN ('success', 'failed')
+    GROUP BY u.id
+) AS new
+ON DUPLICATE KEY UPDATE
+    total_downloads = new.total_downloads,
+    successful_downloads = new.successful_downloads,
+    failed_downloads = new.failed_downloads
+"""
+
 class DatabaseManager:
+    """Acceso a la base de datos (MySQL por defecto)
+
+    Con DB_BACKEND=sqlite, DatabaseManager() devuelve un SQLiteDatabaseManager
+    (ver database/sqlite.py) con los mismos métodos.
+    """
+    backend = "mysql"
     _instance = None
     _pool = None
-    _initialized = False
+    # Limita los préstamos al tamaño del pool para poder esperar con timeout
+    _slots = threading.BoundedSemaphore(DB_POOL_SIZE)
+    _pool_lock = threading.Lock()
+
+    # Sentencias que cambian según el motor
+    UPSERT_DOWNLOAD_JOB = UPSERT_DOWNLOAD_JOB
+    UPDATE_USER_STATS = UPDATE_USER_STATS
+    REPAIR_USER_STATS = REPAIR_USER_STATS
+    FOR_UPDATE = " FOR UPDATE"
 
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(DatabaseManager, cls).__new__(cls)
-        return cls._instance
+        if DatabaseManager._instance is None:
+            manager_class = cls
+            if cls is DatabaseManager and DB_BACKEND == "sqlite":
+                from .sqlite import SQLiteDatabaseManager
+                manager_class = SQLiteDatabaseManager
+            elif DB_BACKEND not in DB_BACKENDS:
+                raise DatabaseError(f"Unknown DB_BACKEND '{DB_BACKEND}' (expected one of {', '.join(DB_BACKENDS)})")
+            DatabaseManager._instance = super(DatabaseManager, cls).__new__(manager_class)
+        return DatabaseManager._instance
+
+    @property
+    def pool_ready(self) -> bool:
+        """Indica si el pool de conexiones ya está creado"""
+        return self._pool is not None
 
-    def __init__(self):
-        if not self._initialized:
-            self._setup_pool()
-            self._initialized = True
+    @classmethod
+    def warm_up(cls):
+        """Crea el pool si aún no existe
+
+        Se llama con la primera consulta o desde el calentamiento en segundo
+        plano: importar el módulo no abre conexiones ni bloquea el arranque
+        del worker.
+        """
+        if cls._pool is not None:
+            return
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._setup_pool()
 
     @classmethod
     def _setup_pool(cls):
@@ -84,18 +364,20 @@ class DatabaseManager:
                     cls._pool = None
 
                 config = {k: v for k, v in DB_CONFIG.items() if k not in ['pool_name', 'pool_size']}
-                cls._pool = mysql.connector.pooling.MySQLConnectionPool(
+                pool = mysql.connector.pooling.MySQLConnectionPool(
                     pool_name=DB_CONFIG['pool_name'],
                     pool_size=DB_CONFIG['pool_size'],
                     **config
                 )
                 
                 # Verificar la conexión
-                with cls._pool.get_connection() as test_conn:
+                with pool.get_connection() as test_conn:
                     with test_conn.cursor() as cursor:
                         cursor.execute('SELECT 1')
                         cursor.fetchone()
                 
+                # Publicar el pool solo cuando ya se verificó
+                cls._pool = pool
                 logger.info("Connection pool created and verified successfully")
                 return
                 
@@ -109,19 +391,37 @@ class DatabaseManager:
 
     @contextmanager
     def get_connection(self):
-        """Obtener una conexión del pool usando context manager"""
+        """Obtener una conexión del pool usando context manager
+
+        Si todas las conexiones están ocupadas se espera a que se libere una
+        (como mucho DB_POOL_TIMEOUT segundos) en lugar de fallar de inmediato.
+        """
+        start = time.monotonic()
+        waited = not self._slots.acquire(blocking=False)
+        if waited and not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+            pool_metrics.timed_out(time.monotonic() - start)
+            raise PoolTimeoutError(f"No hay conexiones libres tras {DB_POOL_TIMEOUT}s (pool de {DB_POOL_SIZE})")
+        pool_metrics.acquired(waited, time.monotonic() - start)
+
         conn = None
         try:
+            self.warm_up()
             conn = self._pool.get_connection()
             yield conn
         except Error as e:
-            raise DatabaseError(f"Error getting connection from pool: {e}")
+            raise DatabaseError(f"Error getting connection from pool: {e}") from e
         finally:
             if conn:
                 try:
                     conn.close()
                 except Error:
                     pass
+            pool_metrics.released()
+            self._slots.release()
+
+    def pool_stats(self) -> dict:
+        """Métricas del pool: tamaño, conexiones en uso, esperas, timeouts y reintentos"""
+        return pool_metrics.snapshot()
 
     @retry_on_error()
     def execute_query(self, query, params=None, fetch_one=False, fetch_all=False, return_last_id=False):
@@ -141,7 +441,9 @@ class DatabaseManager:
                     
                 except Error as e:
                     conn.rollback()
-                    raise DatabaseError(f"Error executing query: {e}")
+                    if e.errno == errorcode.ER_DUP_ENTRY:
+                        raise duplicate_key_error(e) from e
+                    raise DatabaseError(f"Error executing query: {e}") from e
 
     @retry_on_error()
     def execute_many(self, query, params_list):
@@ -155,11 +457,23 @@ class DatabaseManager:
                 except Error as e:
                     conn.rollback()
                     logger.error(f"Batch execution failed: {e}\nQuery: {query}")
-                    raise DatabaseError(f"Batch execution failed: {e}")
+                    raise DatabaseError(f"Batch execution failed: {e}") from e
                 finally:
                     cursor.close()
 
-    @retry_on_error()
+    @contextmanager
+    def transaction(self):
+        """Cursor dentro de una transacción: commit al salir, rollback si hay error"""
+        with self.get_connection() as conn:
+            with conn.cursor() as cursor:
+                try:
+                    conn.start_transaction()
+                    yield cursor
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
     def health_check(self) -> bool:
         """Verificar el estado de la conexión"""
         try:
@@ -168,39 +482,46 @@ class DatabaseManager:
                 cursor.execute('SELECT 1')
                 result = cursor.fetchone()
                 return bool(result)
-        except Error as e:
+        except (Error, DatabaseError) as e:
             logger.error(f"Health check failed: {e}")
             return False
 
     # Funciones de Usuario
-    @retry_on_error()
     def create_user(self, username: str, email: str, password: str) -> int:
         """Crear un nuevo usuario"""
         query = "INSERT INTO USER (username, email, password) VALUES (%s, %s, %s)"
         params = (username, email, password)
         return self.execute_query(query, params, return_last_id=True)
 
-    @retry_on_error()
     def get_user_by_id(self, user_id: int) -> dict:
-        """Obtener usuario por ID"""
+        """Obtener usuario por ID (cacheado USER_CACHE_TTL segundos)"""
+        user = user_cache.get('id', user_id)
+        if user is not None:
+            return user
         query = "SELECT id, username, email, created_at, last_login, is_active FROM USER WHERE id = %s"
         result = self.execute_query(query, (user_id,), fetch_one=True)
-        return dict(zip(['id', 'username', 'email', 'created_at', 'last_login', 'is_active'], result)) if result else None
+        user = dict(zip(['id', 'username', 'email', 'created_at', 'last_login', 'is_active'], result)) if result else None
+        user_cache.set('id', user_id, user)
+        return user
 
-    @retry_on_error()
     def get_user_by_username(self, username: str) -> dict:
-        """Obtener usuario por nombre de usuario"""
+        """Obtener usuario por nombre de usuario (cacheado USER_CACHE_TTL segundos)"""
+        user = user_cache.get('username', username)
+        if user is not None:
+            return user
         query = "SELECT id, username, email, password, created_at, last_login, is_active FROM USER WHERE username = %s"
         result = self.execute_query(query, (username,), fetch_one=True)
-        return dict(zip(['id', 'username', 'email', 'password', 'created_at', 'last_login', 'is_active'], result)) if result else None
+        user = dict(zip(['id', 'username', 'email', 'password', 'created_at', 'last_login', 'is_active'], result)) if result else None
+        user_cache.set('username', username, user)
+        return user
 
-    @retry_on_error()
     def update_user_last_login(self, user_id: int) -> bool:
         """Actualizar última fecha de inicio de sesión"""
         query = "UPDATE USER SET last_login = CURRENT_TIMESTAMP WHERE id = %s"
-        return self.execute_query(query, (user_id,))
+        result = self.execute_query(query, (user_id,))
+        user_cache.invalidate(user_id)
+        return result
 
-    @retry_on_error()
     def update_user(self, user_id: int, username: str = None, email: str = None, password: str = None, is_active: bool = None) -> bool:
         """Actualizar información del usuario"""
         updates = []
@@ -227,36 +548,66 @@ class DatabaseManager:
 
         query = f"UPDATE USER SET {', '.join(updates)} WHERE id = %s"
         params.append(user_id)
-        return self.execute_query(query, tuple(params))
+        try:
+            return self.execute_query(query, tuple(params))
+        finally:
+            user_cache.invalidate(user_id)
 
-    @retry_on_error()
     def delete_user(self, user_id: int) -> bool:
         """Eliminar usuario"""
         query = "DELETE FROM USER WHERE id = %s"
-        return self.execute_query(query, (user_id,))
+        try:
+            return self.execute_query(query, (user_id,))
+        finally:
+            user_cache.invalidate(user_id)
 
     # Funciones de Historial de Descargas
     @retry_on_error()
     def register_download(self, user_id: int, url: str, filename: str, status: str, error_message: str = None) -> int:
-        """Registrar una nueva descarga"""
-        query = "CALL register_download(%s, %s, %s, %s, %s)"
-        params = (user_id, url, filename, status, error_message)
-        return self.execute_query(query, params, return_last_id=True)
+        """Registrar una nueva descarga
 
-    @retry_on_error()
-    def get_user_downloads(self, user_id: int, limit: int = 10, offset: int = 0) -> list:
-        """Obtener historial de descargas de un usuario"""
-        query = """
+        Hace lo mismo que el procedimiento register_download (fila de
+        historial y last_login del usuario) y además ajusta los contadores,
+        en una sola transacción y sin depender de procedimientos almacenados.
+        """
+        with self.transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO DOWNLOAD_HISTORY (user_id, url, filename, status, error_message) VALUES (%s, %s, %s, %s, %s)",
+                (user_id, url, filename or '', status, error_message)
+            )
+            download_id = cursor.lastrowid
+            if any(_stats_flags(status)):
+                cursor.execute(self.UPDATE_USER_STATS, (user_id, *_stats_flags(status)))
+            cursor.execute("UPDATE USER SET last_login = CURRENT_TIMESTAMP WHERE id = %s", (user_id,))
+        return download_id
+
+    def get_user_downloads(self, user_id: int, limit: int = 10, before: tuple = None, status: str = None) -> list:
+        """Obtener historial de descargas de un usuario (paginación por clave)
+
+        Args:
+            before: Tupla (download_date, id) de la última fila de la página anterior
+            status: Filtrar por estado (pending, running, success, failed)
+        """
+        conditions = ["user_id = %s"]
+        params = [user_id]
+        if status:
+            conditions.append("status = %s")
+            params.append(status)
+        if before:
+            # Equivale a (download_date, id) < before, escrito para que use el índice
+            conditions.append("(download_date < %s OR (download_date = %s AND id < %s))")
+            params += [before[0], before[0], before[1]]
+        query = f"""
         SELECT id, url, filename, download_date, status, error_message 
         FROM DOWNLOAD_HISTORY 
-        WHERE user_id = %s 
-        ORDER BY download_date DESC 
-        LIMIT %s OFFSET %s
+        WHERE {' AND '.join(conditions)}
+        ORDER BY download_date DESC, id DESC
+        LIMIT %s
         """
-        results = self.execute_query(query, (user_id, limit, offset), fetch_all=True)
+        params.append(limit)
+        results = self.execute_query(query, tuple(params), fetch_all=True)
         return [dict(zip(['id', 'url', 'filename', 'download_date', 'status', 'error_message'], row)) for row in results]
 
-    @retry_on_error()
     def get_download_by_id(self, download_id: int) -> dict:
         """Obtener una descarga específica por ID"""
         query = "SELECT id, user_id, url, filename, download_date, status, error_message FROM DOWNLOAD_HISTORY WHERE id = %s"
@@ -264,14 +615,47 @@ class DatabaseManager:
         return dict(zip(['id', 'user_id', 'url', 'filename', 'download_date', 'status', 'error_message'], result)) if result else None
 
     @retry_on_error()
+    def save_download_jobs(self, rows: list) -> None:
+        """Inserta o actualiza las filas de historial de varios trabajos
+
+        Los contadores de USER_DOWNLOAD_STATS se ajustan en la misma
+        transacción según el estado anterior de cada fila, y last_login de
+        cada usuario del lote se actualiza como en register_download.
+
+        Args:
+            rows: Tuplas (job_id, user_id, url, filename, download_date, status, error_message)
+        """
+        with self.transaction() as cursor:
+            placeholders = ", ".join(["%s"] * len(rows))
+            cursor.execute(
+                f"SELECT job_id, status FROM DOWNLOAD_HISTORY WHERE job_id IN ({placeholders}){self.FOR_UPDATE}",
+                tuple(row[0] for row in rows)
+            )
+            previous = dict(cursor.fetchall())
+            cursor.executemany(self.UPSERT_DOWNLOAD_JOB, rows)
+
+            deltas = {}
+            for job_id, user_id, _, _, _, status, _ in rows:
+                old_status = previous.get(job_id)
+                previous[job_id] = status
+                delta = deltas.setdefault(user_id, [0, 0, 0])
+                for i, counted in enumerate(_stats_flags(status)):
+                    delta[i] += counted - _stats_flags(old_status)[i]
+            changes = [(user_id, *delta) for user_id, delta in deltas.items() if any(delta)]
+            if changes:
+                cursor.executemany(self.UPDATE_USER_STATS, changes)
+            # Como register_download: la actividad de descargas cuenta como último acceso
+            user_ids = tuple(deltas)
+            cursor.execute(
+                f"UPDATE USER SET last_login = CURRENT_TIMESTAMP WHERE id IN ({', '.join(['%s'] * len(user_ids))})",
+                user_ids
+            )
+
     def get_download_stats(self, user_id: int) -> dict:
-        """Obtener estadísticas de descargas de un usuario"""
+        """Obtener estadísticas de descargas de un usuario (contadores materializados)"""
         query = """
-        SELECT 
-            COUNT(*) as total_downloads,
-            SUM(CASE WHEN status = 'success' THEN 1 ELSE 0 END) as successful_downloads,
-            SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) as failed_downloads
-        FROM DOWNLOAD_HISTORY
+        SELECT total_downloads, successful_downloads, failed_downloads
+        FROM USER_DOWNLOAD_STATS
         WHERE user_id = %s
         """
         result = self.execute_query(query, (user_id,), fetch_one=True)
@@ -279,13 +663,35 @@ class DatabaseManager:
 
     @retry_on_error()
     def delete_download_history(self, user_id: int, download_id: int = None) -> bool:
-        """Eliminar historial de descargas de un usuario"""
+        """Eliminar historial de descargas de un usuario (y descontarlo de sus contadores)"""
+        condition = "user_id = %s"
+        params = (user_id,)
         if download_id:
-            query = "DELETE FROM DOWNLOAD_HISTORY WHERE user_id = %s AND id = %s"
-            return self.execute_query(query, (user_id, download_id))
-        else:
-            query = "DELETE FROM DOWNLOAD_HISTORY WHERE user_id = %s"
-            return self.execute_query(query, (user_id,))
+            condition += " AND id = %s"
+            params += (download_id,)
+        with self.transaction() as cursor:
+            cursor.execute(
+                f"SELECT status, COUNT(*) FROM DOWNLOAD_HISTORY WHERE {condition} GROUP BY status{self.FOR_UPDATE}",
+                params
+            )
+            delta = [0, 0, 0]
+            for status, count in cursor.fetchall():
+                for i, counted in enumerate(_stats_flags(status)):
+                    delta[i] -= counted * count
+            cursor.execute(f"DELETE FROM DOWNLOAD_HISTORY WHERE {condition}", params)
+            if any(delta):
+                cursor.execute(self.UPDATE_USER_STATS, (user_id, *delta))
+        return True
+
+    @retry_on_error()
+    def repair_download_stats(self) -> None:
+        """Recalcula USER_DOWNLOAD_STATS a partir de DOWNLOAD_HISTORY"""
+        with self.transaction() as cursor:
+            cursor.execute(self.REPAIR_USER_STATS)
+
+def _stats_flags(status):
+    """Cuánto suma un estado a (total, exitosas, fallidas): solo cuentan los trabajos terminados"""
+    return (int(status in ('success', 'failed')), int(status == 'success'), int(status == 'failed'))
 
 # Instancia global del manejador de base de datos
 db = DatabaseManager()
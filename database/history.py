@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import atexit
+import itertools
+import threading
+import uuid
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from .core import DatabaseManager
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Segundos máximos que un evento espera en memoria antes de escribirse
+HISTORY_FLUSH_INTERVAL = float(os.getenv('HISTORY_FLUSH_INTERVAL', '2'))
+# Eventos pendientes a partir de los que se escribe sin esperar al temporizador
+HISTORY_BATCH_SIZE = int(os.getenv('HISTORY_BATCH_SIZE', '50'))
+# Eventos que se conservan en memoria si la base de datos no responde; el resto va al spool
+HISTORY_MAX_PENDING = int(os.getenv('HISTORY_MAX_PENDING', '5000'))
+# Cada cuántos segundos se recalculan los contadores por usuario desde el historial (0 = nunca)
+STATS_REPAIR_INTERVAL = float(os.getenv('STATS_REPAIR_INTERVAL', str(24 * 3600)))
+# Archivo donde se guardan los eventos que no se pudieron escribir (se reintentan al arrancar)
+HISTORY_SPOOL = os.getenv('HISTORY_SPOOL', os.path.join(BASE_DIR, 'history_spool.jsonl'))
+
+class HistoryWriter:
+    """Escritura diferida (write-behind) del historial de descargas
+
+    Los eventos se acumulan en memoria y un hilo los escribe por lotes con
+    DatabaseManager.save_download_jobs, cada HISTORY_FLUSH_INTERVAL segundos
+    o al llegar a HISTORY_BATCH_SIZE eventos. Cada descarga es una fila con
+    un job_id propio: los cambios de estado se escriben como upsert sobre esa
+    fila (ajustando los contadores del usuario en la misma transacción), y
+    los que llegan antes de escribirse se combinan en memoria.
+
+    Si la base de datos falla, los eventos se reintentan en el siguiente lote;
+    al cerrar el proceso, o si se acumulan demasiados, se guardan en
+    HISTORY_SPOOL y se vuelven a encolar en el siguiente arranque.
+    """
+
+    def __init__(self, db=None, spool_path=HISTORY_SPOOL):
+        self._db = db
+        self.spool_path = spool_path
+        self._pending = {}  # job_id -> fila, en orden de llegada
+        self._written = OrderedDict()  # Últimas filas escritas (para update())
+        self._changed = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = None
+        # Contadores para las métricas (ver stats())
+        self._stats = {"flushes": 0, "rows": 0, "errors": 0, "flush_seconds": 0.0}
+        self._flush_observers = []
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = DatabaseManager()
+        return self._db
+
+    def start(self):
+        """Recupera el spool de una ejecución anterior y arranca el hilo de escritura"""
+        with self._changed:
+            if self._thread is not None:
+                return
+            self._load_spool()
+            self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+            self._thread.start()
+
+    def record(self, user_id, url, filename="", status="success", error_message=None):
+        """Encola la fila de una descarga
+
+        Returns:
+            str: job_id de la fila, para actualizarla con update()
+        """
+        self.start()
+        event = {
+            "job_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "url": url,
+            "filename": filename,
+            "download_date": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+            "status": status,
+            "error_message": error_message,
+        }
+        with self._changed:
+            self._pending[event["job_id"]] = event
+            if len(self._pending) >= HISTORY_BATCH_SIZE:
+                self._changed.notify()
+        return event["job_id"]
+
+    def update(self, job_id, user_id, url, **fields):
+        """Actualiza el estado (o el archivo) de la fila de una descarga
+
+        Si la fila ya no está en memoria (escrita hace demasiado o pasada al
+        spool), el cambio se encola igual: el upsert por job_id actualiza la
+        fila existente sin crear otra.
+
+        Returns:
+            str: job_id
+        """
+        self.start()
+        with self._changed:
+            event = self._pending.get(job_id) or self._written.get(job_id)
+            if event is None:
+                # El upsert solo cambia filename, status y error_message de la fila existente
+                event = {
+                    "job_id": job_id,
+                    "user_id": user_id,
+                    "url": url,
+                    "filename": "",
+                    "download_date": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                    "status": "pending",
+                    "error_message": None,
+                }
+            # Un dict nuevo: si el lote en curso ya incluye el anterior, este queda pendiente
+            self._pending[job_id] = {**event, **fields}
+        return job_id
+
+    def flush(self, user_id=None):
+        """Escribe ya los eventos pendientes (lectura de lo recién escrito, cierre)
+
+        Args:
+            user_id: Escribir solo los eventos de este usuario. Las lecturas
+                lo usan para ver sus propias filas sin esperar a las del resto
+
+        Returns:
+            bool: False si la base de datos falló y los eventos siguen pendientes
+        """
+        if user_id is not None and not self._pending_for(user_id):
+            # Lo habitual en una lectura: nada pendiente, sin esperar al lote en curso
+            return True
+        with self._flush_lock:
+            batch = self._pending_for(user_id)
+            if not batch:
+                return True
+            start = time.perf_counter()
+            try:
+                self.db.save_download_jobs([self._params(event) for _, event in batch])
+            except Exception as e:
+                logger.error(f"[history] Error al escribir {len(batch)} eventos del historial: {e}")
+                self._stats["errors"] += 1
+                self._observe_flush(time.perf_counter() - start, False)
+                self._spill_overflow()
+                return False
+            self._stats["flushes"] += 1
+            self._stats["rows"] += len(batch)
+            elapsed = time.perf_counter() - start
+            self._stats["flush_seconds"] += elapsed
+            self._observe_flush(elapsed, True)
+
+            with self._changed:
+                for job_id, event in batch:
+                    self._written[job_id] = event
+                    self._written.move_to_end(job_id)
+                    if len(self._written) > HISTORY_MAX_PENDING:
+                        self._written.popitem(last=False)
+                    # Solo se retira si no cambió mientras se escribía
+                    if self._pending.get(job_id) is event:
+                        del self._pending[job_id]
+            logger.info(f"[history] {len(batch)} eventos del historial escritos")
+            return True
+
+    def add_flush_observer(self, callback):
+        """Llama a callback(segundos, ok) tras cada intento de escribir un lote (p. ej. para un histograma)"""
+        self._flush_observers.append(callback)
+
+    def _observe_flush(self, seconds, ok):
+        for callback in self._flush_observers:
+            callback(seconds, ok)
+
+    def stats(self):
+        """Lotes escritos, filas, errores, segundos escribiendo y eventos pendientes"""
+        with self._changed:
+            return dict(self._stats, pending=len(self._pending))
+
+    def close(self):
+        """Escribe lo pendiente; si no se puede, lo guarda en el spool"""
+        with self._changed:
+            self._closed = True
+            self._changed.notify()
+        if not self.flush():
+            with self._changed:
+                events = list(self._pending.values())
+                self._pending.clear()
+            self._write_spool(events)
+
+    def repair_stats(self):
+        """Recalcula los contadores por usuario (corrige desvíos por escrituras externas)"""
+        with self._flush_lock:
+            try:
+                self.db.repair_download_stats()
+                logger.info("[history] Contadores de descargas recalculados")
+            except Exception as e:
+                logger.error(f"[history] Error al recalcular los contadores de descargas: {e}")
+
+    def _run(self):
+        next_repair = time.monotonic() + STATS_REPAIR_INTERVAL
+        while True:
+            with self._changed:
+                if not self._closed and len(self._pending) < HISTORY_BATCH_SIZE:
+                    self._changed.wait(HISTORY_FLUSH_INTERVAL)
+                if self._closed:
+                    return
+            self.flush()
+            if STATS_REPAIR_INTERVAL and time.monotonic() >= next_repair:
+                self.repair_stats()
+                next_repair = time.monotonic() + STATS_REPAIR_INTERVAL
+
+    def _pending_for(self, user_id=None):
+        """Eventos pendientes (job_id, fila), de todos o de un usuario"""
+        with self._changed:
+            return [(job_id, event) for job_id, event in self._pending.items()
+                    if user_id is None or event["user_id"] == user_id]
+
+    @staticmethod
+    def _params(event):
+        return (event["job_id"], event["user_id"], event["url"], event["filename"] or "",
+                event["download_date"], event["status"], event["error_message"])
+
+    def _spill_overflow(self):
+        """Pasa al spool los eventos más antiguos si se acumulan demasiados en memoria"""
+        with self._changed:
+            excess = len(self._pending) - HISTORY_MAX_PENDING
+            if excess <= 0:
+                return
+            overflow = list(itertools.islice(self._pending, excess))
+            events = [self._pending.pop(job_id) for job_id in overflow]
+        self._write_spool(events)
+
+    def _write_spool(self, events):
+        if not events:
+            return
+        try:
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                for event in events:
+                    f.write(json.dumps(event) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            logger.warning(f"[history] {len(events)} eventos guardados en {self.spool_path}")
+        except OSError as e:
+            logger.error(f"[history] No se pudieron guardar {len(events)} eventos en el spool: {e}")
+
+    def _load_spool(self):
+        """Encola los eventos guardados en el spool por una ejecución anterior"""
+        if not os.path.exists(self.spool_path):
+            return
+        try:
+            with open(self.spool_path, encoding="utf-8") as f:
+                events = [json.loads(line) for line in f if line.strip()]
+            os.remove(self.spool_path)
+        except (OSError, ValueError) as e:
+            logger.error(f"[history] No se pudo leer el spool del historial: {e}")
+            return
+        # Desde aquí están en memoria: si no se escriben antes de cerrar, close() los vuelve a guardar
+        for event in events:
+            # Spools anteriores a job_id: cada evento es una fila nueva
+            event.setdefault("job_id", uuid.uuid4().hex)
+            self._pending[event["job_id"]] = event
+        logger.info(f"[history] {len(events)} eventos recuperados del spool")
+
+history_writer = HistoryWriter()
+atexit.register(history_writer.close)
@@ -12,18 +12,34 @@ CREATE TABLE IF NOT EXISTS USER (
     INDEX idx_created_at (created_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
--- Tabla de historial de descargas
+-- Tabla de historial de descargas: una fila por trabajo, actualizada en su
+-- sitio (pending -> running -> success/failed) mediante job_id
 CREATE TABLE IF NOT EXISTS DOWNLOAD_HISTORY (
     id INT AUTO_INCREMENT PRIMARY KEY,
+    job_id CHAR(32) NULL,
     user_id INT NOT NULL,
     url VARCHAR(2048) NOT NULL,
-    filename VARCHAR(255) NOT NULL,
+    filename VARCHAR(255) NOT NULL DEFAULT '',
     download_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    status ENUM('success', 'failed') NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    status ENUM('pending', 'running', 'success', 'failed') NOT NULL DEFAULT 'pending',
     error_message TEXT,
     FOREIGN KEY (user_id) REFERENCES USER(id) ON DELETE CASCADE,
-    INDEX idx_user_id (user_id),
-    INDEX idx_download_date (download_date)
+    UNIQUE INDEX idx_job_id (job_id),
+    -- Historial paginado por (download_date, id) y filtrado por estado
+    INDEX idx_user_date (user_id, download_date),
+    INDEX idx_user_status_date (user_id, status, download_date)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Contadores por usuario, mantenidos en la misma transacción que el cambio de
+-- estado de cada trabajo (ver DatabaseManager.save_download_jobs)
+CREATE TABLE IF NOT EXISTS USER_DOWNLOAD_STATS (
+    user_id INT PRIMARY KEY,
+    total_downloads INT NOT NULL DEFAULT 0,
+    successful_downloads INT NOT NULL DEFAULT 0,
+    failed_downloads INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES USER(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Procedimiento para registrar una descarga
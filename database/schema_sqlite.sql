@@ -0,0 +1,56 @@
+-- Schema equivalente a schema.sql para DB_BACKEND=sqlite. El procedimiento
+-- register_download se sustituye por DatabaseManager.register_download y
+-- ON UPDATE CURRENT_TIMESTAMP por triggers.
+
+CREATE TABLE IF NOT EXISTS USER (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username VARCHAR(50) NOT NULL UNIQUE,
+    email VARCHAR(100) NOT NULL UNIQUE,
+    password VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_login TIMESTAMP NULL,
+    is_active BOOLEAN DEFAULT 1
+);
+
+CREATE INDEX IF NOT EXISTS idx_created_at ON USER (created_at);
+
+-- Tabla de historial de descargas: una fila por trabajo, actualizada en su
+-- sitio (pending -> running -> success/failed) mediante job_id
+CREATE TABLE IF NOT EXISTS DOWNLOAD_HISTORY (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id CHAR(32) NULL UNIQUE,
+    user_id INTEGER NOT NULL REFERENCES USER(id) ON DELETE CASCADE,
+    url VARCHAR(2048) NOT NULL,
+    filename VARCHAR(255) NOT NULL DEFAULT '',
+    download_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'running', 'success', 'failed')),
+    error_message TEXT
+);
+
+-- Historial paginado por (download_date, id) y filtrado por estado
+CREATE INDEX IF NOT EXISTS idx_user_date ON DOWNLOAD_HISTORY (user_id, download_date);
+CREATE INDEX IF NOT EXISTS idx_user_status_date ON DOWNLOAD_HISTORY (user_id, status, download_date);
+
+CREATE TRIGGER IF NOT EXISTS trg_download_history_updated_at
+AFTER UPDATE OF filename, status, error_message ON DOWNLOAD_HISTORY
+BEGIN
+    UPDATE DOWNLOAD_HISTORY SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+END;
+
+-- Contadores por usuario, mantenidos en la misma transacción que el cambio de
+-- estado de cada trabajo (ver DatabaseManager.save_download_jobs)
+CREATE TABLE IF NOT EXISTS USER_DOWNLOAD_STATS (
+    user_id INTEGER PRIMARY KEY REFERENCES USER(id) ON DELETE CASCADE,
+    total_downloads INTEGER NOT NULL DEFAULT 0,
+    successful_downloads INTEGER NOT NULL DEFAULT 0,
+    failed_downloads INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_user_download_stats_updated_at
+AFTER UPDATE OF total_downloads, successful_downloads, failed_downloads ON USER_DOWNLOAD_STATS
+BEGIN
+    UPDATE USER_DOWNLOAD_STATS SET updated_at = CURRENT_TIMESTAMP WHERE user_id = NEW.user_id;
+END;
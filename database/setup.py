@@ -10,6 +10,12 @@ logger = logging.getLogger(__name__)
 def init_db():
     """Inicializar la base de datos con el schema"""
     try:
+        if db.backend == "sqlite":
+            # schema_sqlite.sql se aplica al abrir la base de datos (siempre al día)
+            db.warm_up()
+            logger.info("Database schema initialized successfully")
+            return True
+
         # Leer el archivo schema.sql
         schema_path = os.path.join(os.path.dirname(__file__), 'schema.sql')
         with open(schema_path, 'r', encoding='utf-8') as f:
@@ -30,6 +36,7 @@ def init_db():
                     logger.error(f"Command was: {command}")
                     raise
 
+        migrate_db()
         logger.info("Database schema initialized successfully")
         return True
 
@@ -37,13 +44,60 @@ def init_db():
         logger.error(f"Error initializing database: {e}")
         return False
 
+def _table_columns(table):
+    rows = db.execute_query(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,), fetch_all=True
+    )
+    return {row[0] for row in rows}
+
+def _table_indexes(table):
+    rows = db.execute_query(
+        "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table,), fetch_all=True
+    )
+    return {row[0] for row in rows}
+
+def migrate_db():
+    """Actualiza una base de datos creada con un schema anterior
+
+    DOWNLOAD_HISTORY pasa a tener una fila por trabajo (job_id) con estados
+    pending/running/success/failed, y los índices compuestos del historial;
+    USER_DOWNLOAD_STATS se llena a partir del historial existente.
+    Es idempotente: solo aplica los cambios que faltan.
+    """
+    if "job_id" not in _table_columns("DOWNLOAD_HISTORY"):
+        db.execute_query("""
+            ALTER TABLE DOWNLOAD_HISTORY
+                ADD COLUMN job_id CHAR(32) NULL AFTER id,
+                ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP AFTER download_date,
+                MODIFY filename VARCHAR(255) NOT NULL DEFAULT '',
+                MODIFY status ENUM('pending', 'running', 'success', 'failed') NOT NULL DEFAULT 'pending',
+                ADD UNIQUE INDEX idx_job_id (job_id)
+        """)
+        # Filas de "inicio" del esquema anterior: éxito sin archivo, duplicadas por la fila final
+        db.execute_query("DELETE FROM DOWNLOAD_HISTORY WHERE status = 'success' AND filename = ''")
+        logger.info("DOWNLOAD_HISTORY migrated to one row per job")
+
+    indexes = _table_indexes("DOWNLOAD_HISTORY")
+    if "idx_user_date" not in indexes:
+        db.execute_query("ALTER TABLE DOWNLOAD_HISTORY ADD INDEX idx_user_date (user_id, download_date)")
+    if "idx_user_status_date" not in indexes:
+        db.execute_query("ALTER TABLE DOWNLOAD_HISTORY ADD INDEX idx_user_status_date (user_id, status, download_date)")
+    # Cubiertos por los índices compuestos (la clave foránea usa idx_user_date)
+    for index in ("idx_user_id", "idx_download_date"):
+        if index in indexes:
+            db.execute_query(f"ALTER TABLE DOWNLOAD_HISTORY DROP INDEX {index}")
+
+    # Contadores materializados: se calculan la primera vez desde el historial
+    if not db.execute_query("SELECT 1 FROM USER_DOWNLOAD_STATS LIMIT 1", fetch_one=True):
+        db.repair_download_stats()
+        logger.info("USER_DOWNLOAD_STATS backfilled from DOWNLOAD_HISTORY")
+
 def register_download(user_id, url, filename, status='success', error_message=None):
     """Registrar una descarga en el historial"""
     try:
-        db.execute_query(
-            "CALL register_download(%s, %s, %s, %s, %s)",
-            (user_id, url, filename, status, error_message)
-        )
+        db.register_download(user_id, url, filename, status, error_message)
         logger.info(f"Download registered for user {user_id}: {filename}")
         return True
     except DatabaseError as e:
@@ -51,6 +105,13 @@ def register_download(user_id, url, filename, status='success', error_message=No
         return False
 
 if __name__ == "__main__":
+    import sys
+    # python -m database.setup --repair-stats: recalcular los contadores por usuario
+    if "--repair-stats" in sys.argv:
+        db.repair_download_stats()
+        print("Download stats repaired")
+        sys.exit(0)
+
     # Inicializar la base de datos
     if init_db():
         print("Database initialized successfully")
@@ -0,0 +1,226 @@
+import os
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from .core import DatabaseManager, DatabaseError, retry_on_error, pool_metrics, duplicate_key_error
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Archivo de la base de datos SQLite (DB_BACKEND=sqlite)
+SQLITE_PATH = os.getenv('SQLITE_PATH', os.path.join(BASE_DIR, 'downloader.db'))
+# Milisegundos que una conexión espera a que otra libere el bloqueo de escritura
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'schema_sqlite.sql')
+
+# Columnas TIMESTAMP de schema_sqlite.sql: SQLite las guarda como texto y
+# SQLiteCursor las devuelve como datetime, igual que MySQL. Los parámetros
+# datetime se escriben con el formato de CURRENT_TIMESTAMP para que comparen
+# bien como texto. No se usa sqlite3.register_adapter/register_converter: son
+# globales del proceso y cambiarían también las otras bases SQLite (índice de
+# la caché, DeliveryIndex).
+TIMESTAMP_COLUMNS = frozenset(("created_at", "last_login", "download_date", "updated_at"))
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def _adapt(params):
+    return tuple(value.strftime(TIMESTAMP_FORMAT) if isinstance(value, datetime) else value
+                 for value in params or ())
+
+UPSERT_DOWNLOAD_JOB = """
+INSERT INTO DOWNLOAD_HISTORY (job_id, user_id, url, filename, download_date, status, error_message)
+VALUES (%s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (job_id) DO UPDATE SET
+    filename = excluded.filename,
+    status = excluded.status,
+    error_message = excluded.error_message
+"""
+
+UPDATE_USER_STATS = """
+INSERT INTO USER_DOWNLOAD_STATS (user_id, total_downloads, successful_downloads, failed_downloads)
+VALUES (%s, %s, %s, %s)
+ON CONFLICT (user_id) DO UPDATE SET
+    total_downloads = total_downloads + excluded.total_downloads,
+    successful_downloads = successful_downloads + excluded.successful_downloads,
+    failed_downloads = failed_downloads + excluded.failed_downloads
+"""
+
+REPAIR_USER_STATS = """
+INSERT INTO USER_DOWNLOAD_STATS (user_id, total_downloads, successful_downloads, failed_downloads)
+SELECT
+    u.id,
+    COUNT(h.id),
+    COALESCE(SUM(h.status = 'success'), 0),
+    COALESCE(SUM(h.status = 'failed'), 0)
+FROM USER u
+LEFT JOIN DOWNLOAD_HISTORY h ON h.user_id = u.id AND h.status IN ('success', 'failed')
+WHERE true
+GROUP BY u.id
+ON CONFLICT (user_id) DO UPDATE SET
+    total_downloads = excluded.total_downloads,
+    successful_downloads = excluded.successful_downloads,
+    failed_downloads = excluded.failed_downloads
+"""
+
+class SQLiteCursor:
+    """Cursor de sqlite3 que acepta las consultas con %s del resto de la aplicación"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=None):
+        self._cursor.execute(query.replace("%s", "?"), _adapt(params))
+        return self
+
+    def executemany(self, query, params_list):
+        self._cursor.executemany(query.replace("%s", "?"), [_adapt(params) for params in params_list])
+        return self
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return self._convert(row, self._timestamp_indexes()) if row is not None else None
+
+    def fetchall(self):
+        indexes = self._timestamp_indexes()
+        return [self._convert(row, indexes) for row in self._cursor.fetchall()]
+
+    def _timestamp_indexes(self):
+        """Posiciones de las columnas TIMESTAMP en el resultado actual"""
+        return [i for i, column in enumerate(self._cursor.description or ()) if column[0] in TIMESTAMP_COLUMNS]
+
+    @staticmethod
+    def _convert(row, indexes):
+        if not indexes:
+            return row
+        row = list(row)
+        for i in indexes:
+            if isinstance(row[i], str):
+                row[i] = datetime.fromisoformat(row[i])
+        return tuple(row)
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+class SQLiteDatabaseManager(DatabaseManager):
+    """DatabaseManager sobre un archivo SQLite en modo WAL
+
+    Para despliegues de un solo nodo y pruebas sin servidor MySQL: las
+    escrituras del historial son locales (sin latencia de red). Cada hilo
+    usa su propia conexión; en modo WAL los lectores no bloquean al escritor
+    y las escrituras concurrentes esperan hasta SQLITE_BUSY_TIMEOUT. El
+    schema (schema_sqlite.sql, equivalente a schema.sql) se crea al abrir
+    la base de datos por primera vez.
+    """
+    backend = "sqlite"
+    _ready = False
+
+    UPSERT_DOWNLOAD_JOB = UPSERT_DOWNLOAD_JOB
+    UPDATE_USER_STATS = UPDATE_USER_STATS
+    REPAIR_USER_STATS = REPAIR_USER_STATS
+    FOR_UPDATE = ""  # BEGIN IMMEDIATE ya bloquea las escrituras de otras conexiones
+
+    _local = threading.local()
+
+    @property
+    def pool_ready(self) -> bool:
+        return self._ready
+
+    @classmethod
+    def warm_up(cls):
+        """Crea el archivo y el schema si aún no existen"""
+        if cls._ready:
+            return
+        with cls._pool_lock:
+            if cls._ready:
+                return
+            try:
+                os.makedirs(os.path.dirname(SQLITE_PATH) or ".", exist_ok=True)
+                with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+                    schema = f.read()
+                cls._connect().executescript(schema)
+            except (OSError, sqlite3.Error) as e:
+                raise DatabaseError(f"Failed to open SQLite database {SQLITE_PATH}: {e}") from e
+            cls._ready = True
+            logger.info(f"SQLite database ready at {SQLITE_PATH}")
+
+    @classmethod
+    def _connect(cls):
+        """Conexión del hilo actual (se abre la primera vez)"""
+        conn = getattr(cls._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: autocommit, las transacciones se abren explícitamente
+            conn = sqlite3.connect(SQLITE_PATH, timeout=SQLITE_BUSY_TIMEOUT / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            cls._local.conn = conn
+        return conn
+
+    @contextmanager
+    def get_connection(self):
+        """Conexión del hilo actual (no hay pool: SQLite no limita las conexiones)"""
+        pool_metrics.acquired(False, 0)
+        try:
+            self.warm_up()
+            yield self._connect()
+        except sqlite3.IntegrityError as e:
+            if "UNIQUE constraint failed" in str(e):
+                raise duplicate_key_error(e) from e
+            raise DatabaseError(f"SQLite error: {e}") from e
+        except sqlite3.Error as e:
+            raise DatabaseError(f"SQLite error: {e}") from e
+        finally:
+            pool_metrics.released()
+
+    @retry_on_error()
+    def execute_query(self, query, params=None, fetch_one=False, fetch_all=False, return_last_id=False):
+        """Ejecutar una consulta con reintentos automáticos"""
+        with self.get_connection() as conn:
+            cursor = SQLiteCursor(conn.cursor())
+            cursor.execute(query, params)
+            if return_last_id:
+                return cursor.lastrowid
+            elif fetch_one:
+                return cursor.fetchone()
+            elif fetch_all:
+                return cursor.fetchall()
+            return True
+
+    @retry_on_error()
+    def execute_many(self, query, params_list):
+        """Ejecutar múltiples consultas en una transacción"""
+        with self.transaction() as cursor:
+            cursor.executemany(query, params_list)
+
+    @contextmanager
+    def transaction(self):
+        """Cursor dentro de una transacción: commit al salir, rollback si hay error
+
+        BEGIN IMMEDIATE toma el bloqueo de escritura al empezar, así dos
+        transacciones no leen y luego chocan al escribir.
+        """
+        with self.get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield SQLiteCursor(conn.cursor())
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def health_check(self) -> bool:
+        """Verificar el estado de la conexión"""
+        try:
+            with self.get_connection() as conn:
+                return bool(conn.execute('SELECT 1').fetchone())
+        except DatabaseError as e:
+            logger.error(f"Health check failed: {e}")
+            return False
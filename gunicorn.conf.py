@@ -0,0 +1,21 @@
+"""Configuración de gunicorn (se carga sola al ejecutar gunicorn desde esta carpeta)
+
+Los trabajos de descarga y su stream SSE (routes.jobs), las descargas
+compartidas y las transcodificaciones en curso (routes.streaming) viven en la
+memoria del proceso: /jobs/<id> tiene que llegar al mismo proceso que creó el
+trabajo. Por eso se usa un solo worker con WEB_THREADS hilos; para atender más
+peticiones a la vez se suben los hilos, no los workers.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = 1
+worker_class = "gthread"
+threads = int(os.getenv('WEB_THREADS', '4'))  # También dimensiona el pool de la base de datos
+
+def on_starting(server):
+    if server.cfg.workers != 1:
+        raise SystemExit(
+            f"gunicorn con {server.cfg.workers} workers: los trabajos de descarga se guardan en memoria "
+            f"y /jobs/<id> devolvería 404 desde otro worker. Usa 1 worker y sube WEB_THREADS"
+        )
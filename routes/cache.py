@@ -0,0 +1,511 @@
+import os
+import re
+import errno
+import threading
+import shutil
+import time
+import sqlite3
+import hashlib
+import zlib
+import logging
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from routes.metrics import cache_lookups, cache_evictions
+
+# Configuración del logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Configuración
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CACHE_FOLDER = os.path.join(BASE_DIR, "cache")
+CACHE_INDEX_PATH = os.getenv('CACHE_INDEX_PATH', os.path.join(CACHE_FOLDER, "index.sqlite3"))
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(5 * 1024 * 1024 * 1024)))  # 5 GB
+CACHE_EVICTION_POLICY = os.getenv('CACHE_EVICTION_POLICY', 'lru').lower()  # 'lru' o 'lfu'
+CACHE_JANITOR_INTERVAL = int(os.getenv('CACHE_JANITOR_INTERVAL', '60'))  # segundos
+MAX_CACHE_AGE = 24 * 60 * 60  # 24 horas en segundos
+DIGEST_MAX_AGE = 7 * 24 * 60 * 60  # Tiempo sin uso tras el que se olvida un digest (7 días)
+DIGEST_CHUNK_SIZE = 256 * 1024
+
+# Orden de desalojo para cada política (primero se eliminan las primeras filas)
+EVICTION_ORDER = {
+    'lru': "last_access ASC",
+    'lfu': "hits ASC, last_access ASC",
+}
+
+YOUTUBE_HOSTS = ("youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com",
+                 "youtube-nocookie.com", "www.youtube-nocookie.com")
+YOUTUBE_ID_RE = re.compile(r"^[0-9A-Za-z_-]{11}$")
+YOUTUBE_PATH_RE = re.compile(r"^/(?:shorts|embed|live|v)/([0-9A-Za-z_-]{11})")
+SPOTIFY_TRACK_RE = re.compile(
+    r"^(?:https?://open\.spotify\.com/(?:intl-[a-z]{2}(?:-[a-z]{2})?/)?track/|spotify:track:)([0-9A-Za-z]{22})"
+)
+SPOTIFY_COLLECTION_RE = re.compile(
+    r"^(?:https?://open\.spotify\.com/(?:intl-[a-z]{2}(?:-[a-z]{2})?/)?(playlist|album)/|spotify:(playlist|album):)"
+    r"([0-9A-Za-z]{22})"
+)
+YOUTUBE_PLAYLIST_RE = re.compile(r"^[0-9A-Za-z_-]{10,}$")
+
+# Parámetros de query que no cambian el contenido descargado
+IGNORED_QUERY_PARAMS = {"t", "si", "feature", "list", "index", "pp", "start_radio", "ab_channel"}
+
+# Ioctl de Linux para clonar un archivo (reflink) en sistemas de archivos con copy-on-write
+FICLONE = 0x40049409
+
+# Crear carpetas necesarias
+os.makedirs(CACHE_FOLDER, exist_ok=True)
+
+def get_media_id(url):
+    """Obtiene el ID canónico del extractor para una URL
+
+    Returns:
+        tuple: (fuente, id) como ('youtube', 'dQw4w9WgXcQ') o None si no se reconoce
+    """
+    url = url.strip()
+    match = SPOTIFY_TRACK_RE.match(url)
+    if match:
+        return 'spotify', match.group(1)
+
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if host == "youtu.be":
+        video_id = parts.path.strip("/").split("/")[0]
+        if YOUTUBE_ID_RE.match(video_id):
+            return 'youtube', video_id
+    elif host in YOUTUBE_HOSTS:
+        if parts.path == "/watch":
+            video_id = dict(parse_qsl(parts.query)).get("v", "")
+            if YOUTUBE_ID_RE.match(video_id):
+                return 'youtube', video_id
+        match = YOUTUBE_PATH_RE.match(parts.path)
+        if match:
+            return 'youtube', match.group(1)
+    return None
+
+def get_playlist_id(url):
+    """Obtiene el ID de la playlist o álbum al que apunta una URL
+
+    Una URL de YouTube con v= y list= devuelve tanto un medio (get_media_id)
+    como una playlist; quien llama decide cuál descargar.
+
+    Returns:
+        tuple: (fuente, tipo, id) como ('spotify', 'album', '...') o None si no es una colección
+    """
+    url = url.strip()
+    match = SPOTIFY_COLLECTION_RE.match(url)
+    if match:
+        return 'spotify', match.group(1) or match.group(2), match.group(3)
+
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if host in YOUTUBE_HOSTS and parts.path in ("/playlist", "/watch"):
+        list_id = dict(parse_qsl(parts.query)).get("list", "")
+        if YOUTUBE_PLAYLIST_RE.match(list_id):
+            return 'youtube', 'playlist', list_id
+    return None
+
+def canonicalize_url(url):
+    """Normaliza una URL para que sus variantes compartan la misma clave de caché"""
+    media = get_media_id(url)
+    if media:
+        source, media_id = media
+        if source == 'youtube':
+            return f"https://www.youtube.com/watch?v={media_id}"
+        return f"https://open.spotify.com/track/{media_id}"
+
+    parts = urlsplit(url.strip())
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query)
+        if k not in IGNORED_QUERY_PARAMS and not k.startswith("utm_")
+    )
+    return urlunsplit((parts.scheme.lower(), (parts.netloc or "").lower(),
+                       parts.path.rstrip("/"), urlencode(query), ""))
+
+def get_cache_key(url, audio_format, bitrate):
+    """Genera la clave de caché compartida entre usuarios
+
+    La clave combina el ID canónico del medio con el formato y la calidad de
+    salida; las URLs no reconocidas usan el hash de la URL normalizada.
+    """
+    media = get_media_id(url)
+    if media:
+        source, media_id = media
+    else:
+        source, media_id = 'url', hashlib.md5(canonicalize_url(url).encode()).hexdigest()
+    return make_cache_key(source, media_id, audio_format, bitrate)
+
+def make_cache_key(source, media_id, audio_format, bitrate):
+    """Clave de caché a partir de la fuente y el ID del medio"""
+    return f"{source}-{media_id}-{audio_format}-{bitrate}"
+
+def get_cache_entry_folder(cache_key):
+    """Carpeta de la entrada de caché (contiene un único archivo con su nombre original)"""
+    return os.path.join(CACHE_FOLDER, cache_key)
+
+class CacheIndex:
+    """Índice persistente de la caché (SQLite): clave -> ruta, tamaño, último acceso y aciertos
+
+    Las búsquedas son consultas por clave primaria, sin recorrer el disco. El
+    índice se reconcilia con el contenido de CACHE_FOLDER al arrancar el
+    janitor, así que se recupera solo tras una caída o si el archivo se pierde.
+    """
+
+    def __init__(self, path=CACHE_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def _connect(self):
+        try:
+            conn = self._open()
+        except sqlite3.DatabaseError as e:
+            # Índice corrupto: se descarta y se reconstruye desde el disco
+            logger.error(f"[cache] Índice corrupto ({e}), reconstruyendo")
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+            conn = self._open()
+        return conn
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                cache_key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache_entries (last_access)")
+        # Digests por inodo (CRC-32 para los ZIP, SHA-256 para los ETag): los
+        # comparten la entrada de caché y sus hardlinks en las carpetas de los
+        # usuarios; tamaño y mtime detectan inodos reutilizados
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS file_digests (
+                dev INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                crc32 INTEGER NOT NULL,
+                sha256 TEXT,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (dev, inode)
+            )
+        """)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(file_digests)")]
+        if "sha256" not in columns:
+            conn.execute("ALTER TABLE file_digests ADD COLUMN sha256 TEXT")
+        conn.execute("PRAGMA quick_check").fetchone()
+        return conn
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def lookup(self, cache_key):
+        """Devuelve la ruta cacheada para la clave (y cuenta el acierto) o None"""
+        rows = self._execute("SELECT path FROM cache_entries WHERE cache_key = ?", (cache_key,))
+        if not rows:
+            return None
+        path = rows[0][0]
+        if not os.path.exists(path):
+            # El archivo desapareció fuera del índice
+            self.remove(cache_key)
+            return None
+        self._execute(
+            "UPDATE cache_entries SET last_access = ?, hits = hits + 1 WHERE cache_key = ?",
+            (time.time(), cache_key)
+        )
+        return path
+
+    def add(self, cache_key, path, size, created_at=None, hits=0):
+        """Registra (o reemplaza) una entrada de la caché"""
+        now = time.time()
+        self._execute(
+            "INSERT OR REPLACE INTO cache_entries (cache_key, path, size, created_at, last_access, hits) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (cache_key, path, size, created_at or now, created_at or now, hits)
+        )
+
+    def remove(self, cache_key):
+        """Elimina una entrada del índice"""
+        self._execute("DELETE FROM cache_entries WHERE cache_key = ?", (cache_key,))
+
+    def total_size(self):
+        return self._execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries")[0][0]
+
+    def entries(self):
+        return self._execute("SELECT cache_key, path FROM cache_entries")
+
+    def expired(self, max_age):
+        """Claves cuyo último acceso es más antiguo que max_age segundos"""
+        rows = self._execute("SELECT cache_key FROM cache_entries WHERE last_access < ?", (time.time() - max_age,))
+        return [row[0] for row in rows]
+
+    def eviction_candidates(self, policy, limit=100):
+        """Claves ordenadas según la política de desalojo, con su tamaño"""
+        order = EVICTION_ORDER.get(policy, EVICTION_ORDER['lru'])
+        return self._execute(f"SELECT cache_key, size FROM cache_entries ORDER BY {order} LIMIT ?", (limit,))
+
+    def get_digests(self, stat):
+        """Digests guardados para el archivo (según su os.stat): (crc32, sha256 o None) o None"""
+        rows = self._execute(
+            "SELECT crc32, sha256 FROM file_digests WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+            (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        )
+        if not rows:
+            return None
+        self._execute(
+            "UPDATE file_digests SET last_used = ? WHERE dev = ? AND inode = ?",
+            (time.time(), stat.st_dev, stat.st_ino)
+        )
+        return rows[0]
+
+    def set_digests(self, stat, crc, sha256=None):
+        """Guarda los digests de un archivo (conserva el SHA-256 si solo llega el CRC)"""
+        self._execute(
+            "INSERT INTO file_digests (dev, inode, size, mtime_ns, crc32, sha256, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (dev, inode) DO UPDATE SET "
+            "sha256 = CASE WHEN excluded.sha256 IS NULL AND file_digests.size = excluded.size "
+            "AND file_digests.mtime_ns = excluded.mtime_ns THEN file_digests.sha256 ELSE excluded.sha256 END, "
+            "size = excluded.size, mtime_ns = excluded.mtime_ns, crc32 = excluded.crc32, "
+            "last_used = excluded.last_used",
+            (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, crc, sha256, time.time())
+        )
+
+    def purge_digests(self, max_age):
+        """Olvida los digests que no se han usado en max_age segundos"""
+        self._execute("DELETE FROM file_digests WHERE last_used < ?", (time.time() - max_age,))
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_cache_index():
+    """Devuelve el índice de la caché, creándolo y arrancando el janitor la primera vez"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = CacheIndex()
+                threading.Thread(target=_janitor_loop, name="cache-janitor", daemon=True).start()
+    return _index
+
+def get_cache_source(cache_key):
+    """Fuente del medio de una clave de caché (youtube, spotify, url, ...)"""
+    return cache_key.split("-", 1)[0]
+
+def get_cached_file(cache_key, *fallback_keys, count=True):
+    """Devuelve la ruta del archivo cacheado para la primera clave encontrada o None
+
+    Probar varias claves del mismo medio (p. ej. la de la URL y la canónica)
+    cuenta como una sola búsqueda en cache_lookups; con count=False no se
+    cuenta (comprobaciones internas de una petición ya contada).
+    """
+    path = None
+    for key in (cache_key, *fallback_keys):
+        path = get_cache_index().lookup(key)
+        if path:
+            break
+    if count:
+        cache_lookups.inc(source=get_cache_source(cache_key), result="hit" if path else "miss")
+    return path
+
+def _entry_file(entry_folder):
+    """Archivo de una carpeta de entrada de caché (ignora temporales) o None"""
+    try:
+        archivos = [f for f in os.listdir(entry_folder) if not f.startswith(".")]
+    except OSError:
+        return None
+    return os.path.join(entry_folder, archivos[0]) if archivos else None
+
+def _has_recent_partial(entry_folder, max_age=3600):
+    """Indica si la carpeta tiene un archivo parcial (.part) escrito hace poco"""
+    now = time.time()
+    for name in os.listdir(entry_folder):
+        if name.endswith(".part") and now - os.path.getmtime(os.path.join(entry_folder, name)) < max_age:
+            return True
+    return False
+
+def compute_digests(path):
+    """Calcula CRC-32 y SHA-256 de un archivo en una sola lectura por bloques"""
+    crc = 0
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(DIGEST_CHUNK_SIZE)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            sha256.update(chunk)
+    return crc, sha256.hexdigest()
+
+def get_file_crc(path, stat=None):
+    """CRC-32 ya calculado de un archivo (p. ej. al guardarlo en caché) o None"""
+    digests = get_cache_index().get_digests(stat or os.stat(path))
+    return digests[0] if digests else None
+
+def save_file_crc(path, crc, stat=None):
+    """Guarda el CRC-32 de un archivo para no volver a leerlo"""
+    get_cache_index().set_digests(stat or os.stat(path), crc)
+
+def get_file_sha256(path, stat=None):
+    """SHA-256 de un archivo: del índice si ya se calculó, o se calcula una vez y se guarda"""
+    stat = stat or os.stat(path)
+    index = get_cache_index()
+    digests = index.get_digests(stat)
+    if digests and digests[1]:
+        return digests[1]
+    crc, sha256 = compute_digests(path)
+    index.set_digests(stat, crc, sha256)
+    return sha256
+
+def evict_entry(cache_key):
+    """Elimina una entrada del índice y del disco"""
+    get_cache_index().remove(cache_key)
+    shutil.rmtree(get_cache_entry_folder(cache_key), ignore_errors=True)
+    cache_evictions.inc(source=get_cache_source(cache_key))
+
+def reconcile_index():
+    """Sincroniza el índice con el disco tras un arranque o una caída
+
+    Añade las entradas que existen en disco pero no en el índice y elimina
+    las filas cuyos archivos ya no existen.
+    """
+    index = get_cache_index()
+    known = dict(index.entries())
+    added = removed = 0
+
+    for cache_key, path in known.items():
+        if not os.path.exists(path):
+            index.remove(cache_key)
+            removed += 1
+
+    for cache_key in os.listdir(CACHE_FOLDER):
+        entry_folder = get_cache_entry_folder(cache_key)
+        if cache_key in known or not os.path.isdir(entry_folder):
+            continue
+        path = _entry_file(entry_folder)
+        if path is None:
+            # Una carpeta sin archivo puede ser una transcodificación en curso
+            if not _has_recent_partial(entry_folder):
+                shutil.rmtree(entry_folder, ignore_errors=True)
+            continue
+        stat = os.stat(path)
+        index.add(cache_key, path, stat.st_size, created_at=stat.st_mtime)
+        added += 1
+
+    logger.info(f"[cache] Índice reconciliado: {added} entradas añadidas, {removed} eliminadas")
+
+def enforce_cache_limits(max_bytes=CACHE_MAX_BYTES, max_age=MAX_CACHE_AGE, policy=CACHE_EVICTION_POLICY):
+    """Elimina entradas caducadas y desaloja según la política hasta respetar el presupuesto"""
+    index = get_cache_index()
+    evicted = 0
+
+    for cache_key in index.expired(max_age):
+        evict_entry(cache_key)
+        evicted += 1
+
+    total = index.total_size()
+    while total > max_bytes:
+        candidates = index.eviction_candidates(policy)
+        if not candidates:
+            break
+        for cache_key, size in candidates:
+            evict_entry(cache_key)
+            evicted += 1
+            total -= size
+            if total <= max_bytes:
+                break
+
+    if evicted:
+        logger.info(f"[cache] {evicted} entradas desalojadas ({policy}), tamaño actual: {total} bytes")
+    return evicted
+
+def _janitor_loop():
+    """Mantenimiento de la caché en segundo plano, fuera del ciclo de las peticiones"""
+    try:
+        reconcile_index()
+    except Exception as e:
+        logger.error(f"[cache] Error al reconciliar el índice: {e}")
+    while True:
+        try:
+            enforce_cache_limits()
+            get_cache_index().purge_digests(DIGEST_MAX_AGE)
+        except Exception as e:
+            logger.error(f"[cache] Error en el janitor de la caché: {e}")
+        time.sleep(CACHE_JANITOR_INTERVAL)
+
+def _reflink(src, dst):
+    """Clona src en dst sin copiar datos (btrfs, XFS, ...)"""
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+def link_file(src, dst):
+    """Enlaza src en dst de forma atómica: hardlink, reflink o copia como último recurso"""
+    tmp_path = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        os.link(src, tmp_path)
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            os.remove(tmp_path)
+            return link_file(src, dst)
+        try:
+            _reflink(src, tmp_path)
+        except (OSError, ImportError):
+            shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+    # rename() no hace nada si ambos nombres ya apuntan al mismo archivo
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    return dst
+
+def store_in_cache(file_path, cache_key):
+    """Guarda un archivo descargado en la caché compartida
+
+    Returns:
+        str: Ruta del archivo dentro de la caché
+    """
+    entry_folder = get_cache_entry_folder(cache_key)
+    os.makedirs(entry_folder, exist_ok=True)
+    cache_path = link_file(file_path, os.path.join(entry_folder, os.path.basename(file_path)))
+    # Los digests se calculan una vez aquí (el archivo aún está en la caché de
+    # páginas); los reutilizan los ZIP y los ETag de todos los usuarios
+    return register_cache_file(cache_key, cache_path, compute_digests(cache_path))
+
+def register_cache_file(cache_key, cache_path, digests):
+    """Registra en el índice un archivo ya escrito en su carpeta de entrada
+
+    Args:
+        cache_key: Clave de la entrada
+        cache_path: Ruta del archivo dentro de get_cache_entry_folder(cache_key)
+        digests: Tupla (crc32, sha256) del contenido
+    """
+    # El archivo se registra después de existir en disco; si el proceso cae
+    # entre ambos pasos, reconcile_index lo recupera
+    stat = os.stat(cache_path)
+    index = get_cache_index()
+    index.add(cache_key, cache_path, stat.st_size)
+    index.set_digests(stat, *digests)
+    logger.info(f"[cache] Archivo guardado en caché: {cache_key}")
+    return cache_path
+
+def deliver_file(cache_path, user_folder):
+    """Entrega un archivo cacheado en la carpeta del usuario
+
+    Returns:
+        str: Nombre del archivo entregado
+    """
+    filename = os.path.basename(cache_path)
+    link_file(cache_path, os.path.join(user_folder, filename))
+    return filename
@@ -0,0 +1,124 @@
+import os
+import logging
+from urllib.parse import quote
+from flask import Response, send_file
+from routes.cache import get_file_sha256
+from routes.zipstream import ZipStream
+from routes.metrics import zip_build_seconds
+
+# Configuración del logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DOWNLOAD_FOLDER = os.path.join(BASE_DIR, "downloads")
+
+# Quién envía los bytes de los archivos:
+#   'send_file'  -> Flask (por defecto, no necesita proxy)
+#   'x-accel'    -> nginx, mediante X-Accel-Redirect
+#   'x-sendfile' -> lighttpd/Apache (mod_xsendfile), mediante X-Sendfile
+FILE_DELIVERY = os.getenv('FILE_DELIVERY', 'send_file').lower()
+# Location interna de nginx que apunta a DOWNLOAD_FOLDER
+X_ACCEL_PREFIX = os.getenv('X_ACCEL_PREFIX', '/protected/downloads/')
+# Con el módulo mod_zip de nginx, también los ZIP los arma y envía nginx
+NGINX_MOD_ZIP = os.getenv('NGINX_MOD_ZIP', '0') == '1'
+
+DELIVERY_MODES = ('send_file', 'x-accel', 'x-sendfile')
+if FILE_DELIVERY not in DELIVERY_MODES:
+    logger.error(f"[delivery] FILE_DELIVERY no válido: {FILE_DELIVERY}, se usa send_file")
+    FILE_DELIVERY = 'send_file'
+
+def content_disposition(filename):
+    """Cabecera Content-Disposition de descarga, con nombre UTF-8 si hace falta"""
+    try:
+        filename.encode("latin-1")
+        ascii_name = filename
+    except UnicodeEncodeError:
+        ascii_name = filename.encode("ascii", "ignore").decode("ascii") or "download"
+    ascii_name = ascii_name.replace("\\", "\\\\").replace('"', '\\"')
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+def accel_uri(file_path):
+    """URI interna de nginx para un archivo de DOWNLOAD_FOLDER"""
+    relative = os.path.relpath(file_path, DOWNLOAD_FOLDER)
+    return X_ACCEL_PREFIX + quote(relative.replace(os.sep, "/"))
+
+def send_local_file(file_path, filename, mime_type):
+    """Envía el archivo desde Flask con send_file"""
+    # ETag fuerte a partir del contenido; send_file responde 304 a
+    # If-None-Match/If-Modified-Since y 206 a las peticiones con Range
+    stat = os.stat(file_path)
+    try:
+        etag = get_file_sha256(file_path, stat)
+    except Exception as e:
+        logger.error(f"[delivery] Error calculando hash para {file_path}: {e}")
+        etag = None
+    response = send_file(
+        file_path,
+        mimetype=mime_type,
+        as_attachment=True,
+        download_name=filename,
+        conditional=True,
+        etag=etag or True,
+        last_modified=stat.st_mtime,
+        max_age=0
+    )
+    response.headers["Accept-Ranges"] = "bytes"
+    return response
+
+def send_download(file_path, filename, mime_type):
+    """Responde con un archivo según FILE_DELIVERY
+
+    Con un proxy delante, Flask solo valida y resuelve la ruta: el proxy
+    envía los bytes (y gestiona Range, ETag y 304), así que el worker queda
+    libre aunque el cliente sea lento. Sin proxy se usa send_file con un
+    ETag fuerte a partir del contenido.
+    """
+    if FILE_DELIVERY == 'send_file':
+        return send_local_file(file_path, filename, mime_type)
+    if FILE_DELIVERY == 'x-sendfile' and not file_path.isascii():
+        # X-Sendfile lleva la ruta tal cual: un título en japonés o cirílico no
+        # cabe en una cabecera latin-1 y el servidor no podría decodificarla
+        logger.warning(f"[delivery] Ruta no ASCII, se envía con send_file: {file_path}")
+        return send_local_file(file_path, filename, mime_type)
+
+    response = Response(mimetype=mime_type)
+    response.headers["Content-Disposition"] = content_disposition(filename)
+    response.headers["Cache-Control"] = "no-cache"
+    if FILE_DELIVERY == 'x-accel':
+        response.headers["X-Accel-Redirect"] = accel_uri(file_path)
+    else:
+        response.headers["X-Sendfile"] = file_path
+    return response
+
+def timed_zip(zip_stream):
+    """Genera el ZIP observando cuánto tarda en enviarse completo"""
+    with zip_build_seconds.time():
+        yield from zip_stream
+
+def send_zip(entries, zip_name, on_crc=None):
+    """Responde con un ZIP de las entradas (ver routes.zipstream.ZipStream)
+
+    Con FILE_DELIVERY='x-accel' y NGINX_MOD_ZIP=1, Flask solo envía la lista
+    de archivos (con los CRC ya conocidos) y mod_zip arma el ZIP; si no, el
+    ZIP se genera en Python mientras se envía.
+    """
+    if FILE_DELIVERY == 'x-accel' and NGINX_MOD_ZIP:
+        lines = []
+        for entry in entries:
+            crc = f"{entry['crc']:08x}" if entry.get("crc") is not None else "-"
+            lines.append(f"{crc} {entry['size']} {accel_uri(entry['path'])} {entry['name']}\n")
+        response = Response("".join(lines), mimetype="application/zip")
+        response.headers["X-Archive-Files"] = "zip"
+        response.headers["Content-Disposition"] = content_disposition(zip_name)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    zip_stream = ZipStream(entries, on_crc=on_crc)
+    logger.info(f"[delivery] Enviando ZIP: {zip_name} ({len(entries)} archivos, "
+                f"{len(zip_stream) / (1024*1024):.2f} MB)")
+    response = Response(timed_zip(zip_stream), mimetype='application/zip')
+    response.headers["Content-Disposition"] = content_disposition(zip_name)
+    response.headers["Content-Length"] = str(len(zip_stream))
+    response.headers["Cache-Control"] = "no-cache"
+    return response
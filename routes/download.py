@@ -1,16 +1,28 @@
-from flask import request, jsonify
+from flask import request, jsonify, Response
 import os
-import subprocess
-import yt_dlp
-from functools import lru_cache
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor
-import hashlib
 import time
-import shutil
 import logging
-from database.core import db
+from database.core import db, pool_metrics
+from database.history import history_writer
+from routes.cache import get_media_id, get_playlist_id, get_cache_key, make_cache_key, get_cached_file, store_in_cache, deliver_file
+from routes.metadata import PreflightError, preflight, resolve_media_format, get_cached_metadata, validate_metadata
+from routes.ydl_pool import enable_pool, pooled_ydl
+from routes.spotdl_engine import SpotdlEngineError, SpotdlTimeoutError, spotdl_download, spotdl_expand
+from routes.tools import probe_tools
+from routes.delivery import send_local_file
+from routes.storage import record_file, check_free_space, get_storage_usage
+from routes.streaming import (STREAM_FORMATS, STREAM_IO_TIMEOUT, STREAM_RETRY_AFTER, StreamError, StreamBusyError,
+                              StreamTimeoutError, build_ffmpeg_command, get_live_transcode, get_stream_filename, stream_pool)
+from routes.jobs import JOB_SUCCESS, JOB_FAILED, JOB_RUNNING, JobError, create_job, get_job, submit_job, submit_shared_job, iter_job_events, count_jobs
+from routes.metrics import register_collector, executor_collector, db_pool_wait_seconds, history_write_seconds
 from typing import Dict, List, Optional
 from datetime import datetime
+from urllib.parse import quote, urlencode
 
 # Configuración del logging
 logging.basicConfig(level=logging.INFO)
@@ -19,7 +31,6 @@ logger = logging.getLogger(__name__)
 # Configuración
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 DOWNLOAD_FOLDER = os.path.join(BASE_DIR, "downloads")
-CACHE_FOLDER = os.path.join(BASE_DIR, "cache")
 COOKIES_FILE = os.path.join(BASE_DIR, "cookies.txt")
 
 # Configuración de FFmpeg
@@ -30,52 +41,184 @@ FFMPEG_PATH = os.path.join(FFMPEG_BIN)
 os.environ["PATH"] = FFMPEG_BIN + os.pathsep + os.environ.get("PATH", "")
 os.environ["FFMPEG_PATH"] = FFMPEG_PATH
 
-MAX_CACHE_AGE = 24 * 60 * 60  # 24 horas en segundos
-MAX_WORKERS = 4
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', '4'))  # Descargas simultáneas (también dimensiona el pool de la base de datos)
+
+# Formatos de entrega (forman parte de la clave de caché). Solo 'mp3' recodifica
+# siempre; los demás copian el audio tal cual si el origen ya usa ese códec y
+# únicamente lo reempaquetan y etiquetan.
+AUDIO_FORMATS = {
+    "mp3": {
+        "ytdl_format": "bestaudio[ext=m4a]/bestaudio/best",
+        "codec": "mp3",
+        "quality": "192",
+        "spotdl_format": "mp3",
+        "spotdl_bitrate": "320k",
+    },
+    "m4a": {
+        "ytdl_format": "bestaudio[ext=m4a]/bestaudio/best",
+        "codec": "m4a",
+        "quality": None,
+        "spotdl_format": "m4a",
+        "spotdl_bitrate": "disable",
+    },
+    "opus": {
+        "ytdl_format": "bestaudio[acodec=opus]/bestaudio/best",
+        "codec": "opus",
+        "quality": None,
+        "spotdl_format": "opus",
+        "spotdl_bitrate": "disable",
+    },
+    # Contenedor y códec originales, sin recodificar
+    "best": {
+        "ytdl_format": "bestaudio/best",
+        "codec": "best",
+        "quality": None,
+        "spotdl_format": "opus",
+        "spotdl_bitrate": "disable",
+    },
+}
+DEFAULT_AUDIO_FORMAT = os.getenv('DEFAULT_AUDIO_FORMAT', 'mp3')
+SPOTDL_TIMEOUT = 120  # 2 minutos de timeout (por canción)
+PLAYLIST_CONCURRENCY = int(os.getenv('PLAYLIST_CONCURRENCY', '2'))  # Canciones simultáneas por playlist
+MAX_PLAYLIST_TRACKS = int(os.getenv('MAX_PLAYLIST_TRACKS', '100'))
+MAX_PLAYLISTS = int(os.getenv('MAX_PLAYLISTS', '4'))  # Playlists coordinadas a la vez
+PROGRESS_INTERVAL = 0.5  # Segundos mínimos entre reportes de bytes descargados
+HISTORY_STATUSES = ('pending', 'running', 'success', 'failed')
+MAX_HISTORY_PAGE = 100  # Filas máximas por página del historial
+
+# Fase reportada para cada post-procesador de yt-dlp
+POSTPROCESSOR_PHASES = {
+    "ExtractAudio": "transcode",
+    "Metadata": "metadata",
+    "ThumbnailsConvertor": "thumbnail",
+    "EmbedThumbnail": "thumbnail",
+}
 
-# Crear carpetas necesarias
-os.makedirs(CACHE_FOLDER, exist_ok=True)
+# Fase reportada para cada mensaje de estado de spotdl
+SPOTDL_PHASES = {
+    "Searching for song": "resolve",
+    "Getting audio meta": "resolve",
+    "Downloading": "fetch",
+    "Converting": "transcode",
+    "Embedding metadata": "metadata",
+    "Done": "done",
+    "Skipped": "done",
+    "Error": "error",
+}
 
-# Pool de hilos para descargas asíncronas
-thread_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+# Pool de hilos para descargas asíncronas (cada hilo conserva sus instancias de YoutubeDL)
+thread_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, initializer=enable_pool)
+# Los coordinadores de playlists solo esperan a sus canciones: van en un pool
+# aparte para no ocupar los hilos de descarga
+playlist_pool = ThreadPoolExecutor(max_workers=MAX_PLAYLISTS, initializer=enable_pool)
 
-# Funciones para el historial de descargas
-def register_new_download(user_id: int, url: str, filename: str = "", status: str = 'success', error_message: str = None) -> int:
-    """Registra una descarga en el historial"""
+def collect_app_metrics():
+    """Trabajos, pool de la base de datos, historial y disco (se leen en cada scrape de /metrics)"""
+    jobs = [({"kind": kind, "source": source, "status": status}, count)
+            for (kind, source, status), count in count_jobs().items()]
+    backend = {"backend": db.backend}
+    pool = db.pool_stats()
+    history = history_writer.stats()
+    storage = get_storage_usage()
+    return [
+        ("downloader_jobs", "gauge", "Trabajos en memoria por tipo, fuente y estado", jobs),
+        ("downloader_db_pool_size", "gauge", "Conexiones del pool de la base de datos", [(backend, pool["size"])]),
+        ("downloader_db_pool_in_use", "gauge", "Conexiones prestadas", [(backend, pool["in_use"])]),
+        ("downloader_db_pool_acquisitions_total", "counter", "Conexiones obtenidas del pool",
+         [(backend, pool["acquisitions"])]),
+        ("downloader_db_pool_waits_total", "counter", "Adquisiciones que esperaron una conexión libre",
+         [(backend, pool["waits"])]),
+        ("downloader_db_pool_wait_seconds_total", "counter", "Segundos esperando una conexión libre",
+         [(backend, pool["wait_seconds_total"])]),
+        ("downloader_db_pool_wait_seconds_max", "gauge", "Espera más larga por una conexión",
+         [(backend, pool["wait_seconds_max"])]),
+        ("downloader_db_pool_timeouts_total", "counter", "Adquisiciones que superaron DB_POOL_TIMEOUT",
+         [(backend, pool["timeouts"])]),
+        ("downloader_db_retries_total", "counter", "Reintentos por errores transitorios", [(backend, pool["retries"])]),
+        ("downloader_history_flushes_total", "counter", "Lotes del historial escritos", [({}, history["flushes"])]),
+        ("downloader_history_rows_total", "counter", "Filas del historial escritas", [({}, history["rows"])]),
+        ("downloader_history_errors_total", "counter", "Lotes del historial que fallaron", [({}, history["errors"])]),
+        ("downloader_history_flush_seconds_total", "counter", "Segundos escribiendo el historial",
+         [({}, history["flush_seconds"])]),
+        ("downloader_history_pending", "gauge", "Eventos del historial aún en memoria", [({}, history["pending"])]),
+        ("downloader_storage_bytes", "gauge", "Bytes en las carpetas de descargas (según el janitor)",
+         [({}, storage["total"])]),
+    ]
+
+register_collector(executor_collector({"download": thread_pool, "playlist": playlist_pool, "stream": stream_pool}))
+register_collector(collect_app_metrics)
+pool_metrics.add_wait_observer(lambda seconds: db_pool_wait_seconds.observe(seconds, backend=db.backend))
+history_writer.add_flush_observer(
+    lambda seconds, ok: history_write_seconds.observe(seconds, result="ok" if ok else "error"))
+
+# Funciones para el historial de descargas (escritura diferida por lotes, ver database.history)
+def register_new_download(user_id: int, url: str, filename: str = "", status: str = 'success', error_message: str = None) -> str:
+    """Registra una descarga en el historial
+
+    Returns:
+        str: ID de la fila (job_id), para actualizar su estado con complete_download
+            o fail_download
+    """
     try:
-        return db.register_download(user_id, url, filename, status, error_message)
+        return history_writer.record(user_id, url, filename, status, error_message)
     except Exception as e:
         logger.error(f"Error al registrar descarga: {e}")
         return None
 
-def register_download_error(download_id: int, error_message: str) -> bool:
-    """Actualiza el registro de descarga con un error"""
-    try:
-        download = db.get_download_by_id(download_id)
-        if download:
-            return db.register_download(
-                download['user_id'],
-                download['url'],
-                download['filename'],
-                'failed',
-                error_message
-            )
-        return False
-    except Exception:
-        return False
+def complete_download(download_id: str, user_id: int, url: str, filename: str) -> str:
+    """Marca como completada la fila de una descarga registrada al iniciarse"""
+    if download_id:
+        return history_writer.update(download_id, user_id, url, filename=filename, status='success')
+    return register_new_download(user_id, url, filename, 'success')
+
+def fail_download(download_id: str, user_id: int, url: str, error_message: str) -> str:
+    """Marca como fallida la fila de una descarga registrada al iniciarse"""
+    if download_id:
+        return history_writer.update(download_id, user_id, url, status='failed', error_message=error_message)
+    return register_new_download(user_id, url, "", 'failed', error_message)
+
+def mark_download_running(download_id: str, user_id: int, url: str) -> None:
+    """Pasa una descarga de pending a running cuando su trabajo empieza"""
+    if download_id:
+        history_writer.update(download_id, user_id, url, status='running')
 
-def get_user_download_history(user_id: int, page: int = 1, per_page: int = 10) -> List[Dict]:
-    """Obtiene el historial de descargas de un usuario con paginación"""
-    offset = (page - 1) * per_page
+def encode_history_cursor(download):
+    """Cursor opaco para la página siguiente: fecha e ID de la última fila"""
+    return f"{download['download_date'].isoformat()},{download['id']}"
+
+def decode_history_cursor(cursor):
+    """Convierte un cursor en la tupla (download_date, id)
+
+    Raises:
+        ValueError: Si el cursor no es válido
+    """
+    date, download_id = cursor.rsplit(",", 1)
+    return datetime.fromisoformat(date), int(download_id)
+
+def get_user_download_history(user_id: int, limit: int = 10, cursor: str = None, status: str = None):
+    """Obtiene una página del historial de descargas de un usuario
+
+    La paginación es por clave (download_date, id): cada página cuesta lo
+    mismo sin importar lo larga que sea la historia.
+
+    Returns:
+        tuple: (descargas, cursor de la página siguiente o None)
+    """
+    before = decode_history_cursor(cursor) if cursor else None
     try:
-        downloads = db.get_user_downloads(user_id, per_page, offset)
-        return downloads
-    except Exception:
-        return []
+        # Incluir los eventos que aún esperan en el buffer
+        history_writer.flush(user_id)
+        downloads = db.get_user_downloads(user_id, limit, before, status)
+    except Exception as e:
+        logger.error(f"Error al obtener historial: {e}")
+        return [], None
+    next_cursor = encode_history_cursor(downloads[-1]) if len(downloads) == limit else None
+    return downloads, next_cursor
 
 def get_download_stats(user_id: int) -> Dict:
     """Obtiene estadísticas de descargas del usuario"""
     try:
+        history_writer.flush(user_id)
         stats = db.get_download_stats(user_id)
         return stats or {
             'total_downloads': 0,
@@ -92,25 +235,43 @@ def get_download_stats(user_id: int) -> Dict:
 def clear_user_download_history(user_id: int, download_id: Optional[int] = None) -> bool:
     """Limpia el historial de descargas de un usuario"""
     try:
+        history_writer.flush(user_id)
         return db.delete_download_history(user_id, download_id)
     except Exception:
         return False
 
-def get_cache_path(url, user_id):
-    """Genera una ruta única para cachear el archivo"""
-    url_hash = hashlib.md5(url.encode()).hexdigest()
-    return os.path.join(CACHE_FOLDER, f"{user_id}_{url_hash}.mp3")
-
-def cleanup_old_files(folder, max_age):
-    """Elimina archivos más antiguos que max_age segundos"""
-    current_time = time.time()
-    for filename in os.listdir(folder):
-        filepath = os.path.join(folder, filename)
-        if os.path.getmtime(filepath) < current_time - max_age:
-            try:
-                os.remove(filepath)
-            except OSError:
-                pass
+def download_history(session_user):
+    """Historial de descargas del usuario: ?limit=&cursor=&status="""
+    if not session_user or 'id' not in session_user:
+        return jsonify({"error": "Usuario no autenticado"}), 401
+
+    status = request.args.get("status")
+    if status and status not in HISTORY_STATUSES:
+        return jsonify({"error": f"Estado no válido. Opciones: {', '.join(HISTORY_STATUSES)}"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", 10)), 1), MAX_HISTORY_PAGE)
+        downloads, next_cursor = get_user_download_history(
+            session_user['id'], limit, request.args.get("cursor"), status)
+    except ValueError:
+        return jsonify({"error": "Parámetros de paginación no válidos"}), 400
+
+    for download in downloads:
+        download['download_date'] = download['download_date'].isoformat()
+    return jsonify({"downloads": downloads, "next_cursor": next_cursor}), 200
+
+def download_history_stats(session_user):
+    """Estadísticas del historial de descargas del usuario"""
+    if not session_user or 'id' not in session_user:
+        return jsonify({"error": "Usuario no autenticado"}), 401
+    return jsonify(get_download_stats(session_user['id'])), 200
+
+def delete_download_history(session_user, download_id=None):
+    """Borra todo el historial del usuario o una sola descarga"""
+    if not session_user or 'id' not in session_user:
+        return jsonify({"error": "Usuario no autenticado"}), 401
+    if not clear_user_download_history(session_user['id'], download_id):
+        return jsonify({"error": "No se pudo borrar el historial"}), 500
+    return jsonify({"message": "Historial borrado"}), 200
 
 def get_user_folder(session_user):
     """Obtiene y crea la carpeta del usuario si no existe
@@ -125,27 +286,130 @@ def get_user_folder(session_user):
     os.makedirs(user_folder, exist_ok=True)
     return user_folder
 
-@lru_cache(maxsize=100)
-def get_cached_download(url, user_id):
-    """Verifica si la URL ya está cacheada"""
-    cache_path = get_cache_path(url, user_id)
-    if os.path.exists(cache_path):
-        return cache_path
-    return None
+@contextmanager
+def job_workdir(user_folder):
+    """Carpeta temporal y privada de un trabajo dentro de la carpeta del usuario
+
+    Está en el mismo sistema de archivos que la carpeta del usuario, así que
+    el resultado se mueve con un rename atómico; se borra al terminar, junto
+    con los archivos intermedios (miniaturas, .info.json, descargas parciales).
+    """
+    workdir = tempfile.mkdtemp(prefix=".job-", dir=user_folder)
+    try:
+        yield workdir
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def publish_file(file_path, user_folder):
+    """Mueve el archivo terminado de un trabajo a la carpeta del usuario
+
+    Returns:
+        str: Ruta final del archivo
+    """
+    final_path = os.path.join(user_folder, os.path.basename(file_path))
+    os.replace(file_path, final_path)
+    record_file(final_path)
+    return final_path
+
+def deliver_to_user(cached_file, user_folder):
+    """Entrega un archivo de la caché en la carpeta del usuario y lo suma a su uso
+
+    Returns:
+        str: Nombre del archivo entregado
+    """
+    filename = deliver_file(cached_file, user_folder)
+    record_file(os.path.join(user_folder, filename))
+    return filename
+
+def get_file_url(filename):
+    """URL de /descargar para un archivo de la carpeta del usuario (nombre escapado)"""
+    return f"/descargar/{quote(filename, safe='')}"
+
+def get_cached_download(url, audio_format, bitrate):
+    """Verifica si la URL ya está en la caché compartida
+
+    Returns:
+        tuple: (clave de caché, ruta del archivo cacheado o None)
+    """
+    cache_key = get_cache_key(url, audio_format, bitrate)
+    return cache_key, get_cached_file(cache_key)
+
+def get_audio_format(data):
+    """Formato de entrega pedido por el cliente o el predeterminado del servidor
+
+    Raises:
+        ValueError: Si el formato no está soportado
+    """
+    audio_format = (data.get("format") or DEFAULT_AUDIO_FORMAT).lower()
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"Formato no soportado. Opciones: {', '.join(AUDIO_FORMATS)}")
+    return audio_format
+
+def ytdl_cache_params(audio_format):
+    """Formato y calidad que identifican la salida de yt-dlp en la clave de caché"""
+    return audio_format, AUDIO_FORMATS[audio_format]["quality"] or "copy"
+
+def spotdl_cache_params(audio_format):
+    """Formato y bitrate que identifican la salida de spotdl en la clave de caché"""
+    settings = AUDIO_FORMATS[audio_format]
+    return settings["spotdl_format"], settings["spotdl_bitrate"]
+
+def make_progress_hooks(report):
+    """Crea los hooks de progreso y post-procesado de yt-dlp
+
+    Args:
+        report: Función que recibe los campos de progreso (phase, bytes, speed, eta)
+    """
+    last_report = [0.0]
+
+    def progress_hook(d):
+        if d["status"] == "downloading":
+            now = time.monotonic()
+            if now - last_report[0] < PROGRESS_INTERVAL:
+                return
+            last_report[0] = now
+            report(
+                phase="fetch",
+                downloaded_bytes=d.get("downloaded_bytes"),
+                total_bytes=d.get("total_bytes") or d.get("total_bytes_estimate"),
+                speed=d.get("speed"),
+                eta=d.get("eta")
+            )
+        elif d["status"] == "finished":
+            report(
+                phase="fetch",
+                downloaded_bytes=d.get("downloaded_bytes") or d.get("total_bytes"),
+                total_bytes=d.get("total_bytes") or d.get("downloaded_bytes"),
+                speed=None,
+                eta=0
+            )
+
+    def postprocessor_hook(d):
+        phase = POSTPROCESSOR_PHASES.get(d.get("postprocessor"))
+        if phase and d["status"] == "started":
+            report(phase=phase, speed=None, eta=None)
+
+    return progress_hook, postprocessor_hook
 
-def optimize_ydl_opts(user_folder):
-    """Configuración optimizada para yt-dlp con soporte para carátulas y anti-bot"""
+def optimize_ydl_opts(audio_format=DEFAULT_AUDIO_FORMAT):
+    """Configuración optimizada para yt-dlp con soporte para carátulas y anti-bot
+
+    Las opciones solo dependen del formato de entrega, así que las instancias de
+    YoutubeDL se reutilizan (ver routes.ydl_pool); la carpeta de salida y los
+    hooks de progreso se asignan por trabajo.
+    """
+    settings = AUDIO_FORMATS[audio_format]
     return {
         # Formato de audio
-        "format": "bestaudio[ext=m4a]/bestaudio/best",
-        "outtmpl": os.path.join(user_folder, "%(title)s.%(ext)s"),
+        "format": settings["ytdl_format"],
+        "outtmpl": "%(title)s.%(ext)s",
         
         # Procesadores de post-descarga
         "postprocessors": [
             {
                 "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "192"
+                "preferredcodec": settings["codec"],
+                "preferredquality": settings["quality"]
             },
             {   
                 "key": "FFmpegMetadata",
@@ -203,31 +467,45 @@ def optimize_ydl_opts(user_folder):
         "hls_prefer_native": True
     }
 
-def download_file(url, user_folder, cache_path=None, user_id=None, download_id=None):
-    """Función de descarga real"""
-    ydl_opts = optimize_ydl_opts(user_folder)
+def download_file(url, user_folder, cache_key=None, user_id=None, download_id=None, report=None, info=None,
+                  audio_format=DEFAULT_AUDIO_FORMAT):
+    """Función de descarga real
+
+    Si se recibe el info_dict del pre-flight, se descarga sin volver a resolver la página.
+    """
+    hooks = make_progress_hooks(report) if report else None
     
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-        
-       
-        archivos = [f for f in os.listdir(user_folder) if f.endswith(".mp3")]
-        if not archivos:
-            error_msg = "No se encontró el archivo descargado"
-            if download_id:
-                register_download_error(download_id, error_msg)
-            raise Exception(error_msg)
-            
-        
-        if cache_path:
-            shutil.copy2(os.path.join(user_folder, archivos[0]), cache_path)
+        # Cada trabajo escribe en su propia carpeta: las descargas simultáneas
+        # de un mismo usuario no pueden confundir sus archivos
+        with job_workdir(user_folder) as workdir:
+            with pooled_ydl(optimize_ydl_opts(audio_format), workdir, hooks) as ydl:
+                if info:
+                    result = ydl.process_ie_result(info, download=True)
+                else:
+                    result = ydl.extract_info(url, download=True)
+
+            # Ruta final tras los post-procesadores (extracción de audio, carátula)
+            downloads = (result or {}).get("requested_downloads") or []
+            file_path = downloads[0].get("filepath") if downloads else None
+            if not file_path or not os.path.isfile(file_path):
+                error_msg = "No se encontró el archivo descargado"
+                if download_id:
+                    fail_download(download_id, user_id, url, error_msg)
+                raise Exception(error_msg)
+
+            file_path = publish_file(file_path, user_folder)
+
+        if cache_key:
+            if report:
+                report(phase="cache")
+            store_in_cache(file_path, cache_key)
             
-        return archivos[0]
+        return os.path.basename(file_path)
     except Exception as e:
         error_msg = f"Error en la descarga: {str(e)}"
         if download_id:
-            register_download_error(download_id, error_msg)
+            fail_download(download_id, user_id, url, error_msg)
         raise Exception(error_msg)
 
 def download_ytdl(session_user):
@@ -241,53 +519,241 @@ def download_ytdl(session_user):
     if not session_user or 'id' not in session_user:
         return jsonify({"error": "Usuario no autenticado"}), 401
 
-    user_id = session_user['username'] if session_user and 'username' in session_user else "anonymous"
+    try:
+        audio_format = get_audio_format(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     user_folder = get_user_folder(session_user)
     
     try:
-        # Verificar caché
-        cached_file = get_cached_download(url, user_id)
-        if cached_file and os.path.exists(cached_file):
-            shutil.copy2(cached_file, user_folder)
-            filename = os.path.basename(cached_file)
+        # Playlists: URL de playlist, o video dentro de una playlist si se pide explícitamente
+        if get_playlist_id(url) and (data.get("playlist") or not get_media_id(url)):
+            return start_playlist(session_user, 'youtube', url, user_folder, audio_format)
+
+        # Rechazar de inmediato medios ya conocidos que no se pueden descargar
+        metadata = get_cached_metadata(url)
+        if metadata:
+            try:
+                validate_metadata(metadata)
+            except PreflightError as e:
+                return jsonify({"error": str(e)}), 400
+
+        # Verificar caché compartida (clave por ID canónico del video y formato de salida)
+        cache_keys = [get_cache_key(url, *ytdl_cache_params(audio_format))]
+        if metadata:
+            cache_keys.append(make_cache_key(metadata['extractor'], metadata['id'], *ytdl_cache_params(audio_format)))
+        cached_file = get_cached_file(*cache_keys)
+        if cached_file:
+            filename = deliver_to_user(cached_file, user_folder)
             # Registrar descarga desde caché
             register_new_download(session_user['id'], url, filename)
             return jsonify({
                 "message": "Archivo recuperado de caché",
-                "file_url": f"/descargar/{filename}"
+                "file_url": get_file_url(filename),
+                "filename": filename
             }), 200
 
-        # Limpiar archivos antiguos
-        cleanup_old_files(CACHE_FOLDER, MAX_CACHE_AGE)
-        
-        # Registrar inicio de descarga
-        download_id = register_new_download(session_user['id'], url)
-        
-        # Iniciar descarga asíncrona
-        cache_path = get_cache_path(url, user_id)
-        future = thread_pool.submit(download_file, url, user_folder, cache_path, session_user['id'], download_id)
-        filename = future.result()
-        
-        # Actualizar registro con nombre de archivo final
-        register_new_download(session_user['id'], url, filename, 'success')
+        # Encolar la descarga y responder de inmediato con el ID del trabajo
+        storage_error = check_free_space()
+        if storage_error:
+            return jsonify({"error": storage_error}), 507
+        job = submit_ytdl_track(session_user['id'], url, user_folder, audio_format)
         
         return jsonify({
-            "message": "Descarga completada",
-            "file_url": f"/descargar/{filename}"
-        }), 200
+            "message": "Descarga en cola",
+            **job.to_dict()
+        }), 202
 
     except Exception as e:
         return jsonify({"error": f"Error al descargar la canción: {str(e)}"}), 500
 
+def submit_ytdl_track(user_id, url, user_folder, audio_format):
+    """Registra y encola la descarga de un video de YouTube
+
+    Returns:
+        Job: Trabajo de la descarga (adjuntado a otro si el video ya se está descargando)
+    """
+    cache_key = get_cache_key(url, *ytdl_cache_params(audio_format))
+    # Registrar inicio de descarga
+    download_id = register_new_download(user_id, url, status='pending')
+    job = create_job(user_id, 'youtube', url)
+    submit_shared_job(thread_pool, job, cache_key, run_ytdl_job, follow_ytdl_job,
+                      url, user_folder, cache_key, user_id, download_id, audio_format)
+    return job
+
+def run_ytdl_job(job, url, user_folder, cache_key, user_id, download_id, audio_format=DEFAULT_AUDIO_FORMAT):
+    """Trabajo en segundo plano para descargas de YouTube"""
+    mark_download_running(download_id, user_id, url)
+    # Pre-flight: metadatos (cacheados) para rechazar el medio antes de mover bytes
+    job.report(phase="resolve")
+    try:
+        with pooled_ydl(optimize_ydl_opts(audio_format)) as ydl:
+            metadata, info = preflight(url, ydl)
+    except PreflightError as e:
+        if download_id:
+            fail_download(download_id, user_id, url, str(e))
+        raise JobError(str(e))
+
+    # El ID del extractor también identifica URLs que no se reconocen por su forma
+    canonical_key = make_cache_key(metadata['extractor'], metadata['id'], *ytdl_cache_params(audio_format))
+    try:
+        # Otra descarga de la misma canción pudo terminar mientras este trabajo esperaba
+        cached_file = get_cached_file(cache_key, canonical_key, count=False)
+        if cached_file:
+            filename = deliver_to_user(cached_file, user_folder)
+        else:
+            filename = download_file(url, user_folder, canonical_key, user_id, download_id, job.report, info,
+                                     audio_format)
+        if cache_key != canonical_key:
+            store_in_cache(os.path.join(user_folder, filename), cache_key)
+    except Exception as e:
+        error_msg = f"Error al descargar la canción: {str(e)}"
+        if download_id:
+            fail_download(download_id, user_id, url, error_msg)
+        raise JobError(error_msg)
+    
+    # Actualizar registro con nombre de archivo final
+    complete_download(download_id, user_id, url, filename)
+    
+    return {
+        "message": "Descarga completada",
+        "file_url": get_file_url(filename),
+        "filename": filename
+    }
+
+def follow_shared_job(leader, url, user_folder, cache_key, user_id):
+    """Entrega a otro usuario el resultado de una descarga compartida
+
+    Returns:
+        str: Nombre del archivo entregado en la carpeta del usuario
+    """
+    if leader.status != JOB_SUCCESS:
+        raise JobError(leader.error, **leader.details)
+
+    cached_file = get_cached_file(cache_key, count=False)
+    if not cached_file:
+        raise JobError("No se encontró el archivo descargado en caché")
+    return deliver_to_user(cached_file, user_folder)
+
+def follow_ytdl_job(job, leader, url, user_folder, cache_key, user_id, download_id, audio_format=DEFAULT_AUDIO_FORMAT):
+    """Completa un trabajo de YouTube adjuntado a otra descarga del mismo video"""
+    try:
+        filename = follow_shared_job(leader, url, user_folder, cache_key, user_id)
+    except JobError as e:
+        if download_id:
+            fail_download(download_id, user_id, url, str(e))
+        raise
+
+    complete_download(download_id, user_id, url, filename)
+    return {
+        "message": "Descarga completada",
+        "file_url": get_file_url(filename),
+        "filename": filename
+    }
+
+def job_events(session_user, job_id):
+    """Stream Server-Sent Events con el progreso de un trabajo de descarga"""
+    if not session_user or 'id' not in session_user:
+        return jsonify({"error": "Usuario no autenticado"}), 401
+
+    job = get_job(job_id, session_user['id'])
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+
+    return Response(
+        iter_job_events(job),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+def job_status(session_user, job_id):
+    """Devuelve el estado (y el resultado, si terminó) de un trabajo de descarga"""
+    if not session_user or 'id' not in session_user:
+        return jsonify({"error": "Usuario no autenticado"}), 401
+
+    job = get_job(job_id, session_user['id'])
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    
+    return jsonify(job.to_dict()), 200
+
+def stream_audio(session_user):
+    """Reproduce un audio mientras se descarga y transcodifica
+
+    Un solo proceso de ffmpeg lee el origen y produce el formato pedido; la
+    respuesta envía la salida a medida que se genera y el archivo completo
+    queda en la caché compartida. Si el audio ya está en caché (como stream o
+    como descarga completa) se envía directamente, con soporte de Range.
+    """
+    url = request.args.get("url")
+    if not url:
+        return jsonify({"error": "No se proporcionó una URL"}), 400
+
+    if not session_user or 'id' not in session_user:
+        return jsonify({"error": "Usuario no autenticado"}), 401
+
+    try:
+        audio_format = get_audio_format(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    spec = STREAM_FORMATS.get(audio_format)
+    if spec is None:
+        return jsonify({"error": f"Formato no disponible para reproducir. Opciones: {', '.join(STREAM_FORMATS)}"}), 400
+    if url.startswith(('https://open.spotify.com/', 'spotify:')):
+        return jsonify({"error": "La reproducción directa solo está disponible para YouTube"}), 400
+
+    try:
+        with pooled_ydl(optimize_ydl_opts(audio_format)) as ydl:
+            metadata, media_format = resolve_media_format(url, ydl)
+    except PreflightError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error al obtener el audio: {str(e)}"}), 500
+
+    stream_key = make_cache_key(metadata['extractor'], metadata['id'], audio_format, "stream")
+    cached_file = get_cached_file(stream_key, make_cache_key(
+        metadata['extractor'], metadata['id'], *ytdl_cache_params(audio_format)))
+    if cached_file:
+        # La caché está fuera de DOWNLOAD_FOLDER: el proxy no tiene una location para ella
+        return send_local_file(cached_file, os.path.basename(cached_file), spec["mimetype"])
+
+    storage_error = check_free_space()
+    if storage_error:
+        return jsonify({"error": storage_error}), 507
+
+    command = build_ffmpeg_command(FFMPEG_PATH, media_format, metadata, spec)
+    try:
+        live = get_live_transcode(stream_key, get_stream_filename(metadata, spec), command, spec["mimetype"])
+        # Esperar el primer bloque para poder responder con un error si ffmpeg falla al arrancar
+        live.wait_for_data(STREAM_IO_TIMEOUT)
+        body = live.iter_bytes()
+    except (StreamBusyError, StreamTimeoutError) as e:
+        # Sin hueco o sin datos todavía: el cliente puede reintentar (la transcodificación
+        # que sigue en curso deja el audio en la caché)
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(STREAM_RETRY_AFTER)}
+    except StreamError as e:
+        return jsonify({"error": f"Error al transcodificar el audio: {str(e)}"}), 502
+
+    return Response(
+        body,
+        mimetype=spec["mimetype"],
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 def download_spdl(session_user):
     """Manejador de descargas de Spotify"""
+    url = None
     try:
         logger.info("[spotdl] Iniciando descarga de Spotify...")
         logger.info(f"[spotdl] Datos de sesión: {session_user}")
         
-        if not session_user or 'id' not in session_user:
-            return jsonify({"error": "Usuario no autenticado"}), 401
-        
         if not session_user or 'id' not in session_user:
             return jsonify({"error": "Usuario no autenticado"}), 401
 
@@ -309,183 +775,315 @@ def download_spdl(session_user):
             register_new_download(session_user['id'], url, "", 'failed', error_msg)
             return jsonify({"error": error_msg}), 400
 
+        try:
+            audio_format = get_audio_format(data)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
         # Preparar directorio
         try:
             user_folder = get_user_folder(session_user)
             logger.info(f"[spotdl] Carpeta del usuario: {user_folder}")
-            if not os.path.exists(user_folder):
-                os.makedirs(user_folder, exist_ok=True)
-                logger.info(f"[spotdl] Carpeta creada: {user_folder}")
         except Exception as e:
             error_msg = f"No se pudo crear el directorio de usuario: {str(e)}"
             logger.error(f"[spotdl] Error al crear carpeta: {str(e)}")
             register_new_download(session_user['id'], url, "", 'failed', error_msg)
             return jsonify({"error": error_msg}), 500
 
-        # Verificar que ffmpeg esté en el PATH
-        ffmpeg_path = os.path.join(FFMPEG_PATH)
-        logger.info(f"[spotdl] Ruta de ffmpeg: {ffmpeg_path}")
-        if not os.path.exists(ffmpeg_path):
-            error_msg = f"ffmpeg no encontrado en {ffmpeg_path}"
-            register_new_download(session_user['id'], url, "", 'failed', error_msg)
-            return jsonify({"error": error_msg}), 500
-
-        # Registrar inicio de descarga
-        download_id = register_new_download(session_user['id'], url)
-        
-        # Verificar que ffmpeg existe
-        if not os.path.exists(FFMPEG_PATH):
+        # Verificar herramientas (comprobadas una sola vez por proceso)
+        tools = probe_tools(FFMPEG_PATH)
+        if not tools["ffmpeg"]:
             error_msg = f"ffmpeg no encontrado en {FFMPEG_PATH}"
             register_new_download(session_user['id'], url, "", 'failed', error_msg)
             return jsonify({"error": error_msg}), 500
-            
-        # Configurar el entorno para spotdl
-        env = os.environ.copy()
-        env["FFMPEG_PATH"] = FFMPEG_PATH
-        logger.info(f"[spotdl] FFMPEG_PATH configurado: {env['FFMPEG_PATH']}")
-
-        # Verificar spotdl con el PATH actualizado
-        try:
-            logger.info("[spotdl] Verificando instalación de spotdl...")
-            version_process = subprocess.run(
-                ["spotdl", "--version"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                env=env,
-                text=True,
-                check=True
-            )
-            logger.info(f"[spotdl] Versión instalada: {version_process.stdout.strip()}")
-        except subprocess.CalledProcessError as e:
-            error_msg = f"Error al verificar spotdl: {e.stderr}"
-            logger.error(f"[spotdl] {error_msg}")
-            register_new_download(session_user['id'], url, "", 'failed', error_msg)
-            return jsonify({
-                "error": error_msg,
-                "details": e.stderr
-            }), 500
-        except FileNotFoundError as e:
+        if not tools["spotdl"]:
             error_msg = "spotdl no está instalado. Por favor, instale spotdl usando: pip install spotdl"
-            logger.error(f"[spotdl] {error_msg}: {str(e)}")
             register_new_download(session_user['id'], url, "", 'failed', error_msg)
             return jsonify({"error": error_msg}), 500
 
-        # Iniciar proceso de descarga con configuración mejorada
+        # Playlists y álbumes: una descarga por canción
+        if get_playlist_id(url):
+            return start_playlist(session_user, 'spotify', url, user_folder, audio_format)
+
+        # Verificar caché compartida (solo canciones individuales tienen ID canónico)
+        if get_media_id(url):
+            cache_key, cached_file = get_cached_download(url, *spotdl_cache_params(audio_format))
+            if cached_file:
+                filename = deliver_to_user(cached_file, user_folder)
+                register_new_download(session_user['id'], url, filename)
+                return jsonify({
+                    "message": "Archivo recuperado de caché",
+                    "file_url": get_file_url(filename),
+                    "filename": filename
+                }), 200
+
+        # Encolar la descarga y responder de inmediato con el ID del trabajo
+        storage_error = check_free_space()
+        if storage_error:
+            return jsonify({"error": storage_error}), 507
+        job = submit_spdl_track(session_user['id'], url, user_folder, audio_format)
+
+        return jsonify({
+            "message": "Descarga en cola",
+            **job.to_dict()
+        }), 202
+            
+    except Exception as e:
+        error_msg = f"Error al descargar la canción: {str(e)}"
+        logger.error(f"[spotdl] {error_msg}")
+        register_new_download(session_user['id'], url or "", "", 'failed', error_msg)
+        return jsonify({
+            "error": error_msg,
+            "details": str(e)
+        }), 500
+
+def submit_spdl_track(user_id, url, user_folder, audio_format):
+    """Registra y encola la descarga de una canción de Spotify
+
+    Returns:
+        Job: Trabajo de la descarga (adjuntado a otro si la canción ya se está descargando)
+    """
+    # Solo las canciones individuales tienen ID canónico (y por tanto caché compartida)
+    cache_key = get_cache_key(url, *spotdl_cache_params(audio_format)) if get_media_id(url) else None
+    # Registrar inicio de descarga
+    download_id = register_new_download(user_id, url, status='pending')
+    job = create_job(user_id, 'spotify', url)
+    if cache_key:
+        submit_shared_job(thread_pool, job, cache_key, run_spdl_job, follow_spdl_job,
+                          url, user_folder, user_id, cache_key, audio_format, download_id)
+    else:
+        submit_job(thread_pool, job, run_spdl_job, url, user_folder, user_id, None, audio_format, download_id)
+    return job
+
+def report_spotdl_progress(progress, report):
+    """Traduce un aviso de progreso de spotdl a la fase del trabajo"""
+    phase = SPOTDL_PHASES.get(progress["message"])
+    if phase:
+        song = progress["song"]
+        report(phase=phase, message=f"{song}: {progress['message']}" if song else progress["message"])
+
+def follow_spdl_job(job, leader, url, user_folder, user_id, cache_key, audio_format=DEFAULT_AUDIO_FORMAT,
+                    download_id=None):
+    """Completa un trabajo de Spotify adjuntado a otra descarga de la misma canción"""
+    try:
+        filename = follow_shared_job(leader, url, user_folder, cache_key, user_id)
+    except JobError as e:
+        fail_download(download_id, user_id, url, str(e))
+        raise
+
+    complete_download(download_id, user_id, url, filename)
+    return {
+        "message": "Descarga completada",
+        "file_url": get_file_url(filename),
+        "filename": filename,
+        "file_size": os.path.getsize(os.path.join(user_folder, filename))
+    }
+
+def run_spdl_job(job, url, user_folder, user_id, cache_key=None, audio_format=DEFAULT_AUDIO_FORMAT, download_id=None):
+    """Trabajo en segundo plano para descargas de Spotify"""
+    mark_download_running(download_id, user_id, url)
+    # Otra descarga de la misma canción pudo terminar mientras este trabajo esperaba
+    cached_file = get_cached_file(cache_key, count=False) if cache_key else None
+    if cached_file:
+        filename = deliver_to_user(cached_file, user_folder)
+        complete_download(download_id, user_id, url, filename)
+        return {
+            "message": "Archivo recuperado de caché",
+            "file_url": get_file_url(filename),
+            "filename": filename,
+            "file_size": os.path.getsize(cached_file)
+        }
+
+    try:
+        # La descarga se ejecuta en un proceso de spotdl ya iniciado (cliente y matcher en caliente)
         logger.info(f"[spotdl] Iniciando descarga de: {url}")
+        job.report(phase="resolve")
         try:
-            command = [
-                "spotdl",
-                url,
-                "--output", user_folder,
-                "--format", "mp3",
-                "--ffmpeg", FFMPEG_PATH,
-                "--bitrate", "320k"
-            ]
-            logger.info(f"[spotdl] Comando a ejecutar: {' '.join(command)}")
-            process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                env=env,
-                text=True
+            with job_workdir(user_folder) as workdir:
+                result = spotdl_download(
+                    url,
+                    workdir,
+                    AUDIO_FORMATS[audio_format]["spotdl_format"],
+                    AUDIO_FORMATS[audio_format]["spotdl_bitrate"],
+                    FFMPEG_PATH,
+                    on_progress=lambda progress: report_spotdl_progress(progress, job.report),
+                    timeout=SPOTDL_TIMEOUT
+                )
+                # spotdl devuelve la ruta exacta de cada archivo descargado
+                file_path = publish_file(result["files"][0], user_folder) if result["files"] else None
+        except SpotdlTimeoutError as e:
+            error_msg = str(e)
+            # Registrar error de timeout
+            fail_download(download_id, user_id, url, error_msg)
+            raise JobError(
+                error_msg,
+                suggestion="Intenta con una canción individual en lugar de una playlist"
             )
-        except Exception as e:
-            error_msg = f"Error al iniciar el proceso de descarga: {str(e)}"
-            logger.error(f"[spotdl] Error al iniciar el proceso: {str(e)}")
-            register_new_download(session_user['id'], url, "", 'failed', error_msg)
-            return jsonify({"error": error_msg}), 500
+        except SpotdlEngineError as e:
+            error_msg = "Error en la descarga"
+            logger.error(f"[spotdl] {error_msg}: {e}\n{e.details or ''}")
+            fail_download(download_id, user_id, url, f"{error_msg}\n{e}")
+            raise JobError(error_msg, details=str(e))
+
+        errors = "\n".join(result["errors"])
+        if errors:
+            logger.info(f"[spotdl] Errores reportados por spotdl:\n{errors}")
+
+        # Verificar si hay error de FFmpeg
+        if "FFmpegError" in errors:
+            error_msg = "Error de FFmpeg durante la conversión"
+            logger.error(f"[spotdl] {error_msg}: {errors}")
+            fail_download(download_id, user_id, url, f"{error_msg}\n{errors}")
+            raise JobError(
+                error_msg,
+                details=errors,
+                suggestion="Verifica que FFmpeg esté correctamente instalado y configurado"
+            )
+
+        if not file_path:
+            error_msg = "No se encontró el archivo descargado"
+            # Registrar error en la base de datos
+            fail_download(download_id, user_id, url, error_msg)
+            raise JobError(
+                error_msg,
+                details=errors
+            )
+
+        filename = os.path.basename(file_path)
+        if cache_key:
+            job.report(phase="cache")
+            store_in_cache(file_path, cache_key)
+
+        # Registrar descarga exitosa
+        complete_download(download_id, user_id, url, filename)
         
-        try:
-            stdout, stderr = process.communicate(timeout=120)  # 2 minutos de timeout
-            logger.info("Salida de spotdl:")
-            logger.info(f"STDOUT: {stdout}")
-            logger.info(f"STDERR: {stderr}")
-            
-            # Verificar si hay error de FFmpeg
-            if "FFmpegError:" in stdout:
-                error_msg = "Error de FFmpeg durante la conversión"
-                error_details = stdout.strip()
-                logger.error(f"[spotdl] {error_msg}: {error_details}")
-                register_new_download(session_user['id'], url, "", 'failed', f"{error_msg}\n{error_details}")
-                return jsonify({
-                    "error": error_msg,
-                    "details": error_details,
-                    "suggestion": "Verifica que FFmpeg esté correctamente instalado y configurado"
-                }), 500
-            
-            # Verificar otros errores
-            if process.returncode != 0:
-                error_msg = "Error en la descarga"
-                error_details = f"STDOUT: {stdout.strip()}\nSTDERR: {stderr.strip()}"
-                logger.error(f"[spotdl] {error_msg}: {error_details}")
-                register_new_download(session_user['id'], url, "", 'failed', f"{error_msg}\n{error_details}")
-                return jsonify({
-                    "error": error_msg,
-                    "stdout": stdout.strip(),
-                    "stderr": stderr.strip()
-                }), 500
-
-            # Buscar archivo descargado
-            archivos = [f for f in os.listdir(user_folder) if f.endswith(".mp3")]
-            archivos.sort(key=lambda x: os.path.getmtime(os.path.join(user_folder, x)), reverse=True)
-            
-            if not archivos:
-                error_msg = "No se encontró el archivo descargado"
-                # Registrar error en la base de datos
-                register_new_download(session_user['id'], url, "", 'failed', error_msg)
-                return jsonify({
-                    "error": error_msg,
-                    "stdout": stdout.strip(),
-                    "stderr": stderr.strip(),
-                    "files_in_directory": os.listdir(user_folder)
-                }), 500
-
-            # Registrar descarga exitosa
-            register_new_download(session_user['id'], url, archivos[0])
-            
-            filename = archivos[0]
-            return jsonify({
-                "message": "Descarga completada",
-                "file_url": f"/descargar/{filename}",
-                "filename": filename,
-                "file_size": os.path.getsize(os.path.join(user_folder, filename))
-            }), 200
+        return {
+            "message": "Descarga completada",
+            "file_url": get_file_url(filename),
+            "filename": filename,
+            "file_size": os.path.getsize(os.path.join(user_folder, filename))
+        }
 
-        except subprocess.TimeoutExpired:
-            process.kill()
-            error_msg = "La descarga tomó demasiado tiempo (120 segundos)"
-            # Registrar error de timeout
-            register_new_download(session_user['id'], url, "", 'failed', error_msg)
-            return jsonify({
-                "error": error_msg,
-                "suggestion": "Intenta con una canción individual en lugar de una playlist"
-            }), 500
-            
+    except JobError:
+        raise
     except Exception as e:
         import traceback
         error_traceback = traceback.format_exc()
-        print("[spotdl] Error completo en download_spdl:")
-        print(error_traceback)
-        
-        # Verificar el estado de spotdl
-        try:
-            subprocess.run(["spotdl", "--version"], check=True)
-        except Exception as spotdl_error:
-            print(f"[spotdl] Error adicional al verificar spotdl: {str(spotdl_error)}")
-        
-        # Verificar el estado de ffmpeg
-        try:
-            subprocess.run([os.path.join(FFMPEG_PATH), "-version"], check=True)
-        except Exception as ffmpeg_error:
-            print(f"[spotdl] Error adicional al verificar ffmpeg: {str(ffmpeg_error)}")
-        
+        logger.error(f"[spotdl] Error completo en run_spdl_job:\n{error_traceback}")
+        logger.error(f"[spotdl] Herramientas disponibles: {probe_tools(FFMPEG_PATH)}")
+
         error_msg = f"Error al descargar la canción: {str(e)}"
         # Registrar error general
-        register_new_download(session_user['id'], url, "", 'failed', error_msg)
-        return jsonify({
-            "error": error_msg,
-            "details": str(e),
-            "suggestion": "Asegúrese de tener spotdl y ffmpeg instalados correctamente",
-            "traceback": error_traceback
-        }), 500
+        fail_download(download_id, user_id, url, error_msg)
+        raise JobError(
+            error_msg,
+            details=str(e),
+            suggestion="Asegúrese de tener spotdl y ffmpeg instalados correctamente",
+            traceback=error_traceback
+        )
+
+def start_playlist(session_user, source, url, user_folder, audio_format):
+    """Encola una playlist o álbum; cada canción se descarga como un trabajo propio"""
+    storage_error = check_free_space()
+    if storage_error:
+        return jsonify({"error": storage_error}), 507
+    job = create_job(session_user['id'], source, url, kind='playlist')
+    submit_job(playlist_pool, job, run_playlist_job, source, url, user_folder, session_user['id'], audio_format)
+    return jsonify({
+        "message": "Playlist en cola",
+        **job.to_dict()
+    }), 202
+
+def expand_ytdl_playlist(url, audio_format):
+    """Lista las canciones de una playlist de YouTube sin resolver cada video"""
+    opts = dict(
+        optimize_ydl_opts(audio_format),
+        extract_flat="in_playlist",
+        noplaylist=False,
+        playlistend=MAX_PLAYLIST_TRACKS
+    )
+    with pooled_ydl(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    tracks = []
+    for entry in (info or {}).get("entries") or []:
+        if entry and entry.get("url"):
+            tracks.append({"url": entry["url"], "title": entry.get("title")})
+    return tracks
 
+def expand_playlist(source, url, audio_format):
+    """Convierte una URL de playlist o álbum en la lista de canciones [{"url", "title"}]"""
+    if source == 'youtube':
+        return expand_ytdl_playlist(url, audio_format)
+    settings = AUDIO_FORMATS[audio_format]
+    return spotdl_expand(url, settings["spotdl_format"], settings["spotdl_bitrate"], FFMPEG_PATH,
+                         timeout=SPOTDL_TIMEOUT)
+
+def run_playlist_job(job, source, url, user_folder, user_id, audio_format):
+    """Trabajo coordinador de una playlist
+
+    Reparte las canciones en trabajos individuales (con caché y descargas
+    compartidas como cualquier otra canción), con como mucho
+    PLAYLIST_CONCURRENCY en curso a la vez, y publica el estado de cada una.
+    Las canciones terminadas quedan disponibles aunque otras fallen.
+    """
+    job.report(phase="resolve")
+    try:
+        tracks = expand_playlist(source, url, audio_format)[:MAX_PLAYLIST_TRACKS]
+    except Exception as e:
+        logger.error(f"[playlist] Error al leer la playlist {url}: {e}")
+        raise JobError(f"No se pudo leer la playlist: {str(e)}")
+    if not tracks:
+        raise JobError("La playlist no tiene canciones")
+
+    logger.info(f"[playlist] {len(tracks)} canciones en {url}")
+    submit_track = submit_ytdl_track if source == 'youtube' else submit_spdl_track
+    states = [{"url": track["url"], "title": track["title"], "status": "queued"} for track in tracks]
+    slots = threading.Semaphore(PLAYLIST_CONCURRENCY)
+    lock = threading.Lock()
+
+    def publish():
+        job.report(
+            phase="fetch",
+            total=len(states),
+            completed=sum(1 for state in states if state["status"] == JOB_SUCCESS),
+            failed=sum(1 for state in states if state["status"] == JOB_FAILED),
+            tracks=[dict(state) for state in states]
+        )
+
+    def track_finished(index, track_job):
+        with lock:
+            states[index]["status"] = track_job.status
+            if track_job.status == JOB_SUCCESS:
+                states[index]["filename"] = track_job.result["filename"]
+            else:
+                states[index]["error"] = track_job.error
+            publish()
+        slots.release()
+
+    track_jobs = []
+    for index, track in enumerate(tracks):
+        slots.acquire()
+        track_job = submit_track(user_id, track["url"], user_folder, audio_format)
+        with lock:
+            states[index].update(status=JOB_RUNNING, job_id=track_job.id)
+            publish()
+        track_job.add_done_callback(lambda track_job, index=index: track_finished(index, track_job))
+        track_jobs.append(track_job)
+
+    for track_job in track_jobs:
+        track_job.wait()
+
+    files = [state["filename"] for state in states if state["status"] == JOB_SUCCESS]
+    failed = len(states) - len(files)
+    if not files:
+        raise JobError("No se pudo descargar ninguna canción de la playlist", tracks=states)
+
+    return {
+        "message": f"Playlist descargada: {len(files)} de {len(states)} canciones",
+        "file_url": "/descargar_todo?" + urlencode([("files", filename) for filename in files]),
+        "files": files,
+        "completed": len(files),
+        "failed": failed,
+        "tracks": states
+    }
@@ -1,20 +1,18 @@
-from flask import send_file, jsonify
+from flask import jsonify, request
 import os
-import shutil
-import zipfile
-from datetime import datetime, timedelta
-import hashlib
-from functools import lru_cache
+from datetime import datetime
 import mimetypes
 import logging
 from database.core import db
+from database.history import history_writer
+from routes.cache import get_file_crc, save_file_crc, get_file_sha256
+from routes.delivery import send_download, send_zip
 
 # Configuración
 BASE_DIR = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
 DOWNLOAD_FOLDER = os.path.join(BASE_DIR, "downloads")
 CACHE_FOLDER = os.path.join(BASE_DIR, "cache")
-MAX_CACHE_AGE = 24 * 60 * 60  # 24 horas en segundos
-MAX_ZIP_SIZE = 500 * 1024 * 1024  # 500MB
+AUDIO_EXTENSIONS = ('.mp3', '.m4a', '.opus', '.ogg', '.flac', '.wav')
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -40,51 +38,15 @@ def get_user_folder(session_user):
     os.makedirs(user_folder, exist_ok=True)
     return user_folder
 
-def clear_user_folder(session_user):
-    """Limpia la carpeta del usuario eliminando todos los archivos.
-    
-    Args:
-        session_user: Diccionario con los datos del usuario
-    """
-    if not session_user or 'username' not in session_user:
-        return
-        
-    user_folder = get_user_folder(session_user)
-    try:
-        # Eliminar todos los archivos en la carpeta
-        for filename in os.listdir(user_folder):
-            file_path = os.path.join(user_folder, filename)
-            try:
-                if os.path.isfile(file_path):
-                    os.unlink(file_path)
-                    logger.info(f"Archivo eliminado: {file_path}")
-            except Exception as e:
-                logger.error(f"Error al eliminar {file_path}: {e}")
-        
-        logger.info(f"Carpeta del usuario {session_user['username']} limpiada exitosamente")
-    except Exception as e:
-        logger.error(f"Error al limpiar la carpeta del usuario {session_user['username']}: {e}")
+def get_file_hash(file_path, stat=None):
+    """Obtiene el hash SHA-256 de un archivo.
 
-def cleanup_old_files(folder, max_age=MAX_CACHE_AGE):
-    try:
-        current_time = datetime.now().timestamp()
-        for filename in os.listdir(folder):
-            filepath = os.path.join(folder, filename)
-            if os.path.getmtime(filepath) < current_time - max_age:
-                try:
-                    os.remove(filepath)
-                    logger.info(f"Archivo eliminado por antiguo: {filepath}")
-                except OSError as e:
-                    logger.error(f"Error al eliminar archivo {filepath}: {e}")
-    except Exception as e:
-        logger.error(f"Error en cleanup_old_files: {e}")
-
-@lru_cache(maxsize=100)
-def get_file_hash(file_path):
-    """Calcula el hash MD5 de un archivo."""
+    Se calcula una sola vez por archivo (normalmente al guardarlo en caché) y
+    se guarda en el índice por inodo, así que no queda obsoleto si el archivo
+    se reemplaza.
+    """
     try:
-        with open(file_path, 'rb') as f:
-            return hashlib.md5(f.read()).hexdigest()
+        return get_file_sha256(file_path, stat)
     except Exception as e:
         logger.error(f"Error calculando hash para {file_path}: {e}")
         return None
@@ -92,17 +54,9 @@ def get_file_hash(file_path):
 def get_last_download(user_id):
     """Obtiene la última descarga exitosa del usuario desde la base de datos."""
     try:
-        with db.get_cursor() as cursor:
-            query = """
-                SELECT filename 
-                FROM DOWNLOAD_HISTORY 
-                WHERE user_id = %s AND status = 'success'
-                ORDER BY download_date DESC 
-                LIMIT 1
-            """
-            cursor.execute(query, (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        history_writer.flush(user_id)
+        downloads = db.get_user_downloads(user_id, 1, status='success')
+        return downloads[0]['filename'] if downloads else None
     except Exception as e:
         logger.error(f"Error al obtener última descarga: {e}")
         return None
@@ -116,7 +70,9 @@ def descargar_archivo(session_user, filename=None):
         user_folder = get_user_folder(session_user)
         
         if filename:
-            # Si se proporciona un nombre de archivo específico
+            # Si se proporciona un nombre de archivo específico (solo dentro de la carpeta del usuario)
+            if os.path.basename(filename) != filename or filename.startswith('.'):
+                return jsonify({"error": "Nombre de archivo no válido"}), 400
             file_path = os.path.join(user_folder, filename)
             if not os.path.exists(file_path):
                 return jsonify({"error": "Archivo no encontrado"}), 404
@@ -137,7 +93,7 @@ def descargar_archivo(session_user, filename=None):
                 if not os.path.exists(user_folder) or not os.listdir(user_folder):
                     return jsonify({"error": "No hay archivos disponibles"}), 404
                     
-                archivos = [f for f in os.listdir(user_folder) if f.lower().endswith(('.mp3', '.m4a', '.wav'))]
+                archivos = [f for f in os.listdir(user_folder) if f.lower().endswith(AUDIO_EXTENSIONS)]
                 if not archivos:
                     return jsonify({"error": "No hay archivos de música disponibles"}), 404
                     
@@ -161,86 +117,77 @@ def descargar_archivo(session_user, filename=None):
         logger.info(f"Enviando archivo: {file_path}")
         logger.info(f"Tipo MIME: {mime_type}")
 
-        # Enviar el archivo
-        return send_file(
-            file_path,
-            mimetype=mime_type,
-            as_attachment=True,
-            download_name=filename
-        )
+        # Enviar el archivo (Flask o el proxy, según FILE_DELIVERY)
+        return send_download(file_path, filename, mime_type)
 
     except Exception as e:
         logger.error(f"Error en descargar_archivo: {e}")
         return jsonify({"error": str(e)}), 500
 
+def get_zip_entries(user_folder, archivos):
+    """Entradas del ZIP con tamaño, fecha y el CRC ya calculado si existe"""
+    entries = []
+    for archivo in archivos:
+        file_path = os.path.join(user_folder, archivo)
+        stat = os.stat(file_path)
+        entries.append({
+            "path": file_path,
+            "name": archivo,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "crc": get_file_crc(file_path, stat),
+            "stat": stat,
+        })
+    return entries
+
+def save_zip_crc(entry, crc):
+    """Guarda un CRC calculado durante el envío para los siguientes ZIP"""
+    try:
+        save_file_crc(entry["path"], crc, entry["stat"])
+    except Exception as e:
+        logger.error(f"Error al guardar el CRC de {entry['path']}: {e}")
+
 def descargar_todo(session_user):
+    """Descarga en un ZIP los archivos de música del usuario (o los indicados en ?files=)
+
+    El ZIP se genera mientras se envía: no hay archivo temporal, la memoria
+    usada no depende del número ni del tamaño de los archivos y el primer
+    byte sale de inmediato.
+    """
     try:
+        if not session_user or 'username' not in session_user:
+            return jsonify({"error": "Usuario no autenticado"}), 401
+
         user_folder = get_user_folder(session_user)
         logger.info(f"Preparando ZIP de la carpeta: {user_folder}")
 
-        archivos = [f for f in os.listdir(user_folder) if f.lower().endswith(('.mp3', '.m4a', '.wav'))]
+        archivos = [f for f in os.listdir(user_folder) if f.lower().endswith(AUDIO_EXTENSIONS)]
+
+        # Subconjunto elegido por el cliente (p. ej. las canciones de una playlist)
+        seleccion = request.args.getlist('files')
+        if seleccion:
+            desconocidos = [f for f in seleccion if f not in archivos]
+            if desconocidos:
+                return jsonify({
+                    "error": "Algunos archivos no existen",
+                    "files": desconocidos
+                }), 404
+            archivos = list(dict.fromkeys(seleccion))
+
         if not archivos:
             return jsonify({"error": "No hay archivos de música para descargar"}), 404
 
         archivos.sort(key=lambda x: os.path.getmtime(os.path.join(user_folder, x)), reverse=True)
-        
-        total_size = sum(os.path.getsize(os.path.join(user_folder, f)) for f in archivos)
-        if total_size > MAX_ZIP_SIZE:
-            size_mb = total_size / (1024 * 1024)
-            limit_mb = MAX_ZIP_SIZE / (1024 * 1024)
-            return jsonify({
-                "error": "El tamaño total excede el límite permitido",
-                "size_mb": round(size_mb, 2),
-                "limit_mb": round(limit_mb, 2),
-                "suggestion": "Descargue los archivos individualmente o en grupos más pequeños"
-            }), 413
+
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        username = session_user.get('username', 'user') if session_user else 'user'
+        username = session_user.get('username', 'user')
         zip_name = f"music_{username}_{timestamp}.zip"
-        
-        temp_folder = os.path.join(DOWNLOAD_FOLDER, "temp")
-        os.makedirs(temp_folder, exist_ok=True)
-        zip_path = os.path.join(temp_folder, zip_name)
-
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            total_files = len(archivos)
-            for i, archivo in enumerate(archivos, 1):
-                file_path = os.path.join(user_folder, archivo)
-                try:
-                    zipf.write(file_path, os.path.basename(file_path))
-                    logger.info(f"Progreso: {i}/{total_files} - Añadido: {os.path.basename(file_path)}")
-                except Exception as e:
-                    logger.error(f"Error al comprimir {archivo}: {e}")
-
-        if not os.path.exists(zip_path):
-            return jsonify({"error": "Error al crear el archivo ZIP"}), 500
-
-        # Obtener el tamaño final del ZIP
-        zip_size = os.path.getsize(zip_path)
-        logger.info(f"ZIP creado: {zip_name} ({zip_size / (1024*1024):.2f} MB)")
-
-        response = send_file(
-            zip_path,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=zip_name,
-            max_age=0
-        )
-
-        def cleanup_zip():
-            try:
-                if os.path.exists(zip_path):
-                    os.remove(zip_path)
-                    logger.info(f"ZIP temporal eliminado: {zip_path}")
-            except OSError as e:
-                logger.error(f"Error al eliminar ZIP temporal {zip_path}: {e}")
-
-        response.call_on_close(cleanup_zip)
-        return response
+
+        return send_zip(get_zip_entries(user_folder, archivos), zip_name, on_crc=save_zip_crc)
 
     except Exception as e:
         logger.error(f"Error en descargar_todo: {e}")
         return jsonify({
             "error": "Error al crear el archivo ZIP",
             "details": str(e)
-        }), 500
\ No newline at end of file
+        }), 500
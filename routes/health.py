@@ -0,0 +1,88 @@
+import os
+import time
+import threading
+import importlib
+import logging
+from flask import jsonify
+from database.core import db
+from routes.tools import probe_tools
+
+# Configuración del logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cada cuántos segundos se vuelve a comprobar la base de datos en segundo plano
+HEALTH_CHECK_INTERVAL = int(os.getenv('HEALTH_CHECK_INTERVAL', '15'))
+# Módulos pesados que se importan durante el calentamiento y no en el arranque
+WARMUP_MODULES = ("yt_dlp",)
+
+_checks = {}
+_checks_lock = threading.Lock()
+_warmup_pid = None
+_warmup_lock = threading.Lock()
+
+def _set_check(name, ok, detail=None):
+    with _checks_lock:
+        _checks[name] = {"ok": ok, "detail": detail, "checked_at": time.time()}
+
+def _warmup_loop(ffmpeg_path):
+    """Calentamiento en segundo plano y comprobaciones periódicas
+
+    Importa los módulos pesados, comprueba las herramientas externas una vez
+    y crea el pool de la base de datos; después vuelve a comprobar la base de
+    datos cada HEALTH_CHECK_INTERVAL segundos. /readyz solo lee estos
+    resultados, así que las sondas del balanceador nunca hacen trabajo real.
+    """
+    for module in WARMUP_MODULES:
+        start = time.monotonic()
+        try:
+            importlib.import_module(module)
+            logger.info(f"[health] {module} importado en {time.monotonic() - start:.2f}s")
+        except ImportError as e:
+            logger.error(f"[health] No se pudo importar {module}: {e}")
+
+    tools = probe_tools(ffmpeg_path)
+    _set_check("ffmpeg", bool(tools["ffmpeg"]), tools["ffmpeg"] or f"no disponible en {ffmpeg_path}")
+    _set_check("spotdl", bool(tools["spotdl"]), tools["spotdl"] or "no instalado")
+
+    while True:
+        try:
+            db.warm_up()
+            ok = db.health_check()
+            _set_check("db", ok, None if ok else "SELECT 1 falló")
+        except Exception as e:
+            _set_check("db", False, str(e))
+        time.sleep(HEALTH_CHECK_INTERVAL)
+
+def start_warmup(ffmpeg_path):
+    """Arranca el calentamiento una vez por proceso (también tras un fork de gunicorn)"""
+    global _warmup_pid
+    if _warmup_pid == os.getpid():
+        return
+    with _warmup_lock:
+        if _warmup_pid == os.getpid():
+            return
+        _warmup_pid = os.getpid()
+        threading.Thread(target=_warmup_loop, args=(ffmpeg_path,), name="warmup", daemon=True).start()
+
+def healthz():
+    """Liveness: el proceso responde (sin tocar dependencias)"""
+    return jsonify({"status": "ok"}), 200
+
+def readyz():
+    """Readiness: resultado cacheado de las comprobaciones de base de datos y herramientas
+
+    Listo cuando la base de datos y ffmpeg responden; spotdl se informa pero
+    no es obligatorio (sin él solo fallan las descargas de Spotify).
+    """
+    with _checks_lock:
+        checks = {name: dict(check) for name, check in _checks.items()}
+    now = time.time()
+    for check in checks.values():
+        check["age"] = round(now - check.pop("checked_at"), 1)
+
+    ready = all(checks.get(name, {}).get("ok") for name in ("db", "ffmpeg"))
+    return jsonify({
+        "status": "ready" if ready else "starting" if len(checks) < 3 else "unavailable",
+        "checks": checks
+    }), 200 if ready else 503
@@ -11,10 +11,6 @@ def limpiar_carpeta():
             os.remove(archivo_path)
 
 def index():
+    # La carpeta del usuario se crea al descargar (get_user_folder), no en cada visita
     session_user = session.get('user')
-    if session_user:
-        # Crear carpeta personal del usuario si no existe
-        user_folder = os.path.join(DOWNLOAD_FOLDER, session_user['username'])
-        os.makedirs(user_folder, exist_ok=True)
-    
     return render_template('index.html', session_user=session_user)
\ No newline at end of file
@@ -0,0 +1,259 @@
+import json
+import threading
+import time
+import uuid
+import logging
+import traceback
+from routes.metrics import download_phase_seconds, download_seconds
+
+# Configuración del logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+JOB_TTL = 60 * 60  # Tiempo que se conservan los trabajos terminados (1 hora)
+EVENT_HEARTBEAT = 15  # Segundos entre comentarios keep-alive del stream SSE
+
+# Estados posibles de un trabajo
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCESS = 'success'
+JOB_FAILED = 'failed'
+
+# Fases cuya duración se mide (las demás, como done/error, no tienen duración)
+TIMED_PHASES = ("queued", "resolve", "fetch", "transcode", "metadata", "thumbnail", "cache")
+
+# Estado en la memoria del proceso: la aplicación corre con un solo worker (ver gunicorn.conf.py)
+_jobs = {}
+_flights = {}  # Clave del medio -> trabajo que lo está descargando
+_jobs_lock = threading.Lock()
+
+class JobError(Exception):
+    """Error de un trabajo con datos adicionales para la respuesta JSON"""
+    def __init__(self, message, **payload):
+        super().__init__(message)
+        self.payload = payload
+
+class Job:
+    """Trabajo de descarga ejecutado fuera del ciclo de la petición"""
+
+    def __init__(self, user_id, source, url, kind='track'):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.source = source
+        self.url = url
+        self.kind = kind  # 'track' o 'playlist' (solo las canciones alimentan las métricas de fases)
+        self.leader = None  # Trabajo al que está adjuntado (ver submit_shared_job)
+        self.status = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.details = {}
+        self.progress = {"phase": "queued"}
+        self.followers = []
+        self.callbacks = []
+        self.version = 0
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._phase_started = time.monotonic()
+        self._changed = threading.Condition()
+
+    @property
+    def timed(self):
+        """Si el trabajo alimenta las métricas (los adjuntos repiten las fases de su líder)"""
+        return self.kind == 'track' and self.leader is None
+
+    def _close_phase(self, now):
+        """Observa la duración de la fase actual (con el lock tomado)"""
+        phase = self.progress.get("phase")
+        if self.timed and phase in TIMED_PHASES:
+            download_phase_seconds.observe(now - self._phase_started, source=self.source, phase=phase)
+        self._phase_started = now
+
+    @property
+    def finished(self):
+        return self.status in (JOB_SUCCESS, JOB_FAILED)
+
+    def report(self, **fields):
+        """Actualiza el progreso del trabajo (y de los que esperan su resultado)"""
+        with self._changed:
+            if fields.get("phase", self.progress.get("phase")) != self.progress.get("phase"):
+                self._close_phase(time.monotonic())
+            self.progress.update(fields)
+            self.updated_at = time.time()
+            self.version += 1
+            self._changed.notify_all()
+        for follower in list(self.followers):
+            follower.report(**fields)
+
+    def set_status(self, status):
+        """Cambia el estado del trabajo y despierta a los suscriptores"""
+        with self._changed:
+            self.status = status
+            if self.finished:
+                self._close_phase(time.monotonic())
+                if self.timed:
+                    download_seconds.observe(time.time() - self.created_at, source=self.source, status=status)
+                self.progress["phase"] = "done" if status == JOB_SUCCESS else "error"
+                callbacks, self.callbacks = self.callbacks, []
+            else:
+                callbacks = []
+            self.updated_at = time.time()
+            self.version += 1
+            self._changed.notify_all()
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """Llama a callback(trabajo) cuando el trabajo termine (o ya, si terminó)"""
+        with self._changed:
+            if not self.finished:
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def wait(self, timeout=None):
+        """Espera a que el trabajo termine; devuelve True si terminó"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.finished, timeout)
+
+    def wait_for_update(self, version, timeout=None):
+        """Espera hasta que la versión del trabajo cambie; devuelve la versión actual"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def to_dict(self):
+        """Representación JSON del trabajo"""
+        with self._changed:
+            progress = dict(self.progress)
+        data = {
+            "job_id": self.id,
+            "source": self.source,
+            "url": self.url,
+            "status": self.status,
+            "status_url": f"/jobs/{self.id}",
+            "events_url": f"/jobs/{self.id}/events",
+            "progress": progress,
+        }
+        if self.status == JOB_SUCCESS and self.result:
+            data.update(self.result)
+        if self.status == JOB_FAILED:
+            data["error"] = self.error
+            data.update(self.details)
+        return data
+
+def _prune_jobs():
+    """Elimina los trabajos terminados más antiguos que JOB_TTL"""
+    limit = time.time() - JOB_TTL
+    expired = [job_id for job_id, job in _jobs.items() if job.finished and job.updated_at < limit]
+    for job_id in expired:
+        del _jobs[job_id]
+
+def create_job(user_id, source, url, kind='track'):
+    """Crea y registra un nuevo trabajo en estado 'queued'"""
+    job = Job(user_id, source, url, kind)
+    with _jobs_lock:
+        _prune_jobs()
+        _jobs[job.id] = job
+    return job
+
+def get_job(job_id, user_id=None):
+    """Obtiene un trabajo por ID; si se indica user_id, solo si le pertenece"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+    if job is None or (user_id is not None and job.user_id != user_id):
+        return None
+    return job
+
+def _run_job(job, func, args, kwargs):
+    job.set_status(JOB_RUNNING)
+    try:
+        job.result = func(job, *args, **kwargs)
+        status = JOB_SUCCESS
+    except JobError as e:
+        job.error = str(e)
+        job.details = e.payload
+        status = JOB_FAILED
+    except Exception as e:
+        logger.error(f"[jobs] Error inesperado en el trabajo {job.id}:\n{traceback.format_exc()}")
+        job.error = str(e)
+        status = JOB_FAILED
+    job.set_status(status)
+    logger.info(f"[jobs] Trabajo {job.id} ({job.source}) terminado: {job.status}")
+
+def submit_job(executor, job, func, *args, **kwargs):
+    """Ejecuta func en el pool indicado y guarda su resultado en el trabajo
+
+    Args:
+        executor: Pool de hilos donde se ejecuta el trabajo
+        job: Trabajo creado con create_job
+        func: Función que recibe el trabajo como primer argumento y devuelve
+            un diccionario con el resultado o lanza JobError
+    """
+    executor.submit(_run_job, job, func, args, kwargs)
+    return job
+
+def submit_shared_job(executor, job, key, func, follow, *args):
+    """Ejecuta func una sola vez por clave aunque lleguen varios trabajos a la vez
+
+    Si ya hay un trabajo en curso con la misma clave, el nuevo trabajo se
+    adjunta a él sin ocupar un hilo del pool: recibe su progreso y, cuando
+    termina, se completa con follow(job, líder, *args).
+
+    Args:
+        executor: Pool de hilos donde se ejecuta el trabajo líder
+        job: Trabajo creado con create_job
+        key: Clave canónica del medio (p. ej. la clave de caché)
+        func: Función del trabajo líder, igual que en submit_job
+        follow: Función que recibe el trabajo adjunto y el líder ya terminado
+    """
+    with _jobs_lock:
+        flight = _flights.get(key)
+        if flight is None:
+            _flights[key] = {"leader": job, "followers": []}
+        else:
+            flight["followers"].append((job, args))
+            flight["leader"].followers.append(job)
+            job.leader = flight["leader"]
+
+    if flight is None:
+        executor.submit(_run_flight, key, job, func, follow, args)
+    else:
+        leader = flight["leader"]
+        logger.info(f"[jobs] Trabajo {job.id} adjuntado a la descarga en curso {leader.id} ({key})")
+        job.set_status(JOB_RUNNING)
+        with leader._changed:
+            progress = dict(leader.progress)
+        job.report(**progress)
+    return job
+
+def _run_flight(key, job, func, follow, args):
+    _run_job(job, func, args, {})
+    with _jobs_lock:
+        flight = _flights.pop(key)
+    for follower, follower_args in flight["followers"]:
+        _run_job(follower, follow, (job,) + follower_args, {})
+
+def count_jobs():
+    """Trabajos en memoria por (tipo, fuente, estado), para las métricas"""
+    counts = {}
+    with _jobs_lock:
+        for job in _jobs.values():
+            key = (job.kind, job.source, job.status)
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def iter_job_events(job):
+    """Generador de eventos Server-Sent Events con el estado del trabajo
+
+    Emite el estado actual en cada cambio y termina cuando el trabajo finaliza.
+    """
+    version = None
+    while True:
+        current = job.wait_for_update(version, timeout=EVENT_HEARTBEAT)
+        if current == version:
+            yield ": keep-alive\n\n"
+            continue
+        version = current
+        yield f"data: {json.dumps(job.to_dict())}\n\n"
+        if job.finished:
+            return
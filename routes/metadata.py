@@ -0,0 +1,171 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qsl
+from routes.cache import get_media_id, canonicalize_url
+
+# Configuración del logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Configuración
+METADATA_TTL = int(os.getenv('METADATA_TTL', str(6 * 60 * 60)))  # 6 horas
+METADATA_CACHE_SIZE = int(os.getenv('METADATA_CACHE_SIZE', '2000'))
+MAX_DURATION = int(os.getenv('MAX_DURATION', str(60 * 60)))  # 1 hora
+MAX_FILESIZE = int(os.getenv('MAX_FILESIZE', str(200 * 1024 * 1024)))  # 200 MB
+
+class PreflightError(Exception):
+    """El medio no se puede descargar (no disponible, en directo o demasiado grande)"""
+    pass
+
+class MetadataCache:
+    """Caché en memoria con TTL y tamaño máximo para resultados de extract_info"""
+
+    def __init__(self, max_entries=METADATA_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires_at'] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+metadata_cache = MetadataCache()
+
+def get_metadata_key(url):
+    """Clave de metadatos: ID canónico del medio o la URL normalizada"""
+    media = get_media_id(url)
+    if media:
+        return f"{media[0]}-{media[1]}"
+    return canonicalize_url(url)
+
+def _url_expiry(url):
+    """Momento en que caduca la URL firmada de un formato (parámetro 'expire')"""
+    try:
+        expire = dict(parse_qsl(urlsplit(url).query)).get('expire')
+        return float(expire) if expire else None
+    except ValueError:
+        return None
+
+def _compact_format(fmt):
+    """Conserva solo los campos del formato que usa la aplicación"""
+    return {
+        'format_id': fmt.get('format_id'),
+        'url': fmt.get('url'),
+        'ext': fmt.get('ext'),
+        'acodec': fmt.get('acodec'),
+        'abr': fmt.get('abr'),
+        'filesize': fmt.get('filesize') or fmt.get('filesize_approx'),
+        'http_headers': fmt.get('http_headers'),
+        'expires_at': _url_expiry(fmt.get('url') or ''),
+    }
+
+def compact_info(info):
+    """Reduce un info_dict de yt-dlp a los campos que usa la aplicación"""
+    formats = info.get('requested_formats') or [info]
+    return {
+        'id': info.get('id'),
+        'extractor': (info.get('extractor_key') or info.get('extractor') or 'url').lower(),
+        'title': info.get('title'),
+        'uploader': info.get('uploader'),
+        'duration': info.get('duration'),
+        'is_live': bool(info.get('is_live')),
+        'formats': [_compact_format(fmt) for fmt in formats if fmt.get('url')],
+        'expires_at': time.time() + METADATA_TTL,
+    }
+
+def get_valid_formats(metadata):
+    """Formatos cacheados cuyas URLs firmadas aún no han caducado"""
+    now = time.time()
+    return [fmt for fmt in metadata['formats'] if not fmt['expires_at'] or fmt['expires_at'] > now]
+
+def get_canonical_key(metadata):
+    """ID canónico obtenido del extractor (sirve para URLs no reconocidas)"""
+    return f"{metadata['extractor']}-{metadata['id']}"
+
+def validate_metadata(metadata):
+    """Lanza PreflightError si el medio no se debe descargar"""
+    if metadata['is_live']:
+        raise PreflightError("No se pueden descargar transmisiones en directo")
+    duration = metadata.get('duration')
+    if duration and duration > MAX_DURATION:
+        raise PreflightError(f"El audio dura más de {MAX_DURATION // 60} minutos")
+    filesize = sum(fmt['filesize'] or 0 for fmt in metadata['formats'])
+    if filesize > MAX_FILESIZE:
+        raise PreflightError(f"El archivo supera el tamaño máximo de {MAX_FILESIZE // (1024 * 1024)} MB")
+
+def get_cached_metadata(url):
+    """Metadatos ya resueltos para la URL, sin acceder a la red"""
+    return metadata_cache.get(get_metadata_key(url))
+
+def preflight(url, ydl):
+    """Resuelve los metadatos (desde la caché si es posible) y valida el medio
+
+    Args:
+        url: URL del medio
+        ydl: Instancia de YoutubeDL usada para extract_info
+
+    Returns:
+        tuple: (metadatos compactos, info_dict completo o None si vino de la caché).
+            El info_dict permite descargar sin volver a resolver la página.
+    """
+    key = get_metadata_key(url)
+    metadata = metadata_cache.get(key)
+    info = None
+    if metadata is None:
+        from yt_dlp.utils import DownloadError  # Ya cargado: ydl es una instancia de YoutubeDL
+        try:
+            info = ydl.extract_info(url, download=False)
+        except DownloadError as e:
+            raise PreflightError(f"El medio no está disponible: {e}")
+        if not info:
+            raise PreflightError("El medio no está disponible")
+
+        metadata = compact_info(info)
+        metadata_cache.set(key, metadata)
+        metadata_cache.set(get_canonical_key(metadata), metadata)
+        logger.info(f"[metadata] Metadatos resueltos para {key}: {metadata['title']}")
+
+    validate_metadata(metadata)
+    return metadata, info
+
+def resolve_media_format(url, ydl):
+    """Metadatos validados y un formato de audio cuya URL firmada sigue vigente
+
+    Si las URLs cacheadas ya caducaron, se vuelven a resolver.
+
+    Returns:
+        tuple: (metadatos compactos, formato compacto con "url" y "http_headers")
+    """
+    metadata, info = preflight(url, ydl)
+    formats = get_valid_formats(metadata)
+    if not formats and info is None:
+        metadata_cache.delete(get_metadata_key(url))
+        metadata_cache.delete(get_canonical_key(metadata))
+        metadata, info = preflight(url, ydl)
+        formats = get_valid_formats(metadata)
+
+    audio_formats = [fmt for fmt in formats if fmt.get('acodec') != 'none']
+    if not audio_formats:
+        raise PreflightError("No hay un formato de audio disponible")
+    return metadata, audio_formats[0]
@@ -0,0 +1,188 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response
+
+# Límites de los histogramas de duración (segundos): de operaciones locales a descargas largas
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Límites para las operaciones de la base de datos (esperas del pool, lotes del historial)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+_collectors = []
+_registry_lock = threading.Lock()
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    """Métrica con etiquetas en el formato de texto de Prometheus"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            state["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            state["sum"] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observa la duración del bloque"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, {"counts": list(state["counts"]), "sum": state["sum"]})
+                           for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state["counts"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+def register_collector(collector):
+    """Registra una función que devuelve métricas leídas en el momento del scrape
+
+    La función devuelve una lista de (nombre, tipo, ayuda, [(etiquetas, valor)]),
+    con las etiquetas como dict. Sirve para estado que ya existe en otro sitio
+    (pools de hilos, pool de la base de datos) sin duplicarlo.
+    """
+    with _registry_lock:
+        _collectors.append(collector)
+    return collector
+
+def render_metrics():
+    """Todas las métricas en el formato de texto de Prometheus"""
+    with _registry_lock:
+        metrics = list(_metrics)
+        collectors = list(_collectors)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collector in collectors:
+        for name, kind, documentation, samples in collector():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def metrics_endpoint():
+    """Endpoint /metrics para Prometheus"""
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+def executor_collector(pools):
+    """Collector con la cola y los hilos ocupados de cada ThreadPoolExecutor
+
+    Args:
+        pools: Diccionario nombre -> ThreadPoolExecutor
+    """
+    def collect():
+        queued, busy, size = [], [], []
+        for name, executor in pools.items():
+            labels = {"pool": name}
+            # Estado interno de ThreadPoolExecutor: leerlo no cuesta nada en el camino de los trabajos
+            threads = len(executor._threads)
+            idle = executor._idle_semaphore._value
+            queued.append((labels, executor._work_queue.qsize()))
+            busy.append((labels, max(threads - idle, 0)))
+            size.append((labels, executor._max_workers))
+        return [
+            ("downloader_executor_queue_depth", "gauge", "Tareas esperando un hilo libre", queued),
+            ("downloader_executor_busy_workers", "gauge", "Hilos ejecutando una tarea", busy),
+            ("downloader_executor_max_workers", "gauge", "Tamaño máximo del pool de hilos", size),
+        ]
+    return collect
+
+# Métricas de la aplicación
+download_phase_seconds = Histogram(
+    "downloader_download_phase_seconds",
+    "Duración de cada fase de una descarga (queued, resolve, fetch, transcode, metadata, thumbnail, cache)",
+    ("source", "phase"))
+download_seconds = Histogram(
+    "downloader_download_seconds",
+    "Duración total de un trabajo de descarga, desde que se encola hasta que termina",
+    ("source", "status"))
+cache_lookups = Counter(
+    "downloader_cache_lookups_total",
+    "Búsquedas en la caché compartida por resultado (hit/miss)",
+    ("source", "result"))
+cache_evictions = Counter(
+    "downloader_cache_evictions_total",
+    "Entradas eliminadas de la caché compartida",
+    ("source",))
+db_pool_wait_seconds = Histogram(
+    "downloader_db_pool_acquire_wait_seconds",
+    "Espera por una conexión del pool de la base de datos en cada adquisición (0 si había una libre)",
+    ("backend",), buckets=DB_BUCKETS)
+history_write_seconds = Histogram(
+    "downloader_history_write_seconds",
+    "Duración de cada escritura de un lote del historial en la base de datos",
+    ("result",), buckets=DB_BUCKETS)
+zip_build_seconds = Histogram(
+    "downloader_zip_build_seconds",
+    "Tiempo en generar y enviar un ZIP de /descargar_todo",
+    ())
@@ -1,8 +1,8 @@
 from flask import Flask, render_template, request, jsonify, flash, redirect, url_for, session
-from database.core import DatabaseManager, DatabaseError
+from database.core import DatabaseManager, DatabaseError, DuplicateKeyError
 from datetime import datetime
 import os
-from routes.downs import clear_user_folder
+from routes.storage import request_user_cleanup
 
 # Obtener la instancia global del DatabaseManager
 db = DatabaseManager()
@@ -74,63 +74,31 @@ def register():
                 flash('La contraseña debe tener al menos 8 caracteres', 'error')
                 return redirect(url_for('register_route'))
 
-            # Verificar si el nombre de usuario ya existe
-            existing_username = db.execute_query(
-                "SELECT id FROM USER WHERE username = %s",
-                (username,),
-                fetch_one=True
-            )
-
-            if existing_username:
-                flash('El nombre de usuario ya está en uso. Por favor, elige otro.', 'error')
-                return redirect(url_for('register_route'))
-
-            # Verificar si el email ya existe
-            existing_email = db.execute_query(
-                "SELECT id FROM USER WHERE email = %s",
-                (email,),
-                fetch_one=True
-            )
-
-            if existing_email:
-                flash('Este correo electrónico ya está registrado. ¿Olvidaste tu contraseña?', 'error')
-                return redirect(url_for('register_route'))
-
             # Hash del password
             hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
 
             try:
-                # Insertar nuevo usuario
-                db.execute_query(
-                    "INSERT INTO USER (username, email, password) VALUES (%s, %s, %s)",
-                    (username, email, hashed_password)
-                )
-
-                # Obtener el usuario recién creado
-                user = db.execute_query(
-                    "SELECT id, username, email FROM USER WHERE username = %s",
-                    (username,),
-                    fetch_one=True
-                )
-
-                if user:
-                    # Convertir la tupla en un diccionario
-                    user_dict = {
-                        'id': user[0],
-                        'username': user[1],
-                        'email': user[2]
-                    }
-                    flash('¡Cuenta creada exitosamente! Bienvenido/a.', 'success')
-                    session['user'] = user_dict
-                    return redirect(url_for('index_route'))
+                # Un solo INSERT: los índices UNIQUE detectan usuario o email repetidos
+                user_id = db.create_user(username, email, hashed_password)
+            except DuplicateKeyError as e:
+                if e.field == 'email':
+                    flash('Este correo electrónico ya está registrado. ¿Olvidaste tu contraseña?', 'error')
                 else:
-                    raise DatabaseError('No se pudo obtener el usuario después de crearlo')
-
+                    flash('El nombre de usuario ya está en uso. Por favor, elige otro.', 'error')
+                return redirect(url_for('register_route'))
             except DatabaseError as e:
                 logger.error(f"Error al insertar nuevo usuario: {e}")
                 flash('Error al crear la cuenta. Por favor, inténtalo de nuevo.', 'error')
                 return redirect(url_for('register_route'))
 
+            flash('¡Cuenta creada exitosamente! Bienvenido/a.', 'success')
+            session['user'] = {
+                'id': user_id,
+                'username': username,
+                'email': email
+            }
+            return redirect(url_for('index_route'))
+
         except DatabaseError as e:
             logger.error(f"Error de base de datos durante el registro: {e}")
             flash('Ocurrió un error al crear tu cuenta. Por favor, inténtalo de nuevo.', 'error')
@@ -145,8 +113,8 @@ def register():
 def login():
     # Si el usuario ya está logueado, redirigir al inicio
     if 'user' in session:
-        # Limpiar la carpeta del usuario actual antes de redirigir
-        clear_user_folder(session['user'])
+        # Vaciar la carpeta del usuario actual (en segundo plano)
+        request_user_cleanup(session['user'])
         flash('Ya tienes una sesión iniciada', 'info')
         return redirect(url_for('index_route'))
 
@@ -163,28 +131,24 @@ def login():
                 flash('Por favor ingresa tu contraseña', 'error')
                 return redirect(url_for('index_route'))
 
-            # Buscar usuario
-            result = db.execute_query(
-                "SELECT id, username, email, password FROM USER WHERE username = %s",
-                (username,),
-                fetch_one=True
-            )
+            # Buscar usuario (cacheado unos segundos por DatabaseManager)
+            user = db.get_user_by_username(username)
 
-            if not result:
+            if not user:
                 flash('Usuario o contraseña incorrectos', 'error')
                 return redirect(url_for('index_route'))
 
             # Verificar contraseña
-            if check_password_hash(result[3], password):
+            if check_password_hash(user['password'], password):
                 # Crear la sesión del usuario
                 user_data = {
-                    'id': result[0],
-                    'username': result[1],
-                    'email': result[2]
+                    'id': user['id'],
+                    'username': user['username'],
+                    'email': user['email']
                 }
                 
-                # Limpiar la carpeta del usuario antes de iniciar sesión
-                clear_user_folder(user_data)
+                # Vaciar la carpeta del usuario (lo hace el janitor, no esta petición)
+                request_user_cleanup(user_data)
                 
                 session['user'] = user_data
                 
@@ -206,9 +170,9 @@ def login():
     return render_template('login.html')
 
 def logout():
-    # Limpiar la carpeta del usuario antes de cerrar sesión
+    # Vaciar la carpeta del usuario (en segundo plano)
     if 'user' in session:
-        clear_user_folder(session['user'])
+        request_user_cleanup(session['user'])
     
     # Cerrar sesión de usuario
     session.pop('user', None)
@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import threading
+import subprocess
+import logging
+import traceback
+
+# Configuración del logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Número de procesos de spotdl que pueden trabajar a la vez
+SPOTDL_WORKERS = int(os.getenv('SPOTDL_WORKERS', '2'))
+# Número de trabajos tras el que se recicla un proceso (limita el crecimiento de su memoria)
+SPOTDL_MAX_JOBS = int(os.getenv('SPOTDL_MAX_JOBS', '100'))
+SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
+SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
+OUTPUT_TEMPLATE = "{artists} - {title}.{output-ext}"
+# Comando del proceso de spotdl (los benchmarks lo sustituyen por un motor falso)
+ENGINE_COMMAND = [sys.executable, "-m", "routes.spotdl_engine"]
+
+class SpotdlEngineError(Exception):
+    """Error devuelto por un proceso de spotdl"""
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details
+
+class SpotdlTimeoutError(SpotdlEngineError):
+    """La descarga superó el tiempo máximo y el proceso se terminó"""
+    pass
+
+def _engine_main(requests, send):
+    """Bucle del proceso de spotdl: atiende peticiones hasta que se cierra la entrada
+
+    El cliente de Spotify, los proveedores de audio y el matcher se crean una
+    sola vez y se reutilizan entre descargas; solo hay un Downloader por cada
+    combinación de formato, bitrate y ffmpeg.
+    """
+    try:
+        from spotdl.download.downloader import Downloader
+        from spotdl.download.progress_handler import ProgressHandler
+        from spotdl.utils.config import SPOTIFY_OPTIONS
+        from spotdl.utils.search import parse_query
+        from spotdl.utils.spotify import SpotifyClient
+
+        SpotifyClient.init(
+            client_id=SPOTIFY_CLIENT_ID or SPOTIFY_OPTIONS["client_id"],
+            client_secret=SPOTIFY_CLIENT_SECRET or SPOTIFY_OPTIONS["client_secret"],
+            headless=True,
+        )
+        init_error = None
+    except Exception as e:
+        init_error = {"message": f"No se pudo iniciar spotdl: {e}", "traceback": traceback.format_exc()}
+
+    downloaders = {}
+    loop = None
+    for line in requests:
+        request = json.loads(line)
+        if init_error:
+            send("error", init_error)
+            continue
+
+        try:
+            key = (request["format"], request["bitrate"], request["ffmpeg"])
+            downloader = downloaders.get(key)
+            if downloader is None:
+                downloader = Downloader(
+                    settings={
+                        "format": request["format"],
+                        "bitrate": request["bitrate"],
+                        "ffmpeg": request["ffmpeg"],
+                        "simple_tui": True,
+                    },
+                    loop=loop,
+                )
+                downloaders[key] = downloader
+                loop = downloader.loop
+
+            if request.get("action") != "expand":
+                def update_callback(tracker, message):
+                    send("progress", {"song": tracker.song_name, "message": message, "progress": tracker.progress})
+
+                downloader.settings["output"] = os.path.join(request["output"], OUTPUT_TEMPLATE)
+                downloader.progress_handler = ProgressHandler(simple_tui=True, update_callback=update_callback)
+                downloader.errors.clear()
+                send("progress", {"song": None, "message": "Searching for song", "progress": 0})
+
+            settings = downloader.settings
+            songs = parse_query(
+                query=[request["url"]],
+                threads=settings["threads"],
+                use_ytm_data=settings["ytm_data"],
+                playlist_numbering=settings["playlist_numbering"],
+                album_type=settings["album_type"],
+                playlist_retain_track_cover=settings["playlist_retain_track_cover"],
+            )
+            if not songs:
+                send("error", {"message": "No se encontraron canciones para la URL"})
+                continue
+
+            # Expansión de playlist o álbum: solo las canciones, sin descargar
+            if request.get("action") == "expand":
+                send("done", {"tracks": [{"url": song.url, "title": song.display_name} for song in songs]})
+                continue
+
+            downloader.progress_handler.set_song_count(len(songs))
+            results = downloader.download_multiple_songs(songs)
+            send("done", {
+                "files": [str(path) for _, path in results if path],
+                "errors": list(downloader.errors),
+            })
+        except Exception as e:
+            send("error", {"message": str(e), "traceback": traceback.format_exc()})
+
+class SpotdlEngine:
+    """Proceso de spotdl de larga duración que atiende una descarga a la vez
+
+    Se comunica con el proceso mediante líneas JSON por stdin/stdout; un hilo
+    lector pasa los mensajes a una cola para poder esperar con timeout.
+    """
+
+    def __init__(self):
+        self.jobs = 0
+        self._messages = queue.Queue()
+        self._process = subprocess.Popen(
+            ENGINE_COMMAND,
+            cwd=BASE_DIR,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1
+        )
+        self._reader = threading.Thread(target=self._read_messages, name="spotdl-engine-reader", daemon=True)
+        self._reader.start()
+        logger.info(f"[spotdl] Proceso de spotdl iniciado (pid {self._process.pid})")
+
+    def _read_messages(self):
+        for line in self._process.stdout:
+            try:
+                self._messages.put(json.loads(line))
+            except ValueError:
+                logger.error(f"[spotdl] Mensaje no válido del proceso de spotdl: {line.strip()}")
+        self._messages.put(None)
+
+    @property
+    def alive(self):
+        return self._process.poll() is None
+
+    def run(self, request, on_progress=None, timeout=None):
+        """Envía una petición al proceso y espera su resultado
+
+        Raises:
+            SpotdlTimeoutError: Si no termina antes de timeout (el proceso se mata)
+            SpotdlEngineError: Si spotdl falla o el proceso muere
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        self.jobs += 1
+        try:
+            self._process.stdin.write(json.dumps(request) + "\n")
+            self._process.stdin.flush()
+        except OSError:
+            self.kill()
+            raise SpotdlEngineError("El proceso de spotdl terminó inesperadamente")
+
+        while True:
+            remaining = deadline - time.monotonic() if deadline else None
+            try:
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                message = self._messages.get(timeout=remaining)
+            except queue.Empty:
+                self.kill()
+                raise SpotdlTimeoutError(f"La descarga tomó demasiado tiempo ({timeout} segundos)")
+
+            if message is None:
+                self.kill()
+                raise SpotdlEngineError("El proceso de spotdl terminó inesperadamente")
+            kind, payload = message
+            if kind == "progress":
+                if on_progress:
+                    on_progress(payload)
+            elif kind == "done":
+                return payload
+            else:
+                raise SpotdlEngineError(payload["message"], payload.get("traceback"))
+
+    def kill(self):
+        if self.alive:
+            self._process.kill()
+        self._process.wait()
+
+    def close(self):
+        """Pide al proceso que termine y lo mata si no lo hace a tiempo"""
+        try:
+            self._process.stdin.close()
+            self._process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        self.kill()
+
+_idle = queue.LifoQueue()
+_slots = threading.BoundedSemaphore(SPOTDL_WORKERS)
+_engines = []
+_engines_lock = threading.Lock()
+
+def _acquire_engine():
+    """Toma un proceso libre (el más reciente primero) o arranca uno nuevo"""
+    while True:
+        try:
+            engine = _idle.get_nowait()
+        except queue.Empty:
+            engine = SpotdlEngine()
+            with _engines_lock:
+                _engines.append(engine)
+            return engine
+        if engine.alive and engine.jobs < SPOTDL_MAX_JOBS:
+            return engine
+        _discard_engine(engine)
+
+def _discard_engine(engine):
+    with _engines_lock:
+        if engine in _engines:
+            _engines.remove(engine)
+    engine.close()
+
+def spotdl_download(url, output, audio_format, bitrate, ffmpeg, on_progress=None, timeout=None):
+    """Descarga una URL de Spotify en un proceso de spotdl ya iniciado
+
+    Como mucho SPOTDL_WORKERS descargas se ejecutan a la vez; el resto espera
+    un proceso libre. Los procesos se arrancan la primera vez que se necesitan
+    y se reutilizan entre peticiones.
+
+    Args:
+        url: URL de Spotify (canción, álbum o playlist)
+        output: Carpeta donde se escriben los archivos
+        audio_format: Formato de salida de spotdl (mp3, m4a, opus...)
+        bitrate: Bitrate de spotdl ("disable" para copiar el audio sin recodificar)
+        ffmpeg: Ruta del ejecutable de ffmpeg
+        on_progress: Función que recibe {"song", "message", "progress"} en cada cambio
+        timeout: Segundos máximos de la descarga (sin contar la espera de un proceso)
+
+    Returns:
+        dict: {"files": rutas descargadas, "errors": errores reportados por spotdl}
+    """
+    return _run_request({
+        "url": url,
+        "output": output,
+        "format": audio_format,
+        "bitrate": bitrate,
+        "ffmpeg": ffmpeg,
+    }, on_progress, timeout)
+
+def spotdl_expand(url, audio_format, bitrate, ffmpeg, timeout=None):
+    """Obtiene las canciones de una playlist o álbum de Spotify sin descargarlas
+
+    Returns:
+        list: [{"url", "title"}] con una entrada por canción
+    """
+    return _run_request({
+        "action": "expand",
+        "url": url,
+        "format": audio_format,
+        "bitrate": bitrate,
+        "ffmpeg": ffmpeg,
+    }, None, timeout)["tracks"]
+
+def _run_request(request, on_progress, timeout):
+    with _slots:
+        engine = _acquire_engine()
+        try:
+            return engine.run(request, on_progress, timeout)
+        finally:
+            if engine.alive:
+                _idle.put(engine)
+            else:
+                _discard_engine(engine)
+
+@atexit.register
+def close_all():
+    """Termina todos los procesos de spotdl"""
+    with _engines_lock:
+        engines = list(_engines)
+    for engine in engines:
+        engine.close()
+
+def main():
+    """Punto de entrada del proceso de spotdl (python -m routes.spotdl_engine)"""
+    # stdout queda reservado para los mensajes; lo que imprima spotdl va a stderr
+    messages = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    send_lock = threading.Lock()
+
+    def send(kind, payload):
+        with send_lock:
+            messages.write(json.dumps([kind, payload]) + "\n")
+            messages.flush()
+
+    _engine_main(sys.stdin, send)
+
+if __name__ == "__main__":
+    main()
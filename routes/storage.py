@@ -0,0 +1,284 @@
+import os
+import time
+import shutil
+import sqlite3
+import threading
+import logging
+
+# Configuración del logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DOWNLOAD_FOLDER = os.path.join(BASE_DIR, "downloads")
+
+STORAGE_JANITOR_INTERVAL = int(os.getenv('STORAGE_JANITOR_INTERVAL', '60'))  # segundos
+USER_QUOTA_BYTES = int(os.getenv('USER_QUOTA_BYTES', str(1024 * 1024 * 1024)))  # 1 GB por usuario
+DOWNLOADS_MAX_BYTES = int(os.getenv('DOWNLOADS_MAX_BYTES', str(10 * 1024 * 1024 * 1024)))  # 10 GB en total
+USER_FILE_TTL = int(os.getenv('USER_FILE_TTL', str(24 * 60 * 60)))  # 24 horas
+MIN_FREE_BYTES = int(os.getenv('MIN_FREE_BYTES', str(512 * 1024 * 1024)))  # Espacio libre para admitir trabajos
+STALE_WORKDIR_AGE = 6 * 60 * 60  # Carpetas .job-* y temporales abandonados (más que cualquier trabajo)
+# Momento de entrega de cada archivo (fuera de DOWNLOAD_FOLDER: el janitor no lo trata como un temporal)
+STORAGE_INDEX_PATH = os.getenv('STORAGE_INDEX_PATH', os.path.join(BASE_DIR, "storage.sqlite3"))
+
+_usage = {}  # usuario -> bytes en su carpeta ("" = raíz de DOWNLOAD_FOLDER)
+_usage_lock = threading.Lock()
+_cleanup_requests = {}  # usuario -> momento hasta el que se vacía su carpeta
+_wake = threading.Event()
+_janitor_pid = None
+_janitor_lock = threading.Lock()
+
+class DeliveryIndex:
+    """Índice persistente (SQLite): ruta de un archivo de usuario -> momento de su entrega
+
+    Los archivos entregados desde la caché son hardlinks: comparten mtime y
+    ctime con la entrada de caché y con las copias de otros usuarios, y el
+    ctime cambia cada vez que se crea o se borra otro enlace del mismo inodo.
+    El TTL se cuenta desde la entrega registrada para cada ruta.
+    """
+
+    def __init__(self, path=STORAGE_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            self._conn = self._open()
+        except sqlite3.DatabaseError as e:
+            # Índice corrupto: se descarta; las rutas sin registro se datan al verlas
+            logger.error(f"[storage] Índice de entregas corrupto ({e}), reconstruyendo")
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
+            self._conn = self._open()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS deliveries (
+                path TEXT PRIMARY KEY,
+                delivered_at REAL NOT NULL
+            )
+        """)
+        conn.execute("PRAGMA quick_check").fetchone()
+        return conn
+
+    def record(self, path, delivered_at):
+        """Registra (o reinicia, si se entrega de nuevo) la entrega de una ruta"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO deliveries (path, delivered_at) VALUES (?, ?)",
+                (path, delivered_at)
+            )
+
+    def all(self):
+        """Diccionario ruta -> momento de entrega"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT path, delivered_at FROM deliveries").fetchall())
+
+    def forget(self, paths):
+        """Elimina las rutas que ya no existen"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM deliveries WHERE path = ?", [(path,) for path in paths])
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_delivery_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DeliveryIndex()
+    return _index
+
+def _owner(path):
+    """Usuario dueño de un archivo de DOWNLOAD_FOLDER ("" si está en la raíz)"""
+    folder = os.path.relpath(os.path.dirname(os.path.abspath(path)), DOWNLOAD_FOLDER)
+    return "" if folder == "." else folder.split(os.sep)[0]
+
+def _remove(path, reason):
+    try:
+        os.remove(path)
+        logger.info(f"[storage] Archivo eliminado ({reason}): {path}")
+        return True
+    except FileNotFoundError:
+        return True
+    except OSError as e:
+        logger.error(f"[storage] Error al eliminar {path}: {e}")
+        return False
+
+def _scan_folder(folder, now, deliveries):
+    """Archivos de una carpeta como (entregado, tamaño, ruta)
+
+    De paso elimina las carpetas de trabajo (.job-*) y los temporales que
+    quedaron abandonados por una caída. Un archivo sin entrega registrada
+    (anterior al índice, o entregado justo antes de una caída) se data ahora.
+    """
+    files = []
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return files
+    for entry in entries:
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        if entry.name.startswith("."):
+            if now - stat.st_mtime > STALE_WORKDIR_AGE:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    logger.info(f"[storage] Carpeta de trabajo abandonada eliminada: {entry.path}")
+                else:
+                    _remove(entry.path, "temporal abandonado")
+            continue
+        if entry.is_file(follow_symlinks=False):
+            delivered = deliveries.get(entry.path)
+            if delivered is None:
+                delivered = deliveries[entry.path] = now
+                get_delivery_index().record(entry.path, now)
+            files.append((delivered, stat.st_size, entry.path))
+    return files
+
+def enforce_storage_limits():
+    """Aplica las limpiezas pedidas, el TTL y las cuotas por usuario y global
+
+    Los tamaños son aparentes: un archivo enlazado desde la caché cuenta
+    entero aunque comparta los bloques con ella.
+
+    Returns:
+        dict: Bytes por usuario tras la limpieza
+    """
+    now = time.time()
+    with _usage_lock:
+        wipes = dict(_cleanup_requests)
+        _cleanup_requests.clear()
+
+    index = get_delivery_index()
+    deliveries = index.all()
+    known = set(deliveries)
+
+    folders = {"": DOWNLOAD_FOLDER}
+    for entry in os.scandir(DOWNLOAD_FOLDER):
+        if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."):
+            folders[entry.name] = entry.path
+
+    usage = {}
+    remaining = []
+    for user, folder in folders.items():
+        kept = []
+        for delivered, size, path in _scan_folder(folder, now, deliveries):
+            if user in wipes and delivered <= wipes[user]:
+                _remove(path, "sesión nueva")
+            elif now - delivered > USER_FILE_TTL:
+                _remove(path, "caducado")
+            else:
+                kept.append((delivered, size, path))
+
+        # Cuota del usuario: se eliminan sus archivos más antiguos
+        kept.sort()
+        total = sum(size for _, size, _ in kept)
+        while kept and total > USER_QUOTA_BYTES:
+            delivered, size, path = kept.pop(0)
+            if _remove(path, "cuota del usuario"):
+                total -= size
+        usage[user] = total
+        remaining.extend((delivered, size, path, user) for delivered, size, path in kept)
+
+    # Cuota global: los archivos más antiguos de cualquier usuario
+    total = sum(usage.values())
+    if total > DOWNLOADS_MAX_BYTES:
+        remaining.sort()
+        for delivered, size, path, user in remaining:
+            if total <= DOWNLOADS_MAX_BYTES:
+                break
+            if _remove(path, "cuota global"):
+                total -= size
+                usage[user] -= size
+
+    # Olvidar las rutas eliminadas (por esta pasada o fuera de la aplicación)
+    present = {path for _, _, path, _ in remaining if os.path.exists(path)}
+    index.forget((known | set(deliveries)) - present)
+
+    with _usage_lock:
+        _usage.clear()
+        _usage.update(usage)
+    return usage
+
+def _janitor_loop():
+    """Mantenimiento de las carpetas de descargas, fuera del ciclo de las peticiones"""
+    while True:
+        try:
+            enforce_storage_limits()
+        except Exception as e:
+            logger.error(f"[storage] Error en el janitor de descargas: {e}")
+        _wake.wait(STORAGE_JANITOR_INTERVAL)
+        _wake.clear()
+
+def start_janitor():
+    """Arranca el janitor una vez por proceso (también tras un fork de gunicorn)"""
+    global _janitor_pid
+    if _janitor_pid == os.getpid():
+        return
+    with _janitor_lock:
+        if _janitor_pid == os.getpid():
+            return
+        _janitor_pid = os.getpid()
+        threading.Thread(target=_janitor_loop, name="storage-janitor", daemon=True).start()
+
+def request_user_cleanup(session_user):
+    """Pide al janitor que vacíe la carpeta del usuario (login/logout)
+
+    Solo se eliminan los archivos entregados antes de la petición: lo que se
+    descargue mientras tanto se conserva.
+    """
+    if not session_user or 'username' not in session_user:
+        return
+    with _usage_lock:
+        _cleanup_requests[session_user['username']] = time.time()
+    _wake.set()
+
+def record_file(path):
+    """Registra la entrega de un archivo y lo suma al uso de su usuario
+
+    El uso es una estimación entre pasadas del janitor (que recalcula el uso
+    real); si supera una cuota, el janitor se adelanta.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return
+    try:
+        get_delivery_index().record(path, time.time())
+    except sqlite3.Error as e:
+        logger.error(f"[storage] No se pudo registrar la entrega de {path}: {e}")
+    user = _owner(path)
+    with _usage_lock:
+        _usage[user] = _usage.get(user, 0) + size
+        over_quota = _usage[user] > USER_QUOTA_BYTES or sum(_usage.values()) > DOWNLOADS_MAX_BYTES
+    if over_quota:
+        _wake.set()
+
+def get_storage_usage():
+    """Uso actual de las carpetas de descargas
+
+    Returns:
+        dict: {"users": {usuario: bytes}, "total": bytes}
+    """
+    with _usage_lock:
+        users = dict(_usage)
+    return {"users": users, "total": sum(users.values())}
+
+def check_free_space():
+    """Mensaje de error si no queda espacio para un trabajo nuevo, o None"""
+    try:
+        free = shutil.disk_usage(DOWNLOAD_FOLDER).free
+    except OSError as e:
+        logger.error(f"[storage] No se pudo comprobar el espacio libre: {e}")
+        return None
+    if free < MIN_FREE_BYTES:
+        logger.warning(f"[storage] Espacio libre insuficiente: {free} bytes")
+        _wake.set()
+        return "No hay espacio suficiente en el servidor. Inténtalo más tarde"
+    return None
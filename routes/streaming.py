@@ -0,0 +1,227 @@
+import os
+import zlib
+import hashlib
+import threading
+import subprocess
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from routes.cache import get_cache_entry_folder, register_cache_file
+
+# Configuración del logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+MAX_STREAMS = int(os.getenv('MAX_STREAMS', '4'))  # Transcodificaciones en directo a la vez
+STREAM_IO_TIMEOUT = 30  # Segundos sin datos del origen antes de abandonar
+STREAM_RETRY_AFTER = 10  # Segundos sugeridos al cliente cuando no hay hueco para otra transcodificación
+
+# Contenedores que se pueden reproducir mientras se escriben. Si el códec del
+# origen ya es el de salida, ffmpeg solo reempaqueta (-c:a copy).
+STREAM_FORMATS = {
+    "mp3": {
+        "ext": "mp3",
+        "mimetype": "audio/mpeg",
+        "muxer": ["-f", "mp3"],
+        "encoder": ["-c:a", "libmp3lame", "-b:a", "192k"],
+        "copy_codecs": ("mp3",),
+    },
+    "opus": {
+        "ext": "opus",
+        "mimetype": "audio/ogg",
+        "muxer": ["-f", "opus"],
+        "encoder": ["-c:a", "libopus", "-b:a", "160k"],
+        "copy_codecs": ("opus",),
+    },
+    # MP4 fragmentado: el índice va al principio y el navegador puede empezar a reproducir
+    "m4a": {
+        "ext": "m4a",
+        "mimetype": "audio/mp4",
+        "muxer": ["-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof"],
+        "encoder": ["-c:a", "aac", "-b:a", "192k"],
+        "copy_codecs": ("mp4a", "aac"),
+    },
+}
+
+_streams = {}
+_streams_lock = threading.Lock()
+stream_pool = ThreadPoolExecutor(max_workers=MAX_STREAMS)
+
+class StreamError(Exception):
+    """La transcodificación en directo falló"""
+    pass
+
+class StreamBusyError(StreamError):
+    """Ya hay MAX_STREAMS transcodificaciones en curso"""
+    pass
+
+class StreamTimeoutError(StreamError):
+    """La transcodificación sigue en curso pero aún no produjo datos"""
+    pass
+
+def build_ffmpeg_command(ffmpeg_path, media_format, metadata, spec):
+    """Comando de ffmpeg que lee el origen por HTTP y escribe el audio por stdout"""
+    command = [
+        ffmpeg_path, "-hide_banner", "-loglevel", "error", "-nostdin",
+        "-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5",
+        "-rw_timeout", str(STREAM_IO_TIMEOUT * 1_000_000),
+    ]
+    headers = media_format.get("http_headers") or {}
+    if headers:
+        command += ["-headers", "".join(f"{name}: {value}\r\n" for name, value in headers.items())]
+    command += ["-i", media_format["url"], "-vn", "-map_metadata", "-1"]
+    if metadata.get("title"):
+        command += ["-metadata", f"title={metadata['title']}"]
+    if metadata.get("uploader"):
+        command += ["-metadata", f"artist={metadata['uploader']}"]
+
+    acodec = (media_format.get("acodec") or "").lower()
+    if acodec.startswith(spec["copy_codecs"]):
+        command += ["-c:a", "copy"]
+    else:
+        command += spec["encoder"]
+    return command + spec["muxer"] + ["pipe:1"]
+
+class LiveTranscode:
+    """Transcodificación en curso cuyo resultado se lee mientras se escribe
+
+    Un único ffmpeg escribe en un archivo parcial dentro de la carpeta de la
+    entrada de caché; cada cliente lee ese archivo a medida que crece. Al
+    terminar, el archivo se renombra y se registra en la caché (con sus
+    digests, calculados durante la escritura). Si un cliente se desconecta, la
+    transcodificación sigue hasta completar la entrada de caché.
+    """
+
+    def __init__(self, cache_key, filename, command, mimetype):
+        self.cache_key = cache_key
+        self.mimetype = mimetype
+        self.command = command
+        self.entry_folder = get_cache_entry_folder(cache_key)
+        self.final_path = os.path.join(self.entry_folder, filename)
+        self.path = os.path.join(self.entry_folder, f".{filename}.{os.getpid()}.part")
+        self.size = 0
+        self.done = False
+        self.error = None
+        self._changed = threading.Condition()
+
+    def run(self):
+        """Ejecuta ffmpeg y copia su salida al archivo parcial (hilo del stream_pool)"""
+        crc = 0
+        sha256 = hashlib.sha256()
+        process = None
+        try:
+            os.makedirs(self.entry_folder, exist_ok=True)
+            process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            with open(self.path, "wb") as f:
+                while True:
+                    chunk = process.stdout.read1(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    f.flush()
+                    crc = zlib.crc32(chunk, crc)
+                    sha256.update(chunk)
+                    with self._changed:
+                        self.size += len(chunk)
+                        self._changed.notify_all()
+            stderr = process.stderr.read().decode(errors="replace").strip()
+            if process.wait() != 0 or not self.size:
+                raise StreamError(stderr or f"ffmpeg terminó con código {process.returncode}")
+
+            os.replace(self.path, self.final_path)
+            with self._changed:
+                self.path = self.final_path
+            register_cache_file(self.cache_key, self.final_path, (crc, sha256.hexdigest()))
+        except Exception as e:
+            logger.error(f"[stream] Error en la transcodificación de {self.cache_key}: {e}")
+            if process and process.poll() is None:
+                process.kill()
+            if os.path.exists(self.path) and self.path != self.final_path:
+                os.remove(self.path)
+            with self._changed:
+                self.error = str(e)
+        finally:
+            with self._changed:
+                self.done = True
+                self._changed.notify_all()
+            with _streams_lock:
+                if _streams.get(self.cache_key) is self:
+                    del _streams[self.cache_key]
+
+    def wait_for_data(self, timeout=None):
+        """Espera a que haya datos (o a que termine)
+
+        Raises:
+            StreamError: Si falló sin datos
+            StreamTimeoutError: Si no llegó nada antes de timeout (la transcodificación sigue)
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.size or self.done, timeout)
+            if self.error and not self.size:
+                raise StreamError(self.error)
+            if not self.size and not self.done:
+                raise StreamTimeoutError("El audio aún no está listo. Inténtalo más tarde")
+            return self.size
+
+    def iter_bytes(self):
+        """Generador con el audio desde el principio, siguiendo al escritor
+
+        El archivo se abre antes de devolver el generador, así que el error
+        llega antes de empezar la respuesta.
+
+        Raises:
+            StreamError: Si el archivo ya no existe (la transcodificación falló)
+        """
+        with self._changed:
+            # Abrir bajo el lock: el escritor puede estar renombrando el archivo
+            try:
+                f = open(self.path, "rb")
+            except OSError as e:
+                raise StreamError(self.error or f"No se pudo abrir el audio: {e}")
+        return self._follow(f)
+
+    def _follow(self, f):
+        position = 0
+        try:
+            while True:
+                with self._changed:
+                    self._changed.wait_for(lambda: self.size > position or self.done, STREAM_IO_TIMEOUT)
+                    available = self.size - position
+                    finished = self.done
+                while available > 0:
+                    chunk = f.read(min(CHUNK_SIZE, available))
+                    if not chunk:
+                        break
+                    position += len(chunk)
+                    available -= len(chunk)
+                    yield chunk
+                if finished and position >= self.size:
+                    return
+        finally:
+            f.close()
+
+def get_live_transcode(cache_key, filename, command, mimetype):
+    """Devuelve la transcodificación en curso para la clave o arranca una nueva
+
+    Los clientes que piden el mismo audio a la vez comparten un solo ffmpeg.
+    No se encolan transcodificaciones: una en cola no produciría datos a
+    tiempo para la petición que la pidió.
+
+    Raises:
+        StreamBusyError: Si ya hay MAX_STREAMS transcodificaciones en curso
+    """
+    with _streams_lock:
+        live = _streams.get(cache_key)
+        if live is None:
+            if len(_streams) >= MAX_STREAMS:
+                raise StreamBusyError("Demasiadas reproducciones en curso. Inténtalo más tarde")
+            live = _streams[cache_key] = LiveTranscode(cache_key, filename, command, mimetype)
+            stream_pool.submit(live.run)
+            logger.info(f"[stream] Transcodificación en directo iniciada: {cache_key}")
+    return live
+
+def get_stream_filename(metadata, spec):
+    """Nombre del archivo final, igual que el de las descargas (título.ext)"""
+    from yt_dlp.utils import sanitize_filename
+    title = sanitize_filename(metadata.get("title") or metadata["id"])
+    return f"{title}.{spec['ext']}"
@@ -0,0 +1,51 @@
+import os
+import subprocess
+import logging
+from functools import lru_cache
+from importlib import metadata
+
+# Configuración del logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _probe_ffmpeg(ffmpeg_path):
+    """Versión de ffmpeg o None si no está disponible"""
+    if not os.path.exists(ffmpeg_path):
+        return None
+    try:
+        result = subprocess.run(
+            [ffmpeg_path, "-version"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=10,
+            check=True
+        )
+        return result.stdout.splitlines()[0] if result.stdout else "desconocida"
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.error(f"[tools] ffmpeg no responde en {ffmpeg_path}: {e}")
+        return None
+
+def _probe_spotdl():
+    """Versión del paquete spotdl instalado o None (sin arrancar un intérprete)"""
+    try:
+        return metadata.version("spotdl")
+    except metadata.PackageNotFoundError:
+        return None
+
+@lru_cache(maxsize=None)
+def probe_tools(ffmpeg_path):
+    """Comprueba una sola vez qué herramientas externas están disponibles
+
+    El resultado se guarda para toda la vida del proceso: las peticiones ya no
+    lanzan `spotdl --version` ni `ffmpeg -version`.
+
+    Returns:
+        dict: {"ffmpeg": versión o None, "spotdl": versión o None}
+    """
+    tools = {
+        "ffmpeg": _probe_ffmpeg(ffmpeg_path),
+        "spotdl": _probe_spotdl(),
+    }
+    logger.info(f"[tools] Herramientas disponibles: {tools}")
+    return tools
@@ -0,0 +1,143 @@
+import os
+import atexit
+import functools
+import threading
+import logging
+from contextlib import contextmanager
+
+# Configuración del logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Número de trabajos tras el que se recicla una instancia (limita el crecimiento de su estado)
+YDL_MAX_JOBS = int(os.getenv('YDL_MAX_JOBS', '200'))
+
+# Estado por trabajo que YoutubeDL guarda en atributos privados y que reset()
+# limpia. Si una versión de yt-dlp no los tiene, cada instancia se usa para un
+# solo trabajo
+RESET_ATTRIBUTES = ("_download_retcode", "_num_downloads", "_printed_messages")
+
+_local = threading.local()
+_instances = []
+_instances_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def _warn_not_reusable(version):
+    logger.warning(f"[ydl_pool] yt-dlp {version} no tiene el estado que se limpia entre trabajos: "
+                   f"cada instancia de YoutubeDL se usará para un solo trabajo")
+
+def _dispatch_progress(d):
+    """Reenvía el progreso de descarga a los hooks del trabajo actual del hilo"""
+    hooks = getattr(_local, 'hooks', None)
+    if hooks:
+        hooks[0](d)
+
+def _dispatch_postprocessor(d):
+    """Reenvía el progreso de post-procesado a los hooks del trabajo actual del hilo"""
+    hooks = getattr(_local, 'hooks', None)
+    if hooks:
+        hooks[1](d)
+
+class _PooledYDL:
+    """Instancia de YoutubeDL de larga duración asociada a un hilo del pool"""
+
+    def __init__(self, key, opts):
+        opts = dict(opts)
+        opts["progress_hooks"] = [_dispatch_progress]
+        opts["postprocessor_hooks"] = [_dispatch_postprocessor]
+        self.key = key
+        self.jobs = 0
+        import yt_dlp  # Importación diferida: yt_dlp tarda en cargarse
+        self.ydl = yt_dlp.YoutubeDL(opts)
+        self.max_jobs = YDL_MAX_JOBS
+        if not all(hasattr(self.ydl, name) for name in RESET_ATTRIBUTES):
+            self.max_jobs = 1
+            _warn_not_reusable(yt_dlp.version.__version__)
+        with _instances_lock:
+            _instances.append(self)
+
+    def reset(self, folder):
+        """Deja la instancia lista para un nuevo trabajo"""
+        self.ydl.params["paths"] = {"home": folder} if folder else {}
+        if not self.jobs:
+            return  # Instancia nueva: no hay estado de trabajos anteriores
+        self.ydl._download_retcode = 0
+        self.ydl._num_downloads = 0
+        self.ydl._printed_messages.clear()
+
+    def close(self):
+        with _instances_lock:
+            if self in _instances:
+                _instances.remove(self)
+        try:
+            self.ydl.close()
+        except Exception as e:
+            logger.error(f"[ydl_pool] Error al cerrar instancia de YoutubeDL: {e}")
+
+def enable_pool():
+    """Activa el pool en el hilo actual
+
+    Se usa como initializer de los ThreadPoolExecutor de descargas: sus
+    hilos viven tanto como el proceso, así que hay como mucho una instancia
+    por hilo del executor y juego de opciones.
+    """
+    if getattr(_local, 'pool', None) is None:
+        _local.pool = {}
+
+@contextmanager
+def single_use_ydl(opts, folder=None, hooks=None):
+    """Instancia de YoutubeDL para un solo trabajo, cerrada al terminar"""
+    import yt_dlp
+    opts = dict(opts, paths={"home": folder} if folder else {})
+    if hooks:
+        opts["progress_hooks"] = [hooks[0]]
+        opts["postprocessor_hooks"] = [hooks[1]]
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        yield ydl
+
+@contextmanager
+def pooled_ydl(opts, folder=None, hooks=None):
+    """Presta una instancia de YoutubeDL del hilo actual para un trabajo
+
+    Cada hilo con el pool activado (ver enable_pool) conserva una instancia
+    por juego de opciones (p. ej. una por formato de entrega): los extractores
+    cargados, las cookies ya leídas y las conexiones keep-alive con los CDN se
+    reutilizan entre trabajos. Lo que cambia por trabajo (carpeta de salida y
+    hooks de progreso) se pasa aparte. En los demás hilos (p. ej. los de las
+    peticiones, uno nuevo por petición en un servidor con hilos) se usa una
+    instancia de un solo uso.
+
+    Args:
+        opts: Opciones base de yt-dlp (sin carpeta de salida ni hooks)
+        folder: Carpeta donde se escriben los archivos del trabajo
+        hooks: Tupla (progress_hook, postprocessor_hook) del trabajo o None
+    """
+    pool = getattr(_local, 'pool', None)
+    if pool is None:
+        with single_use_ydl(opts, folder, hooks) as ydl:
+            yield ydl
+        return
+
+    key = repr(sorted(opts.items()))
+    pooled = pool.get(key)
+    if pooled is None or pooled.jobs >= pooled.max_jobs:
+        if pooled is not None:
+            pooled.close()
+        pooled = pool[key] = _PooledYDL(key, opts)
+        logger.info(f"[ydl_pool] Nueva instancia de YoutubeDL para {threading.current_thread().name}")
+
+    pooled.reset(folder)
+    _local.hooks = hooks
+    try:
+        yield pooled.ydl
+    finally:
+        _local.hooks = None
+        pooled.jobs += 1
+
+@atexit.register
+def close_all():
+    """Cierra todas las instancias (guarda las cookies y libera las conexiones)"""
+    with _instances_lock:
+        instances = list(_instances)
+    for pooled in instances:
+        pooled.close()
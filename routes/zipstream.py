@@ -0,0 +1,162 @@
+import struct
+import time
+import zlib
+import logging
+
+# Configuración del logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF  # Tamaños y desplazamientos a partir de los que se usa ZIP64
+ZIP64_COUNT_LIMIT = 0xFFFF
+MARKER_32 = 0xFFFFFFFF  # Valor que indica "ver el campo extra ZIP64"
+MARKER_16 = 0xFFFF
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<IHHHHIIH")
+ZIP64_END_RECORD = struct.Struct("<IQHHIIQQQQ")
+ZIP64_LOCATOR = struct.Struct("<IIQI")
+
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+VERSION_MADE_BY = (3 << 8) | VERSION_ZIP64  # Unix
+FLAG_UTF8 = 0x800
+METHOD_STORED = 0
+EXTERNAL_ATTR = (0o100644 & 0xFFFF) << 16
+
+def file_crc32(path):
+    """CRC-32 de un archivo leído por bloques (memoria constante)"""
+    crc = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return crc
+            crc = zlib.crc32(chunk, crc)
+
+def _dos_datetime(timestamp):
+    """Fecha y hora en formato MS-DOS (el formato ZIP no admite fechas anteriores a 1980)"""
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+class ZipStream:
+    """Archivo ZIP generado al vuelo, sin archivos temporales
+
+    Las entradas se guardan sin comprimir (STORED): el audio ya está comprimido
+    y así el tamaño final se conoce antes de enviar el primer byte. Cada
+    entrada lleva su CRC en la cabecera local (sin data descriptor), lo que
+    la hace legible también para lectores en streaming; si no se conoce de
+    antemano, se calcula justo antes de enviar el archivo. Las extensiones
+    ZIP64 se usan solo cuando algún tamaño o desplazamiento lo requiere.
+
+    Args:
+        entries: Lista de dicts con "path", "name", "size", "mtime" y "crc"
+            (None si no se conoce)
+        on_crc: Función opcional que recibe (entrada, crc) cuando se calcula
+            un CRC, para guardarlo y no volver a leer el archivo
+    """
+
+    def __init__(self, entries, on_crc=None):
+        self.entries = entries
+        self.on_crc = on_crc
+        self.length = self._layout()
+
+    def __len__(self):
+        return self.length
+
+    def _layout(self):
+        """Calcula el desplazamiento de cada entrada y el tamaño total del ZIP"""
+        offset = 0
+        for entry in self.entries:
+            entry["offset"] = offset
+            offset += len(self._local_header(entry, 0)) + entry["size"]
+        self.central_offset = offset
+        self.central_size = sum(len(self._central_header(entry)) for entry in self.entries)
+        return offset + self.central_size + len(self._end_records())
+
+    def _local_header(self, entry, crc):
+        name = entry["name"].encode("utf-8")
+        size = entry["size"]
+        dos_time, dos_date = _dos_datetime(entry["mtime"])
+        extra = b""
+        version = VERSION_DEFAULT
+        if size >= ZIP64_LIMIT:
+            extra = struct.pack("<HHQQ", 0x0001, 16, size, size)
+            version = VERSION_ZIP64
+            size = MARKER_32
+        header = LOCAL_HEADER.pack(
+            0x04034b50, version, FLAG_UTF8, METHOD_STORED, dos_time, dos_date,
+            crc, size, size, len(name), len(extra)
+        )
+        return header + name + extra
+
+    def _central_header(self, entry):
+        name = entry["name"].encode("utf-8")
+        size = entry["size"]
+        offset = entry["offset"]
+        dos_time, dos_date = _dos_datetime(entry["mtime"])
+        fields = []
+        if size >= ZIP64_LIMIT:
+            fields += [size, size]
+            size = MARKER_32
+        if offset >= ZIP64_LIMIT:
+            fields.append(offset)
+            offset = MARKER_32
+        extra = b""
+        version = VERSION_DEFAULT
+        if fields:
+            extra = struct.pack(f"<HH{len(fields)}Q", 0x0001, 8 * len(fields), *fields)
+            version = VERSION_ZIP64
+        header = CENTRAL_HEADER.pack(
+            0x02014b50, VERSION_MADE_BY, version, FLAG_UTF8, METHOD_STORED, dos_time, dos_date,
+            entry.get("crc") or 0, size, size, len(name), len(extra), 0, 0, 0, EXTERNAL_ATTR, offset
+        )
+        return header + name + extra
+
+    def _end_records(self):
+        count = len(self.entries)
+        cd_size = self.central_size
+        cd_offset = self.central_offset
+        records = b""
+        if count >= ZIP64_COUNT_LIMIT or cd_size >= ZIP64_LIMIT or cd_offset >= ZIP64_LIMIT:
+            zip64_offset = cd_offset + cd_size
+            records += ZIP64_END_RECORD.pack(
+                0x06064b50, ZIP64_END_RECORD.size - 12, VERSION_MADE_BY, VERSION_ZIP64,
+                0, 0, count, count, cd_size, cd_offset
+            )
+            records += ZIP64_LOCATOR.pack(0x07064b50, 0, zip64_offset, 1)
+            count = min(count, MARKER_16)
+            cd_size = min(cd_size, MARKER_32)
+            cd_offset = min(cd_offset, MARKER_32)
+        return records + END_RECORD.pack(0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0)
+
+    def _read_file(self, entry):
+        """Envía exactamente entry["size"] bytes del archivo"""
+        remaining = entry["size"]
+        with open(entry["path"], "rb") as f:
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise IOError(f"El archivo cambió de tamaño durante el envío: {entry['path']}")
+                remaining -= len(chunk)
+                yield chunk
+
+    def __iter__(self):
+        for entry in self.entries:
+            if entry.get("crc") is None:
+                entry["crc"] = file_crc32(entry["path"])
+                if self.on_crc:
+                    self.on_crc(entry, entry["crc"])
+            yield self._local_header(entry, entry["crc"])
+            yield from self._read_file(entry)
+
+        for entry in self.entries:
+            yield self._central_header(entry)
+        yield self._end_records()
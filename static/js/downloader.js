@@ -1,5 +1,88 @@
-function descargar_spdl() {
-    let url = document.getElementById("spotify-url").value;
+const JOB_POLL_INTERVAL = 1500;
+
+const PHASE_LABELS = {
+    queued: "⏳ Waiting in queue...",
+    resolve: "🔎 Looking up the track...",
+    fetch: "⏳ Downloading...",
+    transcode: "🎛️ Converting audio...",
+    metadata: "🏷️ Writing tags...",
+    thumbnail: "🖼️ Embedding cover art..."
+};
+
+function formatear_bytes(bytes) {
+    if (!bytes) {
+        return "0 MB";
+    }
+    return (bytes / (1024 * 1024)).toFixed(1) + " MB";
+}
+
+function texto_progreso(progress) {
+    // Playlist: progreso por canciones
+    if (progress.total) {
+        let text = "⏳ Downloading playlist: " + progress.completed + " / " + progress.total + " tracks";
+        if (progress.failed) {
+            text += " (" + progress.failed + " failed)";
+        }
+        return text;
+    }
+
+    let text = PHASE_LABELS[progress.phase] || PHASE_LABELS.fetch;
+    if (progress.phase === "fetch" && progress.downloaded_bytes) {
+        text += " " + formatear_bytes(progress.downloaded_bytes);
+        if (progress.total_bytes) {
+            let percent = Math.min(100, Math.round(progress.downloaded_bytes * 100 / progress.total_bytes));
+            text += " / " + formatear_bytes(progress.total_bytes) + " (" + percent + "%)";
+        }
+        if (progress.speed) {
+            text += " · " + formatear_bytes(progress.speed) + "/s";
+        }
+        if (progress.eta) {
+            text += " · " + progress.eta + "s left";
+        }
+    }
+    return text;
+}
+
+function seguir_trabajo(job, status) {
+    // Sin soporte de Server-Sent Events: consultar el estado periódicamente
+    if (!window.EventSource) {
+        return esperar_trabajo(job.status_url);
+    }
+
+    return new Promise((resolve, reject) => {
+        let source = new EventSource(job.events_url);
+        source.onmessage = event => {
+            let data = JSON.parse(event.data);
+            if (data.status === "success" || data.status === "failed") {
+                source.close();
+                resolve(data);
+                return;
+            }
+            status.textContent = texto_progreso(data.progress || {});
+        };
+        source.onerror = () => {
+            // Si se corta el stream, seguir consultando el estado del trabajo
+            source.close();
+            esperar_trabajo(job.status_url).then(resolve, reject);
+        };
+    });
+}
+
+function esperar_trabajo(statusUrl) {
+    return fetch(statusUrl)
+    .then(response => response.json())
+    .then(data => {
+        if (data.status === "success" || data.status === "failed" || data.error) {
+            return data;
+        }
+        return new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL))
+            .then(() => esperar_trabajo(statusUrl));
+    });
+}
+
+function iniciar_descarga(endpoint, inputId, formatId) {
+    let url = document.getElementById(inputId).value;
+    let formatSelect = document.getElementById(formatId);
     let status = document.getElementById("status");
     let link = document.getElementById("descargar-link");
     let carpeta = document.getElementById("descargas");
@@ -13,22 +96,37 @@ function descargar_spdl() {
     status.style.display = "block";
     status.textContent = "⏳ Downloading...";
 
-    fetch("/download-spdl", {
+    fetch(endpoint, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ url: url })
+        body: JSON.stringify({ url: url, format: formatSelect ? formatSelect.value : undefined })
     })
     .then(response => response.json())
+    .then(data => {
+        // La descarga se procesa en segundo plano: consultar el trabajo hasta que termine
+        if (data.job_id && !data.error) {
+            return seguir_trabajo(data, status);
+        }
+        return data;
+    })
     .then(data => {
         if (data.error) {
             throw new Error(data.error);
         }
-        
-        status.textContent = "✅ Download completed.";
+
         carpeta.style.display = "flex";
-        
-        link.href = "/descargar";
-        link.download = "song.mp3";
+
+        if (data.tracks) {
+            status.textContent = "✅ Playlist: " + data.completed + " of " + data.tracks.length + " tracks downloaded.";
+            link.href = data.file_url;
+            link.download = "";
+            return;
+        }
+
+        status.textContent = "✅ Download completed.";
+        // Enlace al archivo exacto de este trabajo (no al último descargado)
+        link.href = data.file_url || "/descargar";
+        link.download = data.filename || "";
     })
     .catch(error => {
         status.textContent = "❌ Error: " + error.message;
@@ -36,40 +134,34 @@ function descargar_spdl() {
     });
 }
 
+function descargar_spdl() {
+    iniciar_descarga("/download-spdl", "spotify-url", "spotify-format");
+}
+
 function descargar_ypdl() {
+    iniciar_descarga("/download-ytdl", "ypdl-url", "ypdl-format");
+}
+
+function reproducir_ypdl() {
     let url = document.getElementById("ypdl-url").value;
+    let format = document.getElementById("ypdl-format").value;
     let status = document.getElementById("status");
-    let link = document.getElementById("descargar-link");
-    let carpeta = document.getElementById("descargas");
+    let player = document.getElementById("ypdl-player");
 
+    status.style.display = "block";
     if (!url) {
-        status.style.display = "block";
         status.textContent = "⚠️ Enter a valid link";
         return;
     }
+    if (format === "best") {
+        format = "opus";
+    }
 
-    status.style.display = "block";
-    status.textContent = "⏳ Downloading...";
-
-    fetch("/download-ytdl", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ url: url })
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data.error) {
-            throw new Error(data.error);
-        }
-        
-        status.textContent = "✅ Download completed.";
-        carpeta.style.display = "flex";
-        
-        link.href = "/descargar";
-        link.download = "song.mp3";
-    })
-    .catch(error => {
-        status.textContent = "❌ Error: " + error.message;
-        console.error(error);
-    });
-}
\ No newline at end of file
+    // El audio empieza a sonar mientras el servidor todavía lo convierte
+    status.textContent = "🎧 Starting playback...";
+    player.style.display = "block";
+    player.onplaying = () => { status.textContent = "▶️ Playing."; };
+    player.onerror = () => { status.textContent = "❌ Error: The audio could not be played"; };
+    player.src = "/stream?" + new URLSearchParams({ url: url, format: format });
+    player.play().catch(error => console.error(error));
+}